@@ -1,7 +1,12 @@
 import os
+import copy
+import shutil
+import gc
+import pickle
 
 import pytest
 import numpy as np
+import fabio
 
 raw_path = os.path.abspath(os.path.join('.', __file__, '..', '..'))
 if raw_path not in os.sys.path:
@@ -9,6 +14,10 @@ if raw_path not in os.sys.path:
 
 import bioxtasraw.RAWAPI as raw
 import bioxtasraw.RAWSettings as RAWSettings
+import bioxtasraw.SASFileIO as SASFileIO
+import bioxtasraw.SASImage as SASImage
+import bioxtasraw.SASParser as SASParser
+import bioxtasraw.SASProc as SASProc
 import bioxtasraw.SASM as SASM
 import bioxtasraw.SECM as SECM
 
@@ -766,6 +775,48 @@ def test_load_settings_saxslab():
     assert settings.get('denssNCSAxis') == 1
     assert settings.get('denssRefine')
 
+@pytest.mark.new
+def test_load_settings_cached(tmp_path):
+    filename = os.path.join(str(tmp_path), 'settings.cfg')
+    shutil.copy(os.path.join('.', 'data', 'settings_old.cfg'), filename)
+
+    ref_settings = raw.load_settings(filename)
+
+    RAWSettings.clearSettingsCache()
+
+    settings = RAWSettings.RawGuiSettings()
+    RAWSettings.loadSettingsCached(settings, filename)
+
+    mask = settings.get('Masks')['BeamStopMask'][0]
+
+    assert np.all(mask == ref_settings.get('Masks')['BeamStopMask'][0])
+    assert settings.get('SampleDistance') == ref_settings.get('SampleDistance')
+
+    settings.set('SampleDistance', 1)
+    settings.get('Masks')['BeamStopMask'][0] = None
+
+    RAWSettings.loadSettingsCached(settings, filename)
+
+    assert settings.get('Masks')['BeamStopMask'][0] is mask
+    assert settings.get('SampleDistance') == ref_settings.get('SampleDistance')
+
+    # Nested values aren't shared between settings loaded from the cache
+    settings.get('NormalizationList')[0][0] = '*'
+
+    settings2 = RAWSettings.RawGuiSettings()
+    RAWSettings.loadSettingsCached(settings2, filename)
+
+    assert (settings2.get('NormalizationList')
+        == ref_settings.get('NormalizationList'))
+
+    mtime = os.stat(filename).st_mtime
+    os.utime(filename, (mtime+10, mtime+10))
+
+    RAWSettings.loadSettingsCached(settings, filename)
+
+    assert settings.get('Masks')['BeamStopMask'][0] is not mask
+    assert np.all(settings.get('Masks')['BeamStopMask'][0] == mask)
+
 def test_load_profile_without_settings():
     filenames = [os.path.join('.', 'data', 'glucose_isomerase.dat')]
     profiles = raw.load_profiles(filenames)
@@ -1339,6 +1390,107 @@ def test_load_series_new_from_images_with_settings(old_settings):
     assert len(secm.use_baseline_subtracted_sasm) == 0
     assert secm.total_i_bcsub.sum() == 0
 
+@pytest.mark.new
+def test_load_series_lazy(tmp_path):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+    raw.set_buffer_range(series, [[18, 53]])
+
+    raw.save_series(series, 'lazy_series.hdf5', str(tmp_path))
+    filename = os.path.join(str(tmp_path), 'lazy_series.hdf5')
+
+    ref_series = raw.load_series([filename])[0]
+    series = raw.load_series([filename], lazy=True)[0]
+
+    assert isinstance(series._sasm_list, SASFileIO.LazySasmList)
+    assert np.allclose(series.total_i, ref_series.total_i)
+    assert np.allclose(series.total_i_sub, ref_series.total_i_sub)
+    assert np.all(series.getRg()[0] == ref_series.getRg()[0])
+    assert len(series._sasm_list._cache) == 0
+
+    profile = series.getSASM(10, 'sub')
+    ref_profile = ref_series.getSASM(10, 'sub')
+
+    assert np.all(profile.getI() == ref_profile.getI())
+    assert profile.getAllParameters() == ref_profile.getAllParameters()
+    assert profile is series.getSASMList(8, 12, 'sub')[2]
+
+    profiles = series.getSASMList(0, len(series.getAllSASMs())-1)
+
+    assert len(profiles) == len(ref_series.getAllSASMs())
+    assert np.all(profiles[-1].getI() == ref_series.getSASM(-1).getI())
+    assert len(series._sasm_list._cache) <= series._sasm_list.cache_size
+
+    copy_series = copy.deepcopy(series)
+    assert isinstance(copy_series._sasm_list, list)
+
+    # Modifying the series loads all of the profiles
+    series.scale(2.)
+    assert isinstance(series._sasm_list, list)
+    assert np.allclose(series.getSASM(0).getI(), 2*ref_series.getSASM(0).getI())
+
+@pytest.mark.new
+def test_load_series_lazy_changed_profiles(tmp_path):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    raw.save_series(series, 'lazy_series.hdf5', str(tmp_path))
+    filename = os.path.join(str(tmp_path), 'lazy_series.hdf5')
+
+    series = raw.load_series([filename], lazy=True)[0]
+    sasm_list = series._sasm_list
+    sasm_list.cache_size = 2
+
+    series.getSASM(5).setQrange((10, 200))
+    series.getSASM(6).setParameter('test', 1)
+    ref_i = series.getSASM(7).getI().copy()
+
+    # Changed profiles are kept when they leave the cache
+    series.getSASMList(20, 30)
+    gc.collect()
+
+    assert tuple(series.getSASM(5).getQrange()) == (10, 200)
+    assert series.getSASM(6).getParameter('test') == 1
+    assert 7 not in sasm_list._refs
+    assert np.all(series.getSASM(7).getI() == ref_i)
+
+    # Copies are regular profiles
+    profile = series.getSASM(5)
+
+    assert type(copy.copy(profile)) is SASM.SASM
+    assert type(copy.deepcopy(profile)) is SASM.SASM
+
+    new_profile = pickle.loads(pickle.dumps(profile))
+
+    assert type(new_profile) is SASM.SASM
+    assert tuple(new_profile.getQrange()) == (10, 200)
+    assert np.all(new_profile.getI() == profile.getI())
+
+@pytest.mark.new
+def test_load_series_lazy_save_same_file(tmp_path):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    raw.save_series(series, 'lazy_series.hdf5', str(tmp_path))
+    filename = os.path.join(str(tmp_path), 'lazy_series.hdf5')
+
+    series = raw.load_series([filename], lazy=True)[0]
+    other_series = raw.load_series([filename], lazy=True)[0]
+
+    ref_i = series.getSASM(5).getI().copy()
+
+    # The file isn't held open, so the series can be saved over it
+    raw.save_series(series, 'lazy_series.hdf5', str(tmp_path))
+
+    new_series = raw.load_series([filename])[0]
+
+    assert np.all(new_series.getSASM(5).getI() == ref_i)
+    assert np.allclose(new_series.total_i, series.total_i)
+
+    # Lazy lists of the old file don't read the new one
+    with pytest.raises(IOError):
+        other_series.getSASM(5)
+
 def test_load_series_sasbdb_keywords():
     filenames = [os.path.join('.', 'data', 'series_with_sasbdb_keywords.hdf5')]
 
@@ -1465,6 +1617,71 @@ def test_load_and_integrate_images(old_settings):
     assert params['imageHeader']['Gain_setting'] == "mid gain (vrf = -0.200)"
     assert 'calibration_params' in params
 
+@pytest.mark.new
+def test_load_images_32bit_tiff():
+    settings = raw.load_settings(os.path.join('.', 'data', 'settings_old.cfg'))
+    settings.set('ImageFormat', '32 bit TIF')
+    settings.set('DetectorFlipLR', False)
+    settings.set('DetectorFlipUD', False)
+
+    filenames = [os.path.join('.', 'data', 'GI2_A9_19_001_0000.tiff')]
+
+    img_list, img_hdr_list = raw.load_images(filenames, settings)
+
+    from PIL import Image
+
+    with Image.open(filenames[0]) as im:
+        ref_img = np.reshape(np.frombuffer(im.tobytes(), np.uint32), im.size)
+
+    assert len(img_list) == 1
+    assert np.all(img_list[0] == ref_img)
+
+    # Images are read into memory unless memory mapping is turned on
+    assert not isinstance(img_list[0].base, np.memmap)
+
+    settings.set('MemmapImages', True)
+
+    img_list, img_hdr_list = raw.load_images(filenames, settings)
+
+    assert isinstance(img_list[0].base, np.memmap)
+    assert np.all(img_list[0] == ref_img)
+
+    img_list[0][0, 0] = ref_img[0, 0] + 1
+
+    img_list, img_hdr_list = raw.load_images(filenames, settings)
+
+    assert np.all(img_list[0] == ref_img)
+
+@pytest.mark.new
+def test_load_and_integrate_images_n_proc(old_settings):
+    filenames = [os.path.join('.', 'data', 'GI2_A9_19_001_0000.tiff')]*3
+
+    profile_list, img_list = raw.load_and_integrate_images(filenames,
+        old_settings)
+    mp_profile_list, mp_img_list = raw.load_and_integrate_images(filenames,
+        old_settings, n_proc=2)
+
+    assert len(mp_profile_list) == len(profile_list) == 3
+    assert len(mp_img_list) == len(img_list) == 1
+    assert np.all(mp_img_list[0] == img_list[0])
+
+    for sasm, mp_sasm in zip(profile_list, mp_profile_list):
+        assert sasm.getParameter('filename') == mp_sasm.getParameter('filename')
+        assert np.allclose(sasm.getI(), mp_sasm.getI())
+        assert np.allclose(sasm.getErr(), mp_sasm.getErr())
+
+    pool = raw.make_load_pool(old_settings, 2)
+
+    try:
+        pool_profile_list, _ = raw.load_and_integrate_images(filenames,
+            old_settings, pool=pool)
+    finally:
+        pool.close()
+        pool.join()
+
+    assert len(pool_profile_list) == 3
+    assert np.allclose(pool_profile_list[0].getI(), profile_list[0].getI())
+
 def test_load_and_integrate_images_saxslab(saxslab_settings):
     filenames = [os.path.join('.', 'data', 'saxslab_image.tiff')]
 
@@ -1558,6 +1775,340 @@ def test_load_integrate_images_biocat_eiger(settings_biocat_eiger):
     assert params2['counters']['Experiment_type'] == 'SEC-SAXS'
     assert 'calibration_params' in params2
 
+@pytest.mark.new
+def test_counter_file_index(tmp_path):
+    filename = os.path.join(str(tmp_path), 'scans')
+
+    with open(filename, 'w') as f:
+        f.write('#F scans\n#S 1 scan\n#D Mon\n#L a b\n1 2\n#S 2 scan\n#D Tue\n')
+
+    lines, start_idx, date_idx, label_idx = SASFileIO.readSpecScan(filename, 2)
+
+    assert len(lines) == 7
+    assert start_idx == 5
+    assert date_idx == 6
+    assert label_idx is None
+
+    with open(filename, 'a') as f:
+        f.write('#L c d\n3 4\n5')
+
+    lines, start_idx, date_idx, label_idx = SASFileIO.readSpecScan(filename, 2)
+
+    with open(filename, 'r') as f:
+        assert lines == f.readlines()
+
+    assert start_idx == 5
+    assert date_idx == 6
+    assert label_idx == 7
+    assert lines[-1] == '5'
+
+    with open(filename, 'w') as f:
+        f.write('#S 3 scan\n')
+
+    lines, start_idx, date_idx, label_idx = SASFileIO.readSpecScan(filename, 2)
+
+    assert lines == ['#S 3 scan\n']
+    assert start_idx is None
+
+@pytest.mark.new
+def test_load_integrate_images_eiger_chunks(settings_biocat_eiger):
+    filename = os.path.join('.', 'data', 'vac_007_data_000001.h5')
+
+    chunk_profiles, _ = SASFileIO.loadImageFile(filename, settings_biocat_eiger,
+        fabio.open(filename), return_all_images=False, chunk_size=1)
+    stack_profiles, _ = SASFileIO.loadImageFile(filename, settings_biocat_eiger,
+        fabio.open(filename), return_all_images=False)
+
+    assert len(chunk_profiles) == len(stack_profiles) == 2
+
+    for sasm1, sasm2 in zip(chunk_profiles, stack_profiles):
+        assert sasm1.getParameter('filename') == sasm2.getParameter('filename')
+        assert np.allclose(sasm1.getQ(), sasm2.getQ())
+        assert np.allclose(sasm1.getI(), sasm2.getI())
+        assert np.allclose(sasm1.getErr(), sasm2.getErr())
+        assert (sasm1.getParameter('counters')['I0']
+            == sasm2.getParameter('counters')['I0'])
+
+@pytest.mark.new
+@pytest.mark.parametrize('method', ['nosplit_csr', 'raw_csr'])
+def test_integration_plan_corrections(method):
+    shape = (195, 487)
+
+    rng = np.random.default_rng(0)
+    img = rng.poisson(100, shape).astype(np.int32)
+    flat = rng.uniform(0.9, 1.1, shape)
+    dark = rng.uniform(0, 2, shape)
+    mask = np.zeros(shape, dtype=bool)
+    mask[90:100, :] = True
+
+    plan = SASImage.IntegrationPlan(shape, 1500., 240., 100., 0., 0., 172.,
+        172., 1.0, 'Linear', 1, mask, True, 0.99, method, 'q_A^-1',
+        'poisson', flat, dark, False, 5, 5)
+
+    # Corrections passed separately to pyFAI, as RAW used to
+    ref = plan.ai.integrate1d(img, plan.npts, mask=mask, correctSolidAngle=True,
+        error_model='poisson', unit='q_A^-1', radial_range=plan.q_range,
+        method='nosplit_csr', polarization_factor=0.99, flat=flat, dark=dark,
+        normalization_factor=2.)
+
+    if plan.csr_integrator is not None:
+        q, iq, err = plan.csr_integrator.integrate(img, 2.)
+    else:
+        q, iq, err = plan.ai.integrate1d(img, plan.npts, normalization_factor=2.,
+            **plan.integration_kwargs)
+
+    assert plan.integration_kwargs['flat'].dtype == np.float32
+    assert np.allclose(ref.radial, q)
+    assert np.allclose(ref.intensity, iq, rtol=1e-5)
+    assert np.allclose(ref.sigma, err, rtol=1e-5)
+
+@pytest.mark.new
+def test_integration_plan_cache_array_identity():
+    shape = (195, 487)
+
+    rng = np.random.default_rng(0)
+    img = rng.poisson(100, shape).astype(np.int32)
+    mask = np.zeros(shape, dtype=bool)
+
+    plan_kwargs = {'img_shape': shape, 'sd_distance': 1500., 'x_c': 240.,
+        'y_c': 100., 'det_tilt': 0., 'det_tilt_plan_rot': 0.,
+        'pixel_size_x': 172., 'pixel_size_y': 172., 'wavelength': 1.0,
+        'bin_type': 'Linear', 'bin_size': 1, 'mask': mask,
+        'do_solidangle': True, 'polarization_factor': 0.99,
+        'integration_method': 'raw_csr', 'angular_unit': 'q_A^-1',
+        'error_model': 'poisson', 'flatfield_image': np.ones(shape),
+        'dark_image': None, 'zinger_removal': False, 'zinger_thres': 5,
+        'zinger_iter': 5}
+
+    SASImage.clearIntegrationPlanCache()
+
+    plan1 = SASImage.getIntegrationPlan(**plan_kwargs)
+
+    assert SASImage.getIntegrationPlan(**plan_kwargs) is plan1
+
+    # A new flatfield that gets the id of a freed one, simulated by caching
+    # the old plan under the key of the new flatfield, doesn't get the old plan
+    flat = np.full(shape, 2.)
+    new_kwargs = dict(plan_kwargs, flatfield_image=flat)
+
+    key = tuple((name, id(value)) if isinstance(value, np.ndarray)
+        else (name, value) for name, value in sorted(new_kwargs.items()))
+    SASImage._integration_plans[key] = ([mask, np.ones(shape)], plan1)
+
+    plan2 = SASImage.getIntegrationPlan(**new_kwargs)
+
+    assert plan2 is not plan1
+
+    q1, i1, _ = plan1.csr_integrator.integrate(img, 1.)
+    q2, i2, _ = plan2.csr_integrator.integrate(img, 1.)
+
+    assert np.allclose(i1, 2*i2)
+
+    SASImage.clearIntegrationPlanCache()
+
+@pytest.mark.new
+def test_integration_plan_cache_invalidation():
+    settings = raw.load_settings(os.path.join('.', 'data', 'settings_old.cfg'))
+    filenames = [os.path.join('.', 'data', 'GI2_A9_19_001_0000.tiff')]
+
+    counters = raw.load_counter_values(filenames, settings)[0]
+
+    img, img_hdr = raw.load_images(filenames, settings)
+    img = img[0]
+    img_hdr = img_hdr[0]
+
+    profile1 = raw.integrate_image(img, settings, 'test_image', img_hdr,
+        counters, filenames[0])
+
+    assert len(SASImage._integration_plans) > 0
+
+    flat = np.ones(img.shape)
+
+    settings.set('NormFlatfieldImage', flat)
+    settings.set('NormFlatfieldEnabled', True)
+
+    assert len(SASImage._integration_plans) == 0
+
+    profile2 = raw.integrate_image(img, settings, 'test_image', img_hdr,
+        counters, filenames[0])
+
+    assert np.allclose(profile1.getI(), profile2.getI())
+
+    # Modifying the flatfield in place and setting it again gives a new plan
+    flat *= 2
+    settings.set('NormFlatfieldImage', flat)
+
+    profile3 = raw.integrate_image(img, settings, 'test_image', img_hdr,
+        counters, filenames[0])
+
+    assert np.allclose(profile1.getI(), 2*profile3.getI())
+
+@pytest.mark.new
+@pytest.mark.parametrize('error_model,use_img_var', [('poisson', False),
+    ('azimuthal', False), ('poisson', True)])
+def test_integrate_image_raw_csr(error_model, use_img_var):
+    filenames = [os.path.join('.', 'data', 'GI2_A9_19_001_0000.tiff')]
+
+    profiles = {}
+
+    for method in ['nosplit_csr', 'raw_csr']:
+        settings = raw.load_settings(os.path.join('.', 'data', 'settings_old.cfg'))
+        settings.set('IntegrationMethod', method)
+        settings.set('ErrorModel', error_model)
+        settings.set('UseImageForVariance', use_img_var)
+
+        counters = raw.load_counter_values(filenames, settings)[0]
+
+        img, img_hdr = raw.load_images(filenames, settings)
+
+        profiles[method] = raw.integrate_image(img[0], settings, 'test_image',
+            img_hdr[0], counters, filenames[0])
+
+    profile1 = profiles['nosplit_csr']
+    profile2 = profiles['raw_csr']
+
+    assert np.allclose(profile1.getQ(), profile2.getQ())
+    assert np.allclose(profile1.getI(), profile2.getI(), rtol=1e-5)
+    assert np.allclose(profile1.getErr(), profile2.getErr(), rtol=1e-5)
+
+@pytest.mark.new
+def test_load_integrate_images_eiger_raw_csr():
+    filename = os.path.join('.', 'data', 'vac_007_data_000001.h5')
+
+    profiles = {}
+
+    for method in ['nosplit_csr', 'raw_csr']:
+        settings = raw.load_settings(os.path.join('.', 'data',
+            'settings_biocat_eiger.cfg'))
+        settings.set('IntegrationMethod', method)
+
+        profiles[method], _ = SASFileIO.loadImageFile(filename, settings,
+            fabio.open(filename), return_all_images=False)
+
+    for sasm1, sasm2 in zip(profiles['nosplit_csr'], profiles['raw_csr']):
+        assert np.allclose(sasm1.getQ(), sasm2.getQ())
+        assert np.allclose(sasm1.getI(), sasm2.getI(), rtol=1e-5)
+        assert np.allclose(sasm1.getErr(), sasm2.getErr(), rtol=1e-5)
+
+@pytest.mark.new
+@pytest.mark.slow
+def test_integrate_raw_csr_large_stack():
+    shape = (1679, 1475)
+    n_frames = 32
+
+    rng = np.random.default_rng(0)
+    imgs = rng.poisson(100, (n_frames,)+shape).astype(np.int32)
+    mask = np.zeros(shape, dtype=bool)
+    mask[800:900, :] = True
+
+    plan = SASImage.IntegrationPlan(shape, 3000., 700., 900., 0., 0., 172.,
+        172., 1.0, 'Linear', 1, mask, True, None, 'raw_csr', 'q_A^-1',
+        'poisson', None, None, False, 3, 5)
+
+    ai = plan.ai
+    kwargs = dict(plan.integration_kwargs)
+
+    kwargs['method'] = 'nosplit_csr'
+
+    ref = [ai.integrate1d(img, plan.npts, **kwargs) for img in imgs]
+
+    results = [plan.csr_integrator.integrate(img) for img in imgs]
+
+    q, iq, err = plan.csr_integrator.integrateStack(imgs, np.ones(n_frames))
+
+    for i in range(n_frames):
+        assert np.allclose(ref[i].intensity, results[i][1], rtol=1e-5)
+        assert np.allclose(ref[i].intensity, iq[i], rtol=1e-5)
+        assert np.allclose(ref[i].sigma, err[i], rtol=1e-5)
+
+@pytest.mark.new
+def test_remove_zingers_image_stack():
+    rng = np.random.default_rng(0)
+    imgs = rng.poisson(50, (20, 64, 48)).astype(np.int32)
+
+    zingers = [(3, 10, 20), (3, 11, 20), (12, 40, 5), (19, 0, 0)]
+
+    zinger_imgs = imgs.copy()
+    for frame, y, x in zingers:
+        zinger_imgs[frame, y, x] += 10000
+
+    cleaned = SASImage.removeZingersImageStack(zinger_imgs, 2, 5.0,
+        chunk_size=1000)
+
+    assert cleaned.dtype == imgs.dtype
+    assert np.all(zinger_imgs[3, 10, 20] == imgs[3, 10, 20] + 10000)
+
+    for frame, y, x in zingers:
+        assert abs(cleaned[frame, y, x] - imgs[frame, y, x]) < 50
+
+    # Only a few poisson outliers besides the zingers should be changed
+    assert (cleaned != imgs).sum() < 20
+
+    median = SASProc.temporalMedian(zinger_imgs, 2)
+    ref_zingers = zinger_imgs - median > 5.0*np.sqrt(np.maximum(median, 1))
+
+    assert np.all((cleaned != zinger_imgs) == ref_zingers)
+    assert np.all(cleaned[ref_zingers] == np.rint(median[ref_zingers]))
+
+@pytest.mark.new
+def test_load_integrate_images_eiger_stack_zingers():
+    filename = os.path.join('.', 'data', 'vac_007_data_000001.h5')
+
+    settings = raw.load_settings(os.path.join('.', 'data',
+        'settings_biocat_eiger.cfg'))
+
+    profiles, _ = SASFileIO.loadImageFile(filename, settings,
+        fabio.open(filename), return_all_images=False)
+
+    settings.set('ZingerRemovalStack', True)
+    settings.set('ZingerRemovalStackWindow', 1)
+
+    zinger_profiles, _ = SASFileIO.loadImageFile(filename, settings,
+        fabio.open(filename), return_all_images=False)
+
+    assert len(profiles) == len(zinger_profiles) == 2
+
+    # Only the few q points with zingers are changed
+    for sasm1, sasm2 in zip(profiles, zinger_profiles):
+        assert np.allclose(sasm1.getQ(), sasm2.getQ())
+        assert (sasm1.getI() != sasm2.getI()).sum() < 0.01*len(sasm1.getI())
+
+@pytest.mark.new
+@pytest.mark.parametrize('expr', ['I0', 'I0/2+pi', '1e6/(I1*exposure_time)',
+    'sqrt(I0)*log(I1, 10)', 'pow(I1, 2)-atan2(I0, I1)'])
+def test_calc_expression(expr):
+    img_hdrs = [{'exposure_time' : '0.5', 'I1' : 'x'} for i in range(4)]
+    file_hdrs = [{'I0' : str(10.*(i+1)), 'I1' : 3.*(i+1), 'exposure_time' : 2}
+        for i in range(4)]
+
+    ref_vals = []
+
+    for img_hdr, file_hdr in zip(img_hdrs, file_hdrs):
+        mathparser = SASParser.PyMathParser()
+        mathparser.addDefaultFunctions()
+        mathparser.addDefaultVariables()
+        mathparser.addSpecialVariables(file_hdr)
+        mathparser.addSpecialVariables(img_hdr)
+        mathparser.expression = expr
+
+        ref_vals.append(mathparser.evaluate())
+
+    vals = [SASImage.calcExpression(expr, img_hdr, file_hdr) for img_hdr,
+        file_hdr in zip(img_hdrs, file_hdrs)]
+    stack_vals = SASImage.calcExpressionStack(expr, img_hdrs, file_hdrs)
+
+    assert vals == ref_vals
+    assert np.allclose(stack_vals, ref_vals)
+
+@pytest.mark.new
+def test_calc_expression_stack_errors():
+    file_hdrs = [{'I0' : 1.}, {'I0' : 0.}]
+
+    with pytest.raises(ZeroDivisionError):
+        SASImage.calcExpressionStack('1/I0', [{}, {}], file_hdrs)
+
+    assert SASImage.calcExpressionStack('', [{}, {}], file_hdrs) is None
+
 def test_profile_to_series():
     filenames = [os.path.join('.', 'data', 'series_dats',
         'BSA_001_{:04d}.dat'.format(i)) for i in range(10)]
@@ -1586,6 +2137,45 @@ def test_profile_to_series_with_settings(old_settings):
     assert series._file_list == test_filenames
     assert series.total_i.sum() == 105.06363296992504
 
+@pytest.mark.new
+@pytest.mark.parametrize('n_proc,use_processes', [(1, False), (3, False),
+    (3, True)])
+def test_load_profile_dir(n_proc, use_processes):
+    filenames = [os.path.join('.', 'data', 'series_dats',
+        'BSA_001_{:04d}.dat'.format(i)) for i in range(10)]
+
+    ref_profiles = raw.load_profiles(filenames)
+
+    profiles = raw.load_profile_dir(os.path.join('.', 'data', 'series_dats'),
+        n_proc=n_proc, use_processes=use_processes)
+
+    assert len(profiles) == len(ref_profiles)
+
+    for profile, ref_profile in zip(profiles, ref_profiles):
+        assert profile.getParameter('filename') == ref_profile.getParameter('filename')
+        assert np.all(profile.getI() == ref_profile.getI())
+        assert np.all(profile.getErr() == ref_profile.getErr())
+
+    series = raw.load_profile_dir(os.path.join('.', 'data', 'series_dats',
+        'BSA_001_000[0-4].dat'), n_proc=n_proc, use_processes=use_processes,
+        as_series=True)
+
+    assert isinstance(series, SECM.SECM)
+    assert series._file_list == [os.path.split(fname)[1] for fname
+        in filenames[:5]]
+
+@pytest.mark.new
+def test_load_profile_dir_frame_order(tmp_path):
+    src = os.path.join('.', 'data', 'series_dats', 'BSA_001_0000.dat')
+
+    for i in [1, 2, 9, 10, 11, 100]:
+        shutil.copy(src, os.path.join(str(tmp_path), 'BSA_{}.dat'.format(i)))
+
+    profiles = raw.load_profile_dir(str(tmp_path), n_proc=2)
+
+    assert ([profile.getParameter('filename') for profile in profiles]
+        == ['BSA_{}.dat'.format(i) for i in [1, 2, 9, 10, 11, 100]])
+
 def test_make_profile():
     filenames = [os.path.join('.', 'data', 'glucose_isomerase.dat')]
     profile = raw.load_profiles(filenames)[0]
@@ -1931,3 +2521,267 @@ def test_integrate_image(old_settings):
     assert all(profile.getI() == profile_list[0].getI())
     assert all(profile.getErr() == profile_list[0].getErr())
 
+@pytest.mark.new
+def test_integrate_image_plan_cache():
+    settings = raw.load_settings(os.path.join('.', 'data', 'settings_old.cfg'))
+    filenames = [os.path.join('.', 'data', 'GI2_A9_19_001_0000.tiff')]
+
+    counters = raw.load_counter_values(filenames, settings)[0]
+
+    img, img_hdr = raw.load_images(filenames, settings)
+    img = img[0]
+    img_hdr = img_hdr[0]
+
+    SASImage.clearIntegrationPlanCache()
+
+    profile1 = raw.integrate_image(img, settings, 'test_image', img_hdr,
+        counters, filenames[0])
+    ai = settings.get('AzimuthalIntegrator')
+
+    profile2 = raw.integrate_image(img, settings, 'test_image', img_hdr,
+        counters, filenames[0])
+
+    assert settings.get('AzimuthalIntegrator') is ai
+    assert all(profile1.getQ() == profile2.getQ())
+    assert all(profile1.getI() == profile2.getI())
+    assert all(profile1.getErr() == profile2.getErr())
+
+    settings.set('Binsize', 2)
+
+    profile3 = raw.integrate_image(img, settings, 'test_image', img_hdr,
+        counters, filenames[0])
+
+    assert settings.get('AzimuthalIntegrator') is not ai
+    assert len(profile3.getQ()) < len(profile1.getQ())
+
+
+@pytest.mark.new
+def test_load_roi_counters_eiger(settings_biocat_eiger):
+    filename = os.path.join('.', 'data', 'vac_007_data_000001.h5')
+
+    imgs, _ = raw.load_images([filename], settings_biocat_eiger)
+
+    roi1 = np.zeros(imgs[0].shape, dtype=int)
+    roi1[100:150, 100:200] = 1
+    roi2 = np.zeros(imgs[0].shape, dtype=int)
+    roi2[10:30, 50:60] = 1
+
+    frame_names, counters = raw.load_roi_counters([filename],
+        settings_biocat_eiger, rois={'roi1': roi1, 'roi2': roi2}, chunk_size=1)
+
+    assert frame_names == ['vac_007_data_000001_00001.h5',
+        'vac_007_data_000001_00002.h5']
+
+    for name, roi in [('roi1', roi1), ('roi2', roi2)]:
+        ref = np.array([img[roi==1].sum() for img in imgs])
+        assert np.all(counters[name] == ref)
+
+    hdr_counters = raw.load_counter_values([filename]*2, settings_biocat_eiger,
+        frame_names)
+
+    for j, hdr in enumerate(hdr_counters):
+        assert counters['I0'][j] == float(hdr['I0'])
+        assert counters['I1'][j] == float(hdr['I1'])
+
+@pytest.mark.new
+def test_load_roi_counters_tbs_mask():
+    settings = raw.load_settings(os.path.join('.', 'data', 'settings_old.cfg'))
+    filename = os.path.join('.', 'data', 'GI2_A9_19_001_0000.tiff')
+
+    imgs, _ = raw.load_images([filename], settings)
+
+    tbs_mask = np.zeros(imgs[0].shape, dtype=int)
+    tbs_mask[90:110, 200:300] = 1
+    settings.get('Masks')['TransparentBSMask'] = [tbs_mask, []]
+
+    frame_names, counters = raw.load_roi_counters([filename], settings)
+
+    profiles, _ = raw.load_and_integrate_images([filename], settings)
+
+    assert frame_names == ['GI2_A9_19_001_0000.tiff']
+    assert counters['roi_counter'][0] == imgs[0][tbs_mask==1].sum()
+    assert (counters['roi_counter'][0]
+        == profiles[0].getParameter('counters')['roi_counter'])
+
+@pytest.mark.new
+def test_calc_roi_counters_stack():
+    rng = np.random.default_rng(0)
+    imgs = rng.integers(0, 100, (5, 40, 30)).astype(np.int32)
+
+    roi = np.zeros((40, 30))
+    roi[5:20, 3:9] = 1
+    roi[30, 20] = 1
+
+    counters = SASImage.calcROICountersStack(imgs[:, ::-1, :], {'roi': roi})
+
+    ref = np.array([img[roi==1].sum() for img in imgs[:, ::-1, :]])
+
+    assert np.all(counters['roi'] == ref)
+    assert SASImage.calcROICounter(imgs[0], roi) == imgs[0][roi==1].sum()
+    assert np.all(SASImage.calcROICountersStack(list(imgs), {'roi': roi})['roi']
+        == np.array([img[roi==1].sum() for img in imgs]))
+
+@pytest.mark.new
+@pytest.mark.parametrize('method', ['nosplit_csr', 'raw_csr'])
+def test_integrate_image_binnings(method):
+    settings = raw.load_settings(os.path.join('.', 'data', 'settings_old.cfg'))
+    settings.set('IntegrationMethod', method)
+
+    filenames = [os.path.join('.', 'data', 'GI2_A9_19_001_0000.tiff')]
+
+    counters = raw.load_counter_values(filenames, settings)[0]
+
+    img, img_hdr = raw.load_images(filenames, settings)
+    img = img[0]
+    img_hdr = img_hdr[0]
+
+    ref_profile = raw.integrate_image(img, settings, 'test_image', img_hdr,
+        dict(counters), filenames[0])
+
+    binnings = {'full': {'npts': 0}, 'svd': {'rebin_factor': 4},
+        'log': {'npts': 100, 'log_rebin': True}}
+
+    profile, binned_profiles = raw.integrate_image(img, settings, 'test_image',
+        img_hdr, dict(counters), filenames[0], binnings=binnings)
+
+    assert sorted(binned_profiles.keys()) == ['full', 'log', 'svd']
+    assert np.all(profile.getI() == ref_profile.getI())
+    assert np.allclose(binned_profiles['full'].getI(), ref_profile.getRawI())
+    assert np.allclose(binned_profiles['full'].getErr(), ref_profile.getRawErr())
+    assert len(binned_profiles['log'].getQ()) == 100
+
+    # Combining the bins gives the same profile as integrating with wider bins
+    npts = len(ref_profile.getRawQ())
+
+    params = {'imageHeader': img_hdr, 'counters': dict(counters),
+        'filename': 'test_image', 'load_path': filenames[0]}
+
+    setup = SASImage.prepareIntegration(img, params, settings)
+    plan = setup['plan']
+    norm_factor, _ = SASImage.setImageParameters(img, params, setup)
+
+    kwargs = dict(plan.integration_kwargs)
+    kwargs['normalization_factor'] = norm_factor
+    kwargs['variance'] = None
+    kwargs['method'] = 'nosplit_csr'
+
+    q, i, err = plan.ai.integrate1d(img, npts//4, **kwargs)
+
+    svd_profile = binned_profiles['svd']
+
+    assert len(svd_profile.getQ()) == npts//4
+    assert np.allclose(svd_profile.getQ(), q)
+    assert np.allclose(svd_profile.getI(), i, rtol=1e-5)
+    assert np.allclose(svd_profile.getErr(), err, rtol=1e-5)
+    assert (svd_profile.getParameter('history')['linear_binning']['final_points']
+        == npts//4)
+
+@pytest.mark.new
+def test_load_integrate_images_eiger_binnings():
+    filename = os.path.join('.', 'data', 'vac_007_data_000001.h5')
+
+    for method in ['nosplit_csr', 'raw_csr']:
+        settings = raw.load_settings(os.path.join('.', 'data',
+            'settings_biocat_eiger.cfg'))
+        settings.set('IntegrationMethod', method)
+
+        imgs, img_hdrs = raw.load_images([filename], settings)
+
+        frame_names = ['vac_007_data_000001_{:05d}.h5'.format(j+1)
+            for j in range(len(imgs))]
+
+        counters = raw.load_counter_values([filename]*len(imgs), settings,
+            frame_names)
+
+        parameters_list = [{'imageHeader': img_hdr, 'counters': counters[j],
+            'filename': frame_names[j], 'load_path': filename}
+            for j, img_hdr in enumerate(img_hdrs)]
+
+        ref_list = SASImage.integrateCalibrateNormalizeStack(np.array(imgs),
+            copy.deepcopy(parameters_list), settings)
+
+        results = SASImage.integrateCalibrateNormalizeStack(np.array(imgs),
+            parameters_list, settings, binnings={'svd': {'npts': 100}})
+
+        # The binnings are made from the full profile, before log binning
+        settings.set('BinType', 'Linear')
+
+        full_list = SASImage.integrateCalibrateNormalizeStack(np.array(imgs),
+            copy.deepcopy(parameters_list), settings)
+
+        for ref, full, (sasm, binned_sasms) in zip(ref_list, full_list, results):
+            assert np.all(sasm.getRawI() == ref.getRawI())
+
+            rebinned = SASProc.rebin(full, int(len(full.getRawQ())//100))
+            svd_sasm = binned_sasms['svd']
+
+            assert np.allclose(svd_sasm.getQ(), rebinned.getQ())
+            assert len(svd_sasm.getQ()) == len(rebinned.getQ())
+
+@pytest.mark.new
+def test_load_dat_parse_fallback(tmp_path):
+    filename = os.path.join('.', 'data', 'series_dats', 'BSA_001_0000.dat')
+
+    ref_sasm = SASFileIO.loadDatFile(filename)
+
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+
+    # A stray text line in the data block forces the line by line parser
+    for i, line in enumerate(lines):
+        if line.strip().startswith('### DATA'):
+            break
+
+    lines.insert(i+10, 'not a data line\n')
+
+    test_file = os.path.join(str(tmp_path), 'BSA_001_0000.dat')
+
+    with open(test_file, 'w') as f:
+        f.writelines(lines)
+
+    sasm = SASFileIO.loadDatFile(test_file)
+
+    assert np.all(sasm.getRawQ() == ref_sasm.getRawQ())
+    assert np.all(sasm.getRawI() == ref_sasm.getRawI())
+    assert np.all(sasm.getRawErr() == ref_sasm.getRawErr())
+    assert sasm.getAllParameters()['counters'] == ref_sasm.getAllParameters()['counters']
+
+@pytest.mark.new
+def test_read_numeric_block():
+    lines = ['# q I err\n', 'some header\n', '1.0 2.0 3.0\n', '2.0 4.0 6.0\n',
+        '3.0 8.0 12.0\n', '\n', 'footer\n']
+
+    data, start, end = SASFileIO.readNumericBlock(lines,
+        SASFileIO.three_col_fit, 3)
+
+    assert start == 2
+    assert end == 5
+    assert np.all(data == np.array([[1., 2., 3.], [2., 4., 6.], [3., 8., 12.]]))
+
+    lines.insert(3, '1.5 3.0\n')
+
+    data, start, end = SASFileIO.readNumericBlock(lines,
+        SASFileIO.three_col_fit, 3)
+
+    assert data is None
+
+@pytest.mark.new
+@pytest.mark.slow
+def test_load_dat_series_dats():
+    filenames = [os.path.join('.', 'data', 'series_dats', fname) for fname
+        in sorted(os.listdir(os.path.join('.', 'data', 'series_dats')))]
+
+    all_lines = []
+
+    for fname in filenames:
+        with open(fname, 'r') as f:
+            all_lines.append(f.readlines())
+
+    for lines in all_lines:
+        data, header = SASFileIO.readDatBlocks(lines,
+            SASFileIO.three_col_fit, 3)
+        q, i, err, imodel, qerr, old_header = SASFileIO._matchDatLines(lines,
+            SASFileIO.three_col_fit, False, False)
+
+        assert np.all(data[:,0] == q)
+        assert np.all(data[:,1] == i)
@@ -1,15 +1,23 @@
 import os
 import copy
+import pickle
+import weakref
 
 import pytest
 import numpy as np
 import scipy.interpolate as interp
+from scipy import integrate
 
 raw_path = os.path.abspath(os.path.join('.', __file__, '..', '..'))
 if raw_path not in os.sys.path:
     os.sys.path.append(raw_path)
 
 import bioxtasraw.RAWAPI as raw
+import bioxtasraw.SASCalc as SASCalc
+import bioxtasraw.SASFileIO as SASFileIO
+import bioxtasraw.SASM as SASM
+import bioxtasraw.SASProc as SASProc
+import bioxtasraw.SECM as SECM
 
 
 @pytest.fixture(scope='package')
@@ -501,3 +509,582 @@ def test_scaleq_profile(gi_sub_profile, scale_factor):
     test_profile.scaleQ(scale_factor)
 
     assert all(test_profile.getQ() == q*scale_factor)
+
+@pytest.mark.new
+@pytest.mark.parametrize('rebin_kwargs', [{'npts': 100}, {'npts': 0},
+    {'rebin_factor': 3}, {'npts': 100, 'log_rebin': True},
+    {'npts': 1000, 'log_rebin': True}, {'rebin_factor': 2, 'log_rebin': True}])
+def test_bin_accumulated(gi_sub_profile, rebin_kwargs):
+    q = gi_sub_profile.getQ()
+    i = gi_sub_profile.getI()
+    err = gi_sub_profile.getErr()
+
+    edges = SASProc.binEdges(len(q), **rebin_kwargs)
+
+    # With unit normalization each bin is averaged, the same as rebin
+    binned_q, binned_i, binned_err = SASProc.binAccumulated(q, i,
+        np.ones_like(i), err**2, edges)
+
+    rebinned = raw.rebin([gi_sub_profile], **rebin_kwargs)[0]
+
+    assert np.allclose(binned_q, rebinned.getQ())
+    assert np.allclose(binned_i, rebinned.getI())
+    assert np.allclose(binned_err, rebinned.getErr())
+
+@pytest.mark.new
+@pytest.mark.parametrize('log_rebin', [False, True])
+def test_rebin_arrays_stack(bsa_series_profiles, log_rebin):
+    profiles = bsa_series_profiles
+
+    q = profiles[0].getQ()
+    i = np.array([profile.getI() for profile in profiles])
+    err = np.array([profile.getErr() for profile in profiles])
+
+    if log_rebin:
+        binned_q, binned_i, binned_err, _ = SASProc.logBinArrays(q, i, err, 50)
+        ref_profiles = [SASProc.logBinning(profile, 50) for profile in profiles]
+    else:
+        binned_q, binned_i, binned_err, _ = SASProc.rebinArrays(q, i, err, 3)
+        ref_profiles = [SASProc.rebin(profile, 3) for profile in profiles]
+
+    assert binned_i.shape == (len(profiles), len(ref_profiles[0].getQ()))
+
+    for j, ref in enumerate(ref_profiles):
+        assert np.allclose(binned_q, ref.getQ())
+        assert np.allclose(binned_i[j], ref.getI())
+        assert np.allclose(binned_err[j], ref.getErr())
+
+@pytest.mark.new
+def test_log_rebin_q_err(gi_sub_profile):
+    q_err = np.linspace(0.001, 0.002, len(gi_sub_profile.getQ()))
+    profile = raw.make_profile(gi_sub_profile.getQ(), gi_sub_profile.getI(),
+        gi_sub_profile.getErr(), 'test', q_err=q_err)
+
+    rebinned = SASProc.logBinning(profile, 100)
+
+    edges = SASProc.logBinEdges(len(q_err), 100)
+    ref = [np.sqrt(np.sum(q_err[edges[j]:edges[j+1]]**2))/(edges[j+1]-edges[j])
+        for j in range(len(edges)-1)]
+
+    assert np.allclose(rebinned.getQErr(), ref)
+
+@pytest.mark.new
+def test_binfixed():
+    rng = np.random.default_rng(0)
+
+    q = np.sort(rng.uniform(0.01, 0.3, 500))
+    i = rng.normal(1, 0.5, 500)
+    i[::17] = 0
+    err = np.abs(rng.normal(0.1, 0.01, 500))
+    refq = np.linspace(0.005, 0.31, 200)
+
+    qn, binned_i, binned_err = SASProc.binfixed(q, i, err, refq)
+
+    dq = refq[1]-refq[0]
+    edges = np.linspace(refq[0]-dq/2., refq[-1]+1.5*dq, 202)
+    dig = np.digitize(q, edges)
+
+    for j in range(1, len(edges)-1):
+        in_bin = dig == j
+
+        if in_bin.sum() == 0:
+            assert np.isnan(binned_i[j-1])
+            assert binned_err[j-1] == 0
+        else:
+            mean_i = i[in_bin].mean()
+            rel_err = err[in_bin][i[in_bin] != 0]/i[in_bin][i[in_bin] != 0]
+
+            assert np.isclose(binned_i[j-1], mean_i)
+            assert np.isclose(binned_err[j-1],
+                np.sqrt(np.sum(rel_err**2))/in_bin.sum()*mean_i)
+
+    assert np.all(qn == refq)
+
+@pytest.mark.new
+def test_prepare_sasms_for_svd(bsa_series_profiles):
+    profiles = bsa_series_profiles
+
+    svd_a, i, err = SASCalc.prepareSASMsforSVD(profiles, bin_to=100)
+
+    rb_fac = int(np.floor(len(profiles[0].getQ())/100.))
+    ref_profiles = [SASProc.rebin(profile, rb_fac) for profile in profiles]
+
+    assert i.shape == (len(ref_profiles[0].getQ()), len(profiles))
+
+    for j, ref in enumerate(ref_profiles):
+        assert np.allclose(i[:, j], ref.getI())
+        assert np.allclose(err[:, j], ref.getErr())
+
+@pytest.mark.new
+def test_remove_zingers_stack(bsa_series_profiles):
+    profiles = copy.deepcopy(bsa_series_profiles)
+
+    ref_i = [copy.deepcopy(profile.getI()) for profile in profiles]
+
+    zinger_i = copy.deepcopy(profiles[4].getRawI())
+    zinger_i[100] += 50*profiles[4].getRawErr()[100]
+    profiles[4].setRawI(zinger_i)
+
+    dezingered = raw.remove_zingers(profiles, 2, 10.)
+
+    neighbors = [profiles[i].getI()[100] for i in (2, 3, 5, 6)]
+
+    assert dezingered[4].getI()[100] == np.median(neighbors)
+    assert all(dezingered[4].getI()[:100] == ref_i[4][:100])
+    assert profiles[4].getI()[100] == zinger_i[100]
+
+    for i, profile in enumerate(dezingered):
+        if i != 4:
+            assert all(profile.getI() == ref_i[i])
+
+@pytest.mark.new
+def test_remove_zingers_stack_series_matrix(bsa_series_profiles):
+    profiles = copy.deepcopy(bsa_series_profiles)
+
+    zinger_i = copy.deepcopy(profiles[4].getRawI())
+    zinger_i[100] += 50*profiles[4].getRawErr()[100]
+    profiles[4].setRawI(zinger_i)
+
+    series_matrix = SECM.SeriesMatrix(profiles[0].getRawQ())
+    assert series_matrix.update(profiles)
+
+    old_row = profiles[4].getRawI()
+
+    SASProc.removeZingersStack(profiles, 2, 10.)
+
+    # The matrix row isn't changed behind the matrix's back
+    assert old_row[100] == zinger_i[100]
+    assert profiles[4].getRawI() is not old_row
+
+    assert series_matrix.update(profiles)
+    assert np.all(series_matrix.getRawI()[4] == profiles[4].getRawI())
+
+@pytest.mark.new
+def test_remove_zingers_stack_view(bsa_series_profiles):
+    profiles = [SASM.SASMView(profile) for profile in bsa_series_profiles]
+
+    ref_i = bsa_series_profiles[4].getRawI()[100]
+
+    SASProc.removeZingersStack(profiles, 2, 0.)
+
+    assert bsa_series_profiles[4].getRawI()[100] == ref_i
+
+@pytest.mark.new
+def test_temporal_median():
+    data = np.arange(5*3, dtype=float).reshape(5, 3)**2
+
+    median = SASProc.temporalMedian(data, 1)
+
+    ref_median = np.array([np.median(data[[1, 1]], axis=0),
+        np.median(data[[0, 2]], axis=0), np.median(data[[1, 3]], axis=0),
+        np.median(data[[2, 4]], axis=0), np.median(data[[3, 3]], axis=0)])
+
+    assert np.all(median == ref_median)
+
+def check_series_intensities(sasms, mean_i, total_i, i_of_q, qrange_i, qref,
+    qrange):
+    assert np.all(mean_i == [sasm.getMeanI() for sasm in sasms])
+    assert np.all(total_i == [sasm.getTotalI() for sasm in sasms])
+    assert np.all(i_of_q == [sasm.getIofQ(qref) for sasm in sasms])
+    assert np.all(qrange_i == [sasm.getIofQRange(qrange[0], qrange[1])
+        for sasm in sasms])
+
+@pytest.mark.new
+def test_series_matrix_update():
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    raw.set_buffer_range(series, [[18, 53]])
+
+    series.I(0.02)
+    series.calc_qrange_I((0.01, 0.1))
+
+    series.scale(2.5)
+    series.offset(0.1)
+    series.setSubQrange(3, 200)
+
+    sasms = series.getAllSASMs()
+
+    check_series_intensities(sasms, series.mean_i, series.total_i,
+        series.I_of_q, series.qrange_I, 0.02, (0.01, 0.1))
+    check_series_intensities(series.subtracted_sasm_list, series.mean_i_sub,
+        series.total_i_sub, series.I_of_q_sub, series.qrange_I_sub, 0.02,
+        (0.01, 0.1))
+
+    # Profile data is copied into one frames x q array, and the profiles keep
+    # their own data
+    matrix = series._profile_matrices['unsub']
+
+    assert np.all(matrix.getRawI() == [sasm.getRawI() for sasm in sasms])
+    assert not any(np.shares_memory(sasm.getRawI(), matrix.getRawI())
+        for sasm in sasms)
+    assert np.all(matrix.scale[:len(sasms)] == 2.5)
+    assert np.all(matrix.offset[:len(sasms)] == 0.1)
+
+    # Profiles with different q ranges are done one by one
+    sasms[5].setQrange((10, 300))
+    series.offset(0)
+
+    check_series_intensities(sasms, series.mean_i, series.total_i,
+        series.I_of_q, series.qrange_I, 0.02, (0.01, 0.1))
+
+@pytest.mark.new
+def test_series_matrix_profile_values(monkeypatch):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    series.I(0.02)
+    sasms = series.getAllSASMs()
+
+    # Series values are set on all of the profiles at once
+    def set_value(sasm, *args):
+        raise AssertionError('Series value set profile by profile')
+
+    for method in ('scale', 'offset', 'setQrange'):
+        monkeypatch.setattr(SASM.SASM, method, set_value)
+
+    series.scale(2)
+    series.offset(0.5)
+    series.setQrange(2, 300)
+
+    monkeypatch.undo()
+
+    # and profiles read them when they're used
+    assert all(sasm.getScale() == 2 for sasm in sasms)
+    assert all(sasm.getOffset() == 0.5 for sasm in sasms)
+    assert all(list(sasm.getQrange()) == [2, 301] for sasm in sasms)
+
+    check_series_intensities(sasms, series.mean_i, series.total_i,
+        series.I_of_q, np.zeros(len(sasms)), 0.02, (0, 0))
+
+    # Profile changes since are kept
+    sasms[3].offset(1)
+    sasms[4].setRawI(sasms[4].getRawI()*2)
+    series.I(0.02)
+
+    assert sasms[3].getOffset() == 1
+    assert series.I_of_q[3] == sasms[3].getIofQ(0.02)
+    assert series.I_of_q[4] == sasms[4].getIofQ(0.02)
+
+    series.scale(3)
+
+    assert sasms[3].getScale() == 3
+    assert sasms[3].getOffset() == 0.5
+    check_series_intensities(sasms, series.mean_i, series.total_i,
+        series.I_of_q, np.zeros(len(sasms)), 0.02, (0, 0))
+
+@pytest.mark.new
+def test_series_matrix_shared_profiles():
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    sasms = series.getAllSASMs()[:20]
+    ref_i = [sasm.getRawI() for sasm in sasms]
+
+    series1 = raw.profiles_to_series(sasms)
+    series2 = raw.profiles_to_series(sasms[:10])
+
+    series1.I(0.02)
+    series2.I(0.02)
+
+    matrix1 = series1._profile_matrices['unsub']
+    matrix2 = series2._profile_matrices['unsub']
+
+    series1.scale(2)
+    series2.scale(3)
+    series1.I(0.02)
+
+    # Profiles in both series aren't moved between the series matrices
+    assert series1._profile_matrices['unsub'] is matrix1
+    assert series2._profile_matrices['unsub'] is matrix2
+    assert all(sasm.getRawI() is ref for sasm, ref in zip(sasms, ref_i))
+
+    check_series_intensities(sasms[:10], series2.mean_i, series2.total_i,
+        series2.I_of_q, np.zeros(10), 0.02, (0, 0))
+
+    assert np.allclose(series1.I_of_q[:10]*1.5, series2.I_of_q)
+
+    # The values set last are used
+    assert all(sasm.getScale() == 3 for sasm in sasms[:10])
+    assert all(sasm.getScale() == 2 for sasm in sasms[10:])
+
+@pytest.mark.new
+def test_series_matrix_dtype(bsa_series_profiles):
+    sasms = copy.deepcopy(bsa_series_profiles)
+
+    for sasm in sasms:
+        sasm.setRawI(sasm.getRawI().astype(np.float32))
+        sasm.setRawErr(sasm.getRawErr().astype(np.float32))
+
+    matrix = SECM.SeriesMatrix(sasms[0].getRawQ())
+    assert matrix.update(sasms[:5])
+
+    assert matrix.getRawI().dtype == np.float32
+    assert matrix.getRawErr().dtype == np.float32
+
+    mean_i, total_i, i_of_q, qrange_i = matrix.getIntensities(qref=0.02)
+
+    assert np.allclose(mean_i, [sasm.getMeanI() for sasm in sasms[:5]])
+    assert np.allclose(i_of_q, [sasm.getIofQ(0.02) for sasm in sasms[:5]])
+
+    # Double precision profiles make the matrix double precision
+    sasms[5].setRawI(sasms[5].getRawI().astype(float))
+
+    assert matrix.update(sasms)
+    assert matrix.getRawI().dtype == np.float64
+    assert np.all(matrix.getRawI() == [sasm.getRawI() for sasm in sasms])
+
+@pytest.mark.new
+def test_series_matrix_append():
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    sasms = series.getAllSASMs()[:40]
+    ref_i = [sasm.getRawI().copy() for sasm in sasms]
+
+    series = raw.profiles_to_series(sasms[:20])
+    series.I(0.02)
+    series.scale(2)
+
+    for j in range(20, 40, 5):
+        series.append(['test']*5, sasms[j:j+5], list(range(j, j+5)))
+
+    check_series_intensities(sasms, series.mean_i, series.total_i,
+        series.I_of_q, np.zeros(40), 0.02, (0, 0))
+
+    # Profiles replaced in the series keep their own data
+    sub_sasms = [SASProc.subtract(sasm, sasms[0]) for sasm in sasms]
+    replaced = sub_sasms[-5:]
+    replaced_i = [sasm.getRawI().copy() for sasm in replaced]
+
+    series.setSubtractedSASMs(sub_sasms, [True]*40)
+    series.appendSubtractedSASMs([copy.deepcopy(sasm) for sasm in sasms[-5:]],
+        [True]*5, 5)
+
+    check_series_intensities(series.subtracted_sasm_list, series.mean_i_sub,
+        series.total_i_sub, series.I_of_q_sub, np.zeros(40), 0.02, (0, 0))
+
+    assert all(np.all(sasm.getRawI() == ref) for sasm, ref in zip(replaced,
+        replaced_i))
+    assert all(np.all(sasm.getRawI() == ref) for sasm, ref in zip(sasms,
+        ref_i))
+
+@pytest.mark.new
+def test_series_matrix_integration_fails(monkeypatch):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    trapz = integrate.trapz
+
+    def matrix_trapz(*args, **kwargs):
+        if 'axis' in kwargs:
+            raise ValueError
+        return trapz(*args, **kwargs)
+
+    # Falls back to the profile by profile calculation
+    monkeypatch.setattr(SECM.integrate, 'trapz', matrix_trapz)
+
+    series.I(0.02)
+    series.calc_qrange_I((0.01, 0.1))
+    series.scale(2)
+
+    sasms = series.getAllSASMs()
+
+    check_series_intensities(sasms, series.mean_i, series.total_i,
+        series.I_of_q, series.qrange_I, 0.02, (0.01, 0.1))
+
+    def failed_trapz(*args, **kwargs):
+        raise ValueError
+
+    monkeypatch.setattr(SECM.integrate, 'trapz', trapz)
+
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    # Where the profile calculation also fails the intensity is -1
+    monkeypatch.setattr(SECM.integrate, 'trapz', failed_trapz)
+
+    series.scale(3)
+
+    assert np.all(series.total_i == -1)
+    assert np.all(series.mean_i == -1)
+
+@pytest.mark.new
+def test_profile_lazy_values(gi_sub_profile):
+    test_profile = copy.deepcopy(gi_sub_profile)
+
+    i_raw = test_profile.getRawI()
+    q_raw = test_profile.getRawQ()
+    err_raw = test_profile.getRawErr()
+
+    assert not hasattr(test_profile, '__dict__')
+    assert weakref.ref(test_profile)() is test_profile
+
+    # Unscaled values aren't copies of the raw data
+    assert np.shares_memory(test_profile.getI(), i_raw)
+    assert not test_profile.getI().flags.writeable
+
+    test_profile.scale(2)
+    test_profile.offset(0.5)
+    test_profile.scaleQ(10)
+    test_profile.setQrange((10, 200))
+
+    assert np.all(test_profile.i == i_raw*2 + 0.5)
+    assert np.all(test_profile.err == err_raw*2)
+    assert np.all(test_profile.q == q_raw*10)
+
+    i = (i_raw*2 + 0.5)[10:200]
+    q = (q_raw*10)[10:200]
+
+    assert test_profile.getTotalI() == integrate.trapz(i, q)
+    assert test_profile.getMeanI() == i.mean()
+
+    test_profile.setRawI(i_raw*3)
+
+    assert np.all(test_profile.i == i_raw*6 + 0.5)
+    assert test_profile.getMeanI() == (i_raw*6 + 0.5)[10:200].mean()
+
+    test_profile.reset()
+
+    assert np.all(test_profile.i == i_raw*3)
+    assert np.all(test_profile.q == q_raw)
+
+    new_profile = pickle.loads(pickle.dumps(test_profile))
+
+    assert np.all(new_profile.getI() == test_profile.getI())
+    assert np.all(new_profile.getQ() == test_profile.getQ())
+    assert new_profile.getTotalI() == test_profile.getTotalI()
+    assert new_profile.getAllParameters() == test_profile.getAllParameters()
+
+@pytest.mark.new
+def test_profile_history_shared(bsa_series_profiles):
+    buffer_profile = raw.average(bsa_series_profiles[:5])
+    sub_profile = raw.subtract([bsa_series_profiles[8]], buffer_profile)[0]
+    binned_profile = raw.rebin([sub_profile], npts=100, log_rebin=True)[0]
+
+    copy_profile = copy.deepcopy(binned_profile)
+
+    # History entries reference the parent entries instead of copying them
+    sub_history = sub_profile.getParameter('history')
+    binned_history = binned_profile.getParameter('history')
+    copy_history = copy_profile.getParameter('history')
+
+    assert (binned_history['log_binning']['initial_file'][1]['subtraction']
+        is sub_history['subtraction'])
+    assert copy_history['log_binning'] is binned_history['log_binning']
+    assert copy_history is not binned_history
+
+    # The copied metadata is otherwise independent
+    copy_profile.getParameter('analysis')['test'] = 1
+    copy_profile.setParameter('filename', 'test.dat')
+    copy_history['test'] = {}
+
+    assert 'test' not in binned_profile.getParameter('analysis')
+    assert binned_profile.getParameter('filename') != 'test.dat'
+    assert 'test' not in binned_history
+
+    # And the header is the same as with copied metadata
+    parameters = binned_profile.getAllParameters()
+    assert (SASFileIO.formatHeader(parameters)
+        == SASFileIO.formatHeader(copy.deepcopy(parameters)))
+
+@pytest.mark.new
+@pytest.mark.parametrize('qref,qrange', [(0.02, (0.01, 0.1)),
+    (0.25, (0.2, 0.02)), (0.001, (0.001, 0.5))])
+def test_series_matrix_iofq(qref, qrange):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    raw.set_buffer_range(series, [[18, 53]])
+
+    series.scale(2.5)
+    series.setSubQrange(3, 200)
+
+    i_of_q = series.I(qref)
+    qrange_i = series.calc_qrange_I(qrange)
+
+    sasms = series.getAllSASMs()
+    sub_sasms = series.subtracted_sasm_list
+
+    assert np.all(i_of_q == [sasm.getIofQ(qref) for sasm in sasms])
+    assert np.all(qrange_i == [sasm.getIofQRange(qrange[0], qrange[1])
+        for sasm in sasms])
+    assert np.all(series.I_of_q_sub == [sasm.getIofQ(qref)
+        for sasm in sub_sasms])
+    assert np.all(series.qrange_I_sub == [sasm.getIofQRange(qrange[0],
+        qrange[1]) for sasm in sub_sasms])
+
+    # Profiles with different q ranges are done one by one
+    sub_sasms[5].setQrange((10, 300))
+
+    series.I(qref)
+    series.calc_qrange_I(qrange)
+
+    assert np.all(series.I_of_q_sub == [sasm.getIofQ(qref)
+        for sasm in sub_sasms])
+    assert np.all(series.qrange_I_sub == [sasm.getIofQRange(qrange[0],
+        qrange[1]) for sasm in sub_sasms])
+
+@pytest.mark.new
+def test_profile_view(gi_sub_profile):
+    profile = copy.deepcopy(gi_sub_profile)
+    profile.scale(2)
+
+    view = SASM.SASMView(profile)
+
+    assert isinstance(view, SASM.SASM)
+    assert np.shares_memory(view.getRawI(), profile.getRawI())
+    assert np.all(view.getI() == profile.getI())
+    assert view.getParameter('filename') == profile.getParameter('filename')
+
+    view.scale(3)
+    view.offset(1)
+    view.setQrange((10, 100))
+
+    assert np.all(view.getI() == (profile.getRawI()*3 + 1)[10:100])
+    assert np.all(view.getQ() == profile.getQ()[10:100])
+    assert profile.getScale() == 2
+    assert profile.getOffset() == 0
+    assert tuple(profile.getQrange()) == (0, len(profile.getRawQ()))
+
+    # Views can't change the profile data or metadata
+    with pytest.raises(ValueError):
+        view.getRawI()[0] = 0
+
+    with pytest.raises(TypeError):
+        view.setParameter('filename', 'test.dat')
+
+    # Copies of a view are regular profiles
+    view_copy = copy.deepcopy(view)
+
+    assert type(view_copy) is SASM.SASM
+    assert np.all(view_copy.getI() == view.getI())
+    assert view_copy.getAllParameters() == dict(profile.getAllParameters())
+
+@pytest.mark.new
+def test_validate_with_views():
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    raw.set_buffer_range(series, [[18, 53]])
+
+    sasms = series.getAllSASMs()[18:54]
+    intensity = series.getIntI()[18:54]
+
+    valid, similarity_results, _, _ = SASCalc.validateBuffer(sasms,
+        np.arange(18, 54), intensity, 'CorMap', 'Bonferroni', 0.01, False)
+
+    assert similarity_results['low_q_similar']
+    assert all(tuple(sasm.getQrange()) == (0, len(sasm.getRawQ()))
+        for sasm in sasms)
+
+    sub_sasms = series.subtracted_sasm_list[130:180]
+    sub_intensity = series.getIntI('sub')[130:180]
+    rg = np.full(len(sub_sasms), 20.)
+
+    SASCalc.validateSample(sub_sasms, np.arange(130, 180), sub_intensity, rg,
+        rg, rg, 'CorMap', 'Bonferroni', 0.01, False)
+
+    assert all(sasm.getScale() == 1 for sasm in sub_sasms)
+    assert all(tuple(sasm.getQrange()) == (0, len(sasm.getRawQ()))
+        for sasm in sub_sasms)
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+import numpy as np
+
+raw_path = os.path.abspath(os.path.join('.', __file__, '..', '..'))
+if raw_path not in os.sys.path:
+    os.sys.path.append(raw_path)
+
+import bioxtasraw.SASMask as SASMask
+
+def point_mask_matrix(img_dim, masks):
+    # Mask matrix made one fill point at a time, as createMaskMatrix used to
+    negmasks = [each for each in masks if each.isNegativeMask()]
+    posmasks = [each for each in masks if not each.isNegativeMask()]
+
+    if len(negmasks) > 0:
+        mask = np.zeros(img_dim)
+    else:
+        mask = np.ones(img_dim)
+
+    maxx, maxy = mask.shape
+
+    for each in negmasks + posmasks:
+        if each.isNegativeMask():
+            val = 1
+        else:
+            val = 0
+
+        for eachp in each.getFillPoints():
+            if eachp[0] < maxx and eachp[0] >= 0 and eachp[1] < maxy and eachp[1] >= 0:
+                mask[(int(eachp[0]), int(eachp[1]))] = val
+
+    mask = np.flipud(mask)
+
+    return mask
+
+def make_masks(img_dim, n_masks, seed):
+    rng = np.random.default_rng(seed)
+
+    ylen, xlen = img_dim
+
+    masks = []
+
+    for i in range(n_masks):
+        negative = bool(rng.random() < 0.2)
+        mask_type = i % 3
+
+        if mask_type == 0:
+            center = (int(rng.integers(-10, xlen+10)), int(rng.integers(-10, ylen+10)))
+            radius = (center[0] + int(rng.integers(-30, 30)), center[1])
+            masks.append(SASMask.CircleMask(center, radius, i, img_dim,
+                negative))
+
+        elif mask_type == 1:
+            p1 = (int(rng.integers(-10, xlen+10)), int(rng.integers(-10, ylen+10)))
+            p2 = (int(rng.integers(-10, xlen+10)), int(rng.integers(-10, ylen+10)))
+            masks.append(SASMask.RectangleMask(p1, p2, i, img_dim, negative))
+
+        else:
+            n_verts = int(rng.integers(3, 8))
+            verts = [(rng.uniform(-10, xlen+10), rng.uniform(-10, ylen+10))
+                for j in range(n_verts)]
+
+            if i % 2 == 0:
+                verts = [(int(x), int(y)) for x, y in verts]
+
+            masks.append(SASMask.PolygonMask(verts, i, img_dim, negative))
+
+    return masks
+
+@pytest.mark.new
+@pytest.mark.parametrize('seed', list(range(5)))
+def test_create_mask_matrix(seed):
+    img_dim = (97, 131)
+
+    masks = make_masks(img_dim, 9, seed)
+
+    mask = SASMask.createMaskMatrix(img_dim, masks)
+    ref_mask = point_mask_matrix(img_dim, masks)
+
+    assert mask.shape == ref_mask.shape
+    assert np.all(mask == ref_mask)
+
+@pytest.mark.new
+def test_create_mask_matrix_header_masks():
+    img = np.zeros((619, 487))
+    img_hdr = {'bsmask_configuration' : 'x 250.3 300.7 30 42.5 10',
+        'detectortype' : 'PILATUS 300K'}
+
+    masks = SASMask.createMaskFromHdr(img, img_hdr)
+
+    mask = SASMask.createMaskMatrix(img.shape, masks)
+    ref_mask = point_mask_matrix(img.shape, masks)
+
+    assert np.all(mask == ref_mask)
+
+@pytest.mark.new
+@pytest.mark.slow
+def test_create_mask_matrix_large_image():
+    img_dim = (3262, 3108)
+
+    masks = make_masks(img_dim, 12, 0)
+
+    mask = SASMask.createMaskMatrix(img_dim, masks)
+
+    for each in masks:
+        each._calcFillPoints()
+
+    ref_mask = point_mask_matrix(img_dim, masks)
+
+    assert np.all(mask == ref_mask)
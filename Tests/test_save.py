@@ -1,13 +1,17 @@
 import os
+import time
+import tracemalloc
 
 import pytest
 import numpy as np
+import h5py
 
 raw_path = os.path.abspath(os.path.join('.', __file__, '..', '..'))
 if raw_path not in os.sys.path:
     os.sys.path.append(raw_path)
 
 import bioxtasraw.RAWAPI as raw
+import bioxtasraw.SASFileIO as SASFileIO
 
 @pytest.fixture()
 def new_settings():
@@ -256,6 +260,188 @@ def test_save_series_sasbdb_keywords(series_sasbdb_keywords, temp_directory):
     assert len(test_series.use_baseline_subtracted_sasm) == len(series_sasbdb_keywords.use_baseline_subtracted_sasm)
     assert all(test_series.total_i_bcsub == series_sasbdb_keywords.total_i_bcsub)
 
+def compare_series_profiles(sasm_list, test_sasm_list):
+    assert len(sasm_list) == len(test_sasm_list)
+
+    for sasm, test_sasm in zip(sasm_list, test_sasm_list):
+        assert np.all(sasm.getRawQ() == test_sasm.getRawQ())
+        assert np.all(sasm.getRawI() == test_sasm.getRawI())
+        assert np.all(sasm.getRawErr() == test_sasm.getRawErr())
+        assert list(sasm.getQrange()) == list(test_sasm.getQrange())
+        assert (SASFileIO.formatHeader(sasm.getAllParameters())
+            == SASFileIO.formatHeader(test_sasm.getAllParameters()))
+
+@pytest.mark.new
+def test_save_series_table_layout(temp_directory):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    raw.set_buffer_range(series, [[18, 53]])
+    raw.set_baseline_correction(series, [0, 10], [313, 323], 'Linear')
+    series.getSASM(5).setQrange((3, 400))
+
+    raw.save_series(series, 'test_series_table.hdf5', temp_directory)
+
+    filename = os.path.join(temp_directory, 'test_series_table.hdf5')
+
+    with h5py.File(filename, 'r') as f:
+        assert f.attrs['layout_version'] == SASFileIO.series_layout_version
+        assert f['profiles'].attrs['layout'] == 'table'
+        assert f['profiles']['intensity'].shape == (len(series.getAllSASMs()),
+            len(series.getSASM(0).getRawQ()))
+
+    test_series = raw.load_series([filename])[0]
+
+    compare_series_profiles(series.getAllSASMs(), test_series.getAllSASMs())
+    compare_series_profiles(series.subtracted_sasm_list,
+        test_series.subtracted_sasm_list)
+    compare_series_profiles(series.baseline_subtracted_sasm_list,
+        test_series.baseline_subtracted_sasm_list)
+    compare_series_profiles(series.baseline_corr, test_series.baseline_corr)
+    compare_series_profiles([series.average_buffer_sasm],
+        [test_series.average_buffer_sasm])
+
+    assert all(test_series.total_i_bcsub == series.total_i_bcsub)
+
+@pytest.mark.new
+def test_save_series_mixed_q(temp_directory):
+    filenames = [os.path.join('.', 'data', 'series_dats',
+        'BSA_001_{:04d}.dat'.format(i)) for i in range(4)]
+
+    profiles = raw.load_profiles(filenames)
+
+    # Profiles without a common q are saved one per dataset
+    profiles[1] = raw.make_profile(profiles[1].getQ()[:-10],
+        profiles[1].getI()[:-10], profiles[1].getErr()[:-10],
+        profiles[1].getParameter('filename'))
+
+    series = raw.profiles_to_series(profiles)
+
+    raw.save_series(series, 'test_series_mixed_q.hdf5', temp_directory)
+
+    filename = os.path.join(temp_directory, 'test_series_mixed_q.hdf5')
+
+    with h5py.File(filename, 'r') as f:
+        assert 'layout' not in f['profiles'].attrs
+        assert '000001' in f['profiles']
+
+    test_series = raw.load_series([filename])[0]
+
+    compare_series_profiles(series.getAllSASMs(), test_series.getAllSASMs())
+
+@pytest.mark.new
+def test_save_series_no_copy(temp_directory):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    raw.set_buffer_range(series, [[18, 53]])
+
+    file_list = list(series.extractAll()['file_list'])
+    params = SASFileIO.formatHeader(series.getAllParameters())
+
+    profile_bytes = sum(sasm.getRawI().nbytes + sasm.getRawErr().nbytes
+        for sasm in series.getAllSASMs() + series.subtracted_sasm_list)
+
+    filename = os.path.join(temp_directory, 'test_series_no_copy.hdf5')
+
+    tracemalloc.start()
+
+    try:
+        SASFileIO.save_series(filename, series)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # Profiles are written straight from the series
+    assert peak < profile_bytes
+
+    assert series.extractAll()['file_list'] == file_list
+    assert SASFileIO.formatHeader(series.getAllParameters()) == params
+
+    test_series = raw.load_series([filename])[0]
+
+    compare_series_profiles(series.getAllSASMs(), test_series.getAllSASMs())
+    compare_series_profiles(series.subtracted_sasm_list,
+        test_series.subtracted_sasm_list)
+
+@pytest.mark.new
+def test_save_series_append(temp_directory):
+    series = raw.load_series([os.path.join('.', 'data',
+        'clean_BSA_001.hdf5')])[0]
+
+    raw.set_buffer_range(series, [[18, 53]])
+
+    sasms = series.getAllSASMs()
+    n_frames = len(sasms)
+
+    online_series = raw.profiles_to_series(sasms[:60])
+    raw.set_buffer_range(online_series, [[18, 53]])
+
+    filename = os.path.join(temp_directory, 'test_series_append.hdf5')
+
+    raw.save_series(online_series, 'test_series_append.hdf5', temp_directory,
+        append=True)
+
+    # New frames, with the subtracted and calculated values redone
+    online_series.append([sasm.getParameter('filename') for sasm in sasms[60:]],
+        sasms[60:], list(range(60, n_frames)))
+    raw.set_buffer_range(online_series, [[18, 53]])
+
+    with h5py.File(filename, 'r') as f:
+        old_params = f['profiles']['parameters'][0]
+
+    raw.save_series(online_series, 'test_series_append.hdf5', temp_directory,
+        append=True)
+
+    with h5py.File(filename, 'r') as f:
+        assert f['profiles']['intensity'].shape[0] == n_frames
+        assert f['profiles']['parameters'][0] == old_params
+        assert f['calculated_data']['rg'].shape[0] == n_frames
+
+    raw.save_series(online_series, 'test_series_full.hdf5', temp_directory)
+
+    test_series = raw.load_series([filename])[0]
+    full_series = raw.load_series([os.path.join(temp_directory,
+        'test_series_full.hdf5')])[0]
+
+    for test, ref in [(test_series, online_series), (full_series, test_series)]:
+        compare_series_profiles(ref.getAllSASMs(), test.getAllSASMs())
+        compare_series_profiles(ref.subtracted_sasm_list,
+            test.subtracted_sasm_list)
+        compare_series_profiles([ref.average_buffer_sasm],
+            [test.average_buffer_sasm])
+
+        assert np.all(test.frame_list == ref.frame_list)
+        assert test.getRg()[0].tolist() == ref.getRg()[0].tolist()
+        assert np.allclose(test.total_i_sub, ref.total_i_sub)
+
+@pytest.mark.new
+def test_save_series_append_changed_file(temp_directory):
+    filenames = [os.path.join('.', 'data', 'series_dats',
+        'BSA_001_{:04d}.dat'.format(i)) for i in range(6)]
+
+    profiles = raw.load_profiles(filenames)
+
+    series = raw.profiles_to_series(profiles[:3])
+
+    raw.save_series(series, 'test_series_append.hdf5', temp_directory,
+        append=True)
+
+    # Written by something else, so the next append writes the whole file
+    other_series = raw.profiles_to_series(profiles[:1])
+    raw.save_series(other_series, 'test_series_append.hdf5', temp_directory)
+
+    series.append([sasm.getParameter('filename') for sasm in profiles[3:]],
+        profiles[3:], list(range(3, 6)))
+
+    raw.save_series(series, 'test_series_append.hdf5', temp_directory,
+        append=True)
+
+    test_series = raw.load_series([os.path.join(temp_directory,
+        'test_series_append.hdf5')])[0]
+
+    compare_series_profiles(series.getAllSASMs(), test_series.getAllSASMs())
+
 def test_save_report_all(gi_sub_profile, gi_gnom_ift, bsa_series, temp_directory):
     raw.save_report('test_all.pdf', temp_directory, [gi_sub_profile], [gi_gnom_ift],
         [bsa_series])
@@ -43,6 +43,9 @@ import queue
 import logging
 import time
 import glob
+import multiprocessing
+import multiprocessing.pool
+import functools
 
 import numpy as np
 
@@ -111,24 +114,14 @@ def load_settings(file, settings=None):
         print(post_msg)
 
     if success:
-        mask_dict = settings.get('Masks')
-        img_dim = settings.get('MaskDimension')
-
-        for each_key in mask_dict:
-            masks = mask_dict[each_key][1]
-
-            if masks is not None:
-                mask_img = SASMask.createMaskMatrix(img_dim, masks)
-                mask_param = mask_dict[each_key]
-                mask_param[0] = mask_img
-                mask_param[1] = masks
-                mask_param[2] = np.logical_not(mask_img)
+        RAWSettings.createMaskMatrices(settings)
     else:
         print('Failed to load settings')
 
     return settings
 
-def load_files(filename_list, settings, return_all_images=False):
+def load_files(filename_list, settings, return_all_images=False, n_proc=1,
+    pool=None):
     """
     Loads all types of files that RAW knows how to load. If images are
     included in the list, then the images are radially averaged as part
@@ -146,6 +139,15 @@ def load_files(filename_list, settings, return_all_images=False):
         If True, all loaded images are returned. If false, only the first loaded
         image of the last file is returned. Useful for minimizing memory use
         if loading and processing a large number of images. False by default.
+    n_proc: int, optional
+        The number of processes to use to load and radially average the
+        files. If greater than 1, a process pool is created for this call.
+        1 (load files in the current process) by default.
+    pool: :class:`multiprocessing.pool.Pool`, optional
+        A process pool made by :py:func:`make_load_pool`, to reuse when
+        loading many sets of files with the same settings. The settings the
+        pool was made with are used to load the files. If provided, n_proc
+        is ignored.
 
     Returns
     -------
@@ -165,73 +167,139 @@ def load_files(filename_list, settings, return_all_images=False):
     if not isinstance(filename_list, list):
         filename_list = [filename_list]
 
+    filename_list = [os.path.abspath(os.path.expanduser(filename))
+        for filename in filename_list]
+
+    if pool is not None:
+        file_results = pool.map(functools.partial(_pool_load_file,
+            return_all_images=return_all_images), filename_list)
+
+    elif n_proc > 1 and len(filename_list) > 1:
+        mp_pool = make_load_pool(settings, min(n_proc, len(filename_list)))
+
+        try:
+            file_results = mp_pool.map(functools.partial(_pool_load_file,
+                return_all_images=return_all_images), filename_list)
+        finally:
+            mp_pool.close()
+            mp_pool.join()
+
+    else:
+        file_results = [_load_file(filename, settings, return_all_images)
+            for filename in filename_list]
+
     profile_list = []
     ift_list = []
     series_list = []
     img_list = []
 
-    for filename in filename_list:
-        filename = os.path.abspath(os.path.expanduser(filename))
+    for profiles, ifts, series, imgs in file_results:
+        profile_list.extend(profiles)
+        ift_list.extend(ifts)
+        series_list.extend(series)
 
-        file_ext = os.path.splitext(filename)[1]
+        if len(imgs) > 0:
+            if not return_all_images:
+                img_list = imgs[:1]
+            else:
+                img_list.extend(imgs)
 
-        is_profile = False
+    return profile_list, ift_list, series_list, img_list
 
-        if file_ext == '.sec':
-            secm = SASFileIO.loadSeriesFile(filename, settings)
-            series_list.append(secm)
+def make_load_pool(settings, n_proc):
+    """
+    Makes a process pool for loading and radially averaging files with
+    :py:func:`load_files` or :py:func:`load_and_integrate_images`. The
+    settings are sent to each process once, when the pool starts, and each
+    process keeps its integration setup between files. Close the pool when
+    you are done with it.
+
+    Parameters
+    ----------
+    settings: :class:`bioxtasraw.RAWSettings.RAWSettings`
+        The RAW settings to be used when loading in the files, such as the
+        calibration values used when radially averaging images.
+    n_proc: int
+        The number of processes in the pool. This could be up to as many
+        cores as your computer has.
 
-        elif file_ext == '.ift' or file_ext == '.out':
-            iftm, img = SASFileIO.loadFile(filename, settings, return_all_images=False)
+    Returns
+    -------
+    pool: :class:`multiprocessing.pool.Pool`
+        The process pool.
+    """
+    pool = multiprocessing.Pool(processes=n_proc, initializer=_init_load_pool,
+        initargs=(settings,))
 
-            if isinstance(iftm, list):
-                ift_list.append(iftm[0])
+    return pool
 
-        elif file_ext == '.hdf5':
-            try:
-                secm = SASFileIO.loadSeriesFile(filename, settings)
-                series_list.append(secm)
-            except Exception:
-                is_profile = True
+_pool_settings = None
 
-        else:
+def _init_load_pool(settings):
+    global _pool_settings
+    _pool_settings = settings
+
+def _pool_load_file(filename, return_all_images):
+    return _load_file(filename, _pool_settings, return_all_images)
+
+def _load_file(filename, settings, return_all_images):
+    profile_list = []
+    ift_list = []
+    series_list = []
+    img_list = []
+
+    file_ext = os.path.splitext(filename)[1]
+
+    is_profile = False
+
+    if file_ext == '.sec':
+        secm = SASFileIO.loadSeriesFile(filename, settings)
+        series_list.append(secm)
+
+    elif file_ext == '.ift' or file_ext == '.out':
+        iftm, img = SASFileIO.loadFile(filename, settings, return_all_images=False)
+
+        if isinstance(iftm, list):
+            ift_list.append(iftm[0])
+
+    elif file_ext == '.hdf5':
+        try:
+            secm = SASFileIO.loadSeriesFile(filename, settings)
+            series_list.append(secm)
+        except Exception:
             is_profile = True
 
-        if is_profile:
-            sasm, img = SASFileIO.loadFile(filename, settings,
-                return_all_images=return_all_images)
+    else:
+        is_profile = True
+
+    if is_profile:
+        sasm, img = SASFileIO.loadFile(filename, settings,
+            return_all_images=return_all_images)
 
-            if img is not None:
-                start_point = settings.get('StartPoint')
-                end_point = settings.get('EndPoint')
+        if img is not None:
+            start_point = settings.get('StartPoint')
+            end_point = settings.get('EndPoint')
 
-                if not isinstance(sasm, list):
-                    qrange = (start_point, len(sasm.getRawQ())-end_point)
-                    sasm.setQrange(qrange)
-                else:
-                    qrange = (start_point, len(sasm[0].getRawQ())-end_point)
-                    for each_sasm in sasm:
-                        each_sasm.setQrange(qrange)
-
-                if isinstance(img, list):
-                    if not return_all_images and len(img_list) == 0:
-                        img_list.append(img[0])
-                    elif not return_all_images:
-                        img_list[0] = img[0]
-                    else:
-                        img_list.extend(img)
-                else:
-                    if not return_all_images and len(img_list) == 0:
-                        img_list.append(img)
-                    elif not return_all_images:
-                        img_list[0] = img
-                    else:
-                        img_list.append(img)
+            if not isinstance(sasm, list):
+                qrange = (start_point, len(sasm.getRawQ())-end_point)
+                sasm.setQrange(qrange)
+            else:
+                qrange = (start_point, len(sasm[0].getRawQ())-end_point)
+                for each_sasm in sasm:
+                    each_sasm.setQrange(qrange)
 
-            if isinstance(sasm, list):
-                profile_list.extend(sasm)
+            if isinstance(img, list):
+                if not return_all_images:
+                    img_list.append(img[0])
+                else:
+                    img_list.extend(img)
             else:
-                profile_list.append(sasm)
+                img_list.append(img)
+
+        if isinstance(sasm, list):
+            profile_list.extend(sasm)
+        else:
+            profile_list.append(sasm)
 
     return profile_list, ift_list, series_list, img_list
 
@@ -267,6 +335,97 @@ def load_profiles(filename_list, settings=None):
 
     return profile_list
 
+def load_profile_dir(path, settings=None, pattern='*.dat', n_proc=1,
+    use_processes=False, as_series=False):
+    """
+    Loads all of the scattering profiles in a directory, or all profiles
+    matching a glob pattern, in parallel. Profiles are returned in frame
+    order, the files are sorted by name with numbers sorted by value (so
+    that _10 comes after _9).
+
+    Parameters
+    ----------
+    path: str
+        Either a directory or a glob pattern (e.g. ``'/data/BSA_001_*.dat'``)
+        for the files to load.
+    settings: :class:`bioxtasraw.RAWSettings.RAWSettings`, optional
+        The RAW settings to be used when loading in the files. Default is
+        None, this is commonly not used unless as_series is True.
+    pattern: str, optional
+        The glob pattern used to select files when path is a directory.
+        Default is '*.dat'.
+    n_proc: int, optional
+        The number of threads or processes used to load the files. 1 (load
+        files in the current thread) by default.
+    use_processes: bool, optional
+        If False (default), files are loaded on a thread pool, which is
+        best when reading the files is the limiting step (e.g. network
+        storage). If True, files are loaded on a process pool, which is
+        best when parsing the files is the limiting step.
+    as_series: bool, optional
+        If True, the loaded profiles are returned as a single series
+        (:class:`bioxtasraw.SECM.SECM`), made as in
+        :py:func:`profiles_to_series`. The profiles are used directly in
+        the series, without copying. Default is False.
+
+    Returns
+    -------
+    profiles: list or :class:`bioxtasraw.SECM.SECM`
+        A list of individual scattering profiles
+        (:class:`bioxtasraw.SASM.SASM`) in frame order, or a series made
+        from them if as_series is True.
+    """
+
+    if settings is None:
+        settings = __default_settings
+
+    path = os.path.abspath(os.path.expanduser(path))
+
+    if os.path.isdir(path):
+        path = os.path.join(path, pattern)
+
+    filename_list = [filename for filename in glob.glob(path)
+        if os.path.isfile(filename)]
+    filename_list.sort(key=SASUtils.natural_sort_key)
+
+    n_proc = min(n_proc, len(filename_list))
+
+    if n_proc > 1 and use_processes:
+        mp_pool = make_load_pool(settings, n_proc)
+
+        try:
+            file_results = mp_pool.map(_pool_load_profiles, filename_list)
+        finally:
+            mp_pool.close()
+            mp_pool.join()
+
+    elif n_proc > 1:
+        thread_pool = multiprocessing.pool.ThreadPool(processes=n_proc)
+
+        try:
+            file_results = thread_pool.map(functools.partial(_load_profiles,
+                settings=settings), filename_list)
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+
+    else:
+        file_results = [_load_profiles(filename, settings)
+            for filename in filename_list]
+
+    profile_list = [sasm for sasms in file_results for sasm in sasms]
+
+    if as_series:
+        profile_list = profiles_to_series(profile_list, settings)
+
+    return profile_list
+
+def _pool_load_profiles(filename):
+    return _load_profiles(filename, _pool_settings)
+
+def _load_profiles(filename, settings):
+    return _load_file(filename, settings, False)[0]
+
 def load_ifts(filename_list):
     """
     Loads IFT files: .out GNOM files and .ift BIFT files. This is a
@@ -289,7 +448,7 @@ def load_ifts(filename_list):
 
     return iftm_list
 
-def load_series(filename_list, settings=None):
+def load_series(filename_list, settings=None, lazy=False):
     """
     Loads in series data. If all filenames provided at individual scattering
     profiles (e.g. .dat files or images that can be radially averaged into
@@ -309,6 +468,13 @@ def load_series(filename_list, settings=None):
         None. This is required if you are loading images into a series or if
         you wish to set the header style of the series loaded in, which is
         necessary for calculating the time point of each frame in the series.
+    lazy: bool, optional
+        Only used when loading series files. If True, the profiles of .hdf5
+        series files are read from the file when they are first used (e.g.
+        by ``series.getSASM()``), rather than all being loaded up front. The
+        series intensities and calculated values (Rg, MW, etc.) are
+        available without reading any profiles. The file must not be
+        changed while the series is in use. Default is False.
 
     Returns
     -------
@@ -331,6 +497,12 @@ def load_series(filename_list, settings=None):
             all_secm = False
             break
 
+    if all_secm and lazy:
+        series_list = [SASFileIO.loadSeriesFile(os.path.abspath(os.path.expanduser(name)),
+            settings, lazy=True) for name in filename_list]
+
+        return series_list
+
     sasm_list, iftm_list, series_list, img_list = load_files(filename_list, settings)
 
     if not all_secm:
@@ -400,7 +572,8 @@ def load_images(filename_list, settings, frame_num=None):
 
     return img_list, imghdr_list
 
-def load_and_integrate_images(filename_list, settings, return_all_images=False):
+def load_and_integrate_images(filename_list, settings, return_all_images=False,
+    n_proc=1, pool=None):
     """
     Loads in image files and radially averages them into 1D scattering
     profiles. This is a convenience wrapper for :py:func:`load_files` that
@@ -418,6 +591,15 @@ def load_and_integrate_images(filename_list, settings, return_all_images=False):
         If True, all loaded images are returned. If false, only the first loaded
         image of the last file is returned. Useful for minimizing memory use
         if loading and processing a large number of images. False by default.
+    n_proc: int, optional
+        The number of processes to use to load and radially average the
+        images. If greater than 1, a process pool is created for this call.
+        1 (load images in the current process) by default.
+    pool: :class:`multiprocessing.pool.Pool`, optional
+        A process pool made by :py:func:`make_load_pool`, to reuse when
+        loading many sets of images with the same settings. The settings the
+        pool was made with are used to load the images. If provided, n_proc
+        is ignored.
 
     Returns
     -------
@@ -429,7 +611,7 @@ def load_and_integrate_images(filename_list, settings, return_all_images=False):
         A list of individual images (:class:`numpy.array`) loaded in.
     """
     profile_list, iftm_list, secm_list, img_list = load_files(filename_list,
-        settings, return_all_images)
+        settings, return_all_images, n_proc, pool)
 
     return profile_list, img_list
 
@@ -481,6 +663,102 @@ def load_counter_values(filename_list, settings, new_filename_list=[]):
 
     return counter_list
 
+def load_roi_counters(filename_list, settings, rois=None, n_proc=1,
+    chunk_size=100):
+    """
+    Calculates region of interest (ROI) counters, the sum of the image in
+    each ROI, for every image in the files, and loads the header counters
+    (such as I0 and I1) for each image. The images are not radially
+    averaged, so this is a quick way to get a time series of the counters
+    (and so the transmission) for a run before reducing it.
+
+    Parameters
+    ----------
+    filename_list: list
+        A list of strings containing the full path to each image file to
+        calculate the counters for.
+    settings: :class:`bioxtasraw.RAWSettings.RAWSettings`
+        The RAW settings to be used when loading in the images and headers.
+    rois: dict, optional
+        A dictionary where each key is an ROI name and each value is an
+        ROI mask (:class:`numpy.array`) of the same shape as the images,
+        which is 1 for pixels in the ROI. If not provided, the transparent
+        beamstop mask in the settings is used for the roi_counter ROI, if
+        it is set.
+    n_proc: int, optional
+        The number of processes to use to load the files. If greater than
+        1, a process pool is created for this call. 1 (load files in the
+        current process) by default.
+    chunk_size: int, optional
+        The number of frames of multi-frame hdf5 files (such as Eiger
+        files) to read in at once. 100 by default.
+
+    Returns
+    -------
+    frame_names: list
+        A list of the filename of each image, in the form
+        <image_name>_00001.<ext> for multi-image files.
+    counters: dict
+        A dictionary where each key is an ROI or header counter name and
+        each value is an array of the value of that counter for each image.
+        Header counters which aren't numbers are not included, and images
+        that are missing a counter have a value of NaN.
+    """
+
+    if not isinstance(filename_list, list):
+        filename_list = [filename_list]
+
+    filename_list = [os.path.abspath(os.path.expanduser(filename))
+        for filename in filename_list]
+
+    if n_proc > 1 and len(filename_list) > 1:
+        mp_pool = make_load_pool(settings, min(n_proc, len(filename_list)))
+
+        try:
+            file_results = mp_pool.map(functools.partial(_pool_load_roi_counters,
+                rois=rois, chunk_size=chunk_size), filename_list)
+        finally:
+            mp_pool.close()
+            mp_pool.join()
+
+    else:
+        file_results = [SASFileIO.loadROICounters(filename, settings, rois,
+            chunk_size) for filename in filename_list]
+
+    frame_names = []
+    counter_list = []
+
+    for names, roi_counters, hdrs in file_results:
+        frame_names.extend(names)
+        counter_list.extend(hdrs)
+
+    counter_names = []
+
+    for hdr in counter_list:
+        for key in hdr:
+            if key not in counter_names:
+                counter_names.append(key)
+
+    counters = {}
+
+    for key in counter_names:
+        values = np.full(len(counter_list), np.nan)
+
+        try:
+            for j, hdr in enumerate(counter_list):
+                if key in hdr:
+                    values[j] = float(hdr[key])
+        except (TypeError, ValueError):
+            continue
+
+        counters[key] = values
+
+    return frame_names, counters
+
+def _pool_load_roi_counters(filename, rois, chunk_size):
+    return SASFileIO.loadROICounters(filename, _pool_settings, rois,
+        chunk_size)
+
 def load_mrc(filename_list):
     """
     Loads DENSS .mrc files.
@@ -512,7 +790,8 @@ def load_mrc(filename_list):
 
     return rhos, sides
 
-def integrate_image(img, settings, name, img_hdr={}, counters={}, load_path=''):
+def integrate_image(img, settings, name, img_hdr={}, counters={}, load_path='',
+    binnings=None):
     """
     Processes a loaded image into a 1D scattering profile.
 
@@ -532,11 +811,24 @@ def integrate_image(img, settings, name, img_hdr={}, counters={}, load_path=''):
         normalization.
     load_path: str, optional
         The load path of the image. Only used for metadata purposes.
+    binnings: dict, optional
+        If provided, rebinned profiles are also made from the same
+        integration of the image. Each key is a name for the rebinned
+        profile, and each value is a dictionary with any of the npts,
+        rebin_factor, and log_rebin keywords of :py:func:`rebin`, for
+        example ``{'svd': {'npts': 100}, 'log': {'npts': 200,
+        'log_rebin': True}}``. Unlike rebinning the profile afterwards,
+        each rebinned point is the average of all of the pixels in it,
+        as if the image had been integrated with the wider bins (for
+        integration methods that provide the per-bin sums).
 
     Returns
     -------
     profile: :class:`bioxtasraw.SASM.SASM`
         The integrated 1D scattering profile.
+    binned_profiles: dict
+        A dictionary of the rebinned profiles, with the same keys as
+        binnings. Only returned if binnings is provided.
     """
     if load_path != '':
         load_path = os.path.abspath(os.path.expanduser(load_path))
@@ -548,7 +840,13 @@ def integrate_image(img, settings, name, img_hdr={}, counters={}, load_path=''):
         'load_path'     : load_path
         }
 
-    profile = SASFileIO.processImage(img, parameters, settings)
+    profile = SASFileIO.processImage(img, parameters, settings, binnings)
+
+    if binnings is not None:
+        profile, binned_profiles = profile
+
+        for binned_profile in binned_profiles.values():
+            SASFileIO.postProcessProfile(binned_profile, settings, False)
 
     SASFileIO.postProcessProfile(profile, settings, False)
 
@@ -563,7 +861,10 @@ def integrate_image(img, settings, name, img_hdr={}, counters={}, load_path=''):
         for each_profile in profile:
             each_profile.setQrange(qrange)
 
-    return profile
+    if binnings is not None:
+        return profile, binned_profiles
+    else:
+        return profile
 
 def profiles_to_series(profiles, settings=None):
     """
@@ -700,7 +1001,7 @@ def save_ift(ift, fname=None, datadir='.'):
     savepath = os.path.abspath(os.path.expanduser(datadir))
     SASFileIO.saveMeasurement(ift, savepath, settings, filetype=newext)
 
-def save_series(series, fname=None, datadir='.'):
+def save_series(series, fname=None, datadir='.', append=False):
     """
     Saves an individual series as a .hdf5 file.
 
@@ -715,19 +1016,30 @@ def save_series(series, fname=None, datadir='.'):
     datadir: str, optional
         The directory to save the profile in. If no directory is provided,
         the current directory is used.
+    append: bool, optional
+        If True, and the series was last saved to the same file with
+        append, only new profiles are added to the file and the other series
+        data is updated in place, which is much faster for long series that
+        are saved repeatedly during data collection. Otherwise the whole
+        file is written. This is safe to use while the series is appended to
+        from another thread. Profiles that were already saved should not be
+        modified, such changes need a save without append. When appending,
+        the series filename parameter is not changed to fname.
     """
-    if fname is not None:
-        series = copy.deepcopy(series)
-        series.setParameter('filename', fname)
-    else:
+    if fname is None:
         fname = series.getParameter('filename')
+    elif not append:
+        # Only the parameters change, so the profiles don't need to be copied
+        series = copy.copy(series)
+        series.setAllParameters(copy.copy(series.getAllParameters()))
+        series.setParameter('filename', fname)
 
     fname = '{}.hdf5'.format(os.path.splitext(fname)[0])
 
     datadir = os.path.abspath(os.path.expanduser(datadir))
     savepath = os.path.join(datadir, fname)
 
-    SASFileIO.save_series(savepath, series)
+    SASFileIO.save_series(savepath, series, append=append)
 
 def save_settings(settings, fname, datadir='.'):
     """
@@ -1097,6 +1409,40 @@ def superimpose(profiles, ref_profile, scale=True, offset=False):
 
     return sup_profiles
 
+def remove_zingers(profiles, window_length=2, stds=5.0):
+    """
+    Removes spikes (zingers) from a set of consecutive profiles, such as the
+    profiles of a SEC-SAXS series, using the temporal neighbors of each q
+    point. A point is replaced by the median of the same q point in the
+    neighboring profiles if it is more than stds times its uncertainty above
+    that median. This works well when consecutive profiles are nearly
+    identical. The profiles must all have the same q vector.
+
+    Parameters
+    ----------
+    profiles: list
+        A list of profiles (:class:`bioxtasraw.SASM.SASM`), in the order
+        they were collected.
+    window_length: int, optional
+        The number of profiles on either side of each profile used to
+        calculate the median. Default is 2.
+    stds: float, optional
+        The threshold used to detect spikes, in units of the profile
+        uncertainty. Default is 5.
+
+    Returns
+    -------
+    dezingered_profiles: list
+        A list of profiles with the spikes removed. Each entry in the list
+        corresponds to the same entry in the input profiles list.
+    """
+
+    dezingered_profiles = [copy.deepcopy(profile) for profile in profiles]
+
+    SASProc.removeZingersStack(dezingered_profiles, window_length, stds)
+
+    return dezingered_profiles
+
 def auto_guinier(profile, error_weight=True, single_fit=True, settings=None):
     """
     Automatically calculates the Rg and I(0) values from the Guinier fit by
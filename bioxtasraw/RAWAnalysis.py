@@ -21760,15 +21760,9 @@ class LCSeriesControlPanel(wx.ScrolledWindow):
                                 baseline = np.zeros_like(i)
 
 
-                    parameters = copy.deepcopy(sasm.getAllParameters())
+                    parameters = SASM.copyParameters(sasm.getAllParameters())
 
-                    old_history = parameters['history']
-
-                    history1 = []
-                    history1.append(copy.deepcopy(sasm.getParameter('filename')))
-
-                    for key in old_history:
-                        history1.append({key:old_history[key]})
+                    history1 = SASM.getHistoryRecord(sasm)
 
                     history = {}
                     history['baseline_correction'] = {'initial_file':history1,
@@ -94,6 +94,9 @@ class ArtifactOptionsPanel(scrolled.ScrolledPanel):
                             'ZingerRemovalRadAvg',
                             'ZingerRemovalRadAvgStd',
                             'ZingerRemovalRadAvgIter',
+                            'ZingerRemovalStack',
+                            'ZingerRemovalStackStd',
+                            'ZingerRemovalStackWindow',
                             ]
 
         if 'style' in kwargs:
@@ -110,7 +113,10 @@ class ArtifactOptionsPanel(scrolled.ScrolledPanel):
 
         self.artifact_removal_data3 = ( ('Zinger removal during radial average', raw_settings.getIdAndType('ZingerRemovalRadAvg')),
                                       ('Discard threshold (std.):', raw_settings.getIdAndType('ZingerRemovalRadAvgStd')),
-                                      ('Number of iterations:', raw_settings.getIdAndType('ZingerRemovalRadAvgIter')))
+                                      ('Number of iterations:', raw_settings.getIdAndType('ZingerRemovalRadAvgIter')),
+                                      ('Zinger removal using neighboring frames in multi-frame files', raw_settings.getIdAndType('ZingerRemovalStack')),
+                                      ('Neighbor threshold (std.):', raw_settings.getIdAndType('ZingerRemovalStackStd')),
+                                      ('Neighbors on each side:', raw_settings.getIdAndType('ZingerRemovalStackWindow')))
 
         artifact_sizer = self.createArtifactRemoveSettings()
         artifact_sizer3 = self.createArtifactRemoveOnRadAvg()
@@ -234,7 +240,7 @@ class CalibrationOptionsPanel(scrolled.ScrolledPanel):
 
         detector_choices = self._get_detectors()
         integration_choices = ['numpy', 'cython', 'BBox', 'nosplit_csr', 'csr',
-            'full_csr']
+            'full_csr', 'raw_csr']
 
         if RAWGlobals.has_pyopencl:
             integration_choices.extend(['nosplit_csr_ocl', 'csr_ocl', 'full_csr_ocl'])
@@ -2601,6 +2607,7 @@ class GeneralOptionsPanel(scrolled.ScrolledPanel):
             'UseHeaderForMask', 'DetectorFlipped90', 'OnlineModeOnStartup',
             'OnlineStartupDir', 'DetectorFlipLR', 'DetectorFlipUD',
             'UseHeaderForConfig', 'HdrLoadConfigDir', 'ExcludeMaskFromImageScale',
+            'MemmapImages',
             ]# 'PromptConfigLoad']
 
         self.chkboxdata = [
@@ -2622,6 +2629,9 @@ class GeneralOptionsPanel(scrolled.ScrolledPanel):
                 raw_settings.getId('OnlineModeOnStartup')),
             ('Exclude masked pixels from image viewer scaling',
                 raw_settings.getId('ExcludeMaskFromImageScale')),
+            ('Memory map uncompressed TIFF and FReLoN images (image files '
+                'must not change while loaded)',
+                raw_settings.getId('MemmapImages')),
             ]
 
         options_sizer = self.createGeneralOptionsData()
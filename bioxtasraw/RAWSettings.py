@@ -36,6 +36,8 @@ import traceback
 import copy
 import os
 import json
+import collections
+import threading
 
 try:
     import wx
@@ -67,6 +69,18 @@ pickle_fix_exclude_keys = ['CurrentCfg', 'csvIncludeData',
 
 pickle_exclude_keys = ['AzimuthalIntegrator']
 
+# Functions called with the key whenever a setting is set, used to
+# invalidate values computed from the settings
+_settings_change_callbacks = []
+
+def addSettingsChangeCallback(callback):
+    if callback not in _settings_change_callbacks:
+        _settings_change_callbacks.append(callback)
+
+def removeSettingsChangeCallback(callback):
+    if callback in _settings_change_callbacks:
+        _settings_change_callbacks.remove(callback)
+
 class RawGuiSettings(object):
     """
     Essentially just a fancy wrapper for a big dictionary. It contains pretty
@@ -127,6 +141,11 @@ class RawGuiSettings(object):
                 'DetectorFlipLR' : [True, get_id(), 'bool'],
                 'DetectorFlipUD' : [False, get_id(), 'bool'],
 
+                # Memory map uncompressed TIFF and FReLoN images instead of
+                # reading them. The image files must not be changed or
+                # removed while the images are in use.
+                'MemmapImages'   : [False, get_id(), 'bool'],
+
                 #Image display
                 'ExcludeMaskFromImageScale' : [True, get_id(), 'bool'],
 
@@ -201,6 +220,10 @@ class RawGuiSettings(object):
                 'ZingerRemovalRadAvgStd'    : [5.0,     get_id(), 'float'],
                 'ZingerRemovalRadAvgIter'   : [5,       get_id(), 'int'],
 
+                'ZingerRemovalStack'        : [False,   get_id(), 'bool'],
+                'ZingerRemovalStackStd'     : [5.0,     get_id(), 'float'],
+                'ZingerRemovalStackWindow'  : [2,       get_id(), 'int'],
+
                 'ZingerRemoval'     : [False, get_id(), 'bool'],
                 'ZingerRemoveSTD'   : [4,     get_id(), 'int'],
                 'ZingerRemoveWinLen': [10,    get_id(), 'int'],
@@ -468,10 +491,10 @@ class RawGuiSettings(object):
         # all our instance attributes. Always use the dict.copy()
         # method to avoid modifying the original state.
         state = self.__dict__.copy()
-        # Remove the unpicklable entries.
-
-        for key in pickle_exclude_keys:
-            del state['_params'][key]
+        # Remove the unpicklable entries. The settings are copied so that
+        # pickling (e.g. to send to another process) doesn't modify them.
+        state['_params'] = {key : list(value) for key, value
+            in self._params.items() if key not in pickle_exclude_keys}
 
         if RAWGlobals.has_wx:
             for key in state['_params']:
@@ -490,9 +513,9 @@ class RawGuiSettings(object):
                     # state['_params'][key][1] = wx.WindowIDRef(state['_params'][key][1])
                      state['_params'][key][1] = state['_params'][key][1]
 
-            for key in pickle_exclude_keys:
-                #this is a hack, and only works for this specific case
-                state['_params'][key] = [None]
+        for key in pickle_exclude_keys:
+            #this is a hack, and only works for this specific case
+            state['_params'][key] = [None]
 
         self.__dict__.update(state)
 
@@ -526,6 +549,9 @@ class RawGuiSettings(object):
         """
         self._params[key][0] = value
 
+        for callback in _settings_change_callbacks:
+            callback(key)
+
     def getId(self, key):
         """
         Gets the Id associated with the setting. In the RAW GUI, this is a
@@ -739,6 +765,107 @@ def loadSettings(raw_settings, filename, auto_load = False):
 
     return True, msg, post_msg
 
+def createMaskMatrices(raw_settings):
+    """
+    Creates the mask matrices (and inverted matrices) for all of the masks in
+    the settings.
+    """
+    mask_dict = raw_settings.get('Masks')
+    img_dim = raw_settings.get('MaskDimension')
+
+    for each_key in mask_dict:
+        masks = mask_dict[each_key][1]
+
+        if masks is not None:
+            mask_img = SASMask.createMaskMatrix(img_dim, masks)
+            mask_param = mask_dict[each_key]
+            mask_param[0] = mask_img
+            mask_param[1] = masks
+            mask_param[2] = np.logical_not(mask_img)
+
+# Least recently used cache of loaded settings with mask matrices, keyed on
+# the config file path, modification time, and size
+settings_cache_size = 4
+_settings_cache = collections.OrderedDict()
+_settings_cache_lock = threading.Lock()
+
+def loadSettingsCached(raw_settings, filename, auto_load = False):
+    """
+    Loads settings from a file and creates the mask matrices, the same as
+    loadSettings followed by createMaskMatrices. The loaded settings and masks
+    are cached, so loading a file that hasn't changed since it was last loaded
+    copies the cached values into raw_settings instead of reading the file
+    and recreating the masks. Used when the config file is read from the
+    image header, which can happen for every image.
+    """
+    filename = os.path.abspath(filename)
+
+    try:
+        file_stat = os.stat(filename)
+        key = (filename, file_stat.st_mtime_ns, file_stat.st_size)
+    except OSError:
+        key = None
+
+    cached = None
+
+    if key is not None:
+        with _settings_cache_lock:
+            cached = _settings_cache.get(key)
+
+            if cached is not None:
+                _settings_cache.move_to_end(key)
+
+    if cached is None:
+        result = loadSettings(raw_settings, filename, auto_load)
+
+        if isinstance(result, bool) and not result:
+            return result
+
+        createMaskMatrices(raw_settings)
+
+        if key is not None and settings_cache_size > 0:
+            params = {each_key : copy.deepcopy(value[0]) for each_key, value
+                in raw_settings.getAllParams().items()
+                if each_key != 'Masks' and each_key not in pickle_exclude_keys}
+
+            masks = {mask_key : list(mask_param) for mask_key, mask_param
+                in raw_settings.get('Masks').items()}
+
+            with _settings_cache_lock:
+                _settings_cache[key] = (params, masks, result)
+
+                while len(_settings_cache) > settings_cache_size:
+                    _settings_cache.popitem(last=False)
+
+    else:
+        params, masks, result = cached
+
+        all_params = raw_settings.getAllParams()
+
+        for each_key, value in params.items():
+            # Arrays (flatfield and dark images) are shared with the cache,
+            # like the masks, so that integration plans made with them can be
+            # reused
+            if not isinstance(value, np.ndarray):
+                value = copy.deepcopy(value)
+
+            if each_key in all_params:
+                all_params[each_key][0] = value
+            else:
+                all_params[each_key] = [value, get_id(), '']
+
+        # The mask matrices are shared with the cache, and are not modified
+        # in place
+        raw_settings.set('Masks', {mask_key : [mask_param[0],
+            copy.copy(mask_param[1]), mask_param[2]] for mask_key, mask_param
+            in masks.items()})
+
+    return result
+
+def clearSettingsCache():
+    with _settings_cache_lock:
+        _settings_cache.clear()
+
 def postProcess(raw_settings, default_settings, loaded_param):
     fixBackwardsCompatibility(raw_settings, loaded_param)
 
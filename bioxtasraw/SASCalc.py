@@ -3259,8 +3259,9 @@ def validateBuffer(sasms, frame_idx, intensity, sim_test, sim_cor, sim_thresh,
     median = np.median(intensity)
     median_i_idx = (np.absolute(intensity-median)).argmin()
 
-    ref_sasm = sasms[median_i_idx].copy_no_metadata()
-    buffer_sasms = [sasm.copy_no_metadata() for sasm in sasms]
+    # Views, as the q ranges are changed for the similarity tests
+    ref_sasm = SASM.SASMView(sasms[median_i_idx])
+    buffer_sasms = [SASM.SASMView(sasm) for sasm in sasms]
     qi, qf = ref_sasm.getQrange()
 
     #Test for frame correlation
@@ -3416,7 +3417,19 @@ def significantSingularValues(sasms):
     return svd_results
 
 def prepareSASMsforSVD(sasms, err_norm=True, do_binning=True, bin_to=100):
-    if do_binning:
+    same_length = len(set(len(sasm.getQ()) for sasm in sasms)) == 1
+
+    if do_binning and same_length:
+        # The whole series is binned at once
+        i = np.array([sasm.getI() for sasm in sasms])
+        err = np.array([sasm.getErr() for sasm in sasms])
+
+        rb_fac = int(np.floor(i.shape[1]/float(bin_to)))
+
+        if rb_fac > 1:
+            _, i, err, _ = SASProc.rebinArrays(sasms[0].getQ(), i, err, rb_fac)
+
+    elif do_binning:
         rebinned_sasms = []
         for sasm in sasms:
             rb_fac = int(np.floor(len(sasm.getQ())/float(bin_to)))
@@ -3428,11 +3441,12 @@ def prepareSASMsforSVD(sasms, err_norm=True, do_binning=True, bin_to=100):
 
             rebinned_sasms.append(rb_sasm)
 
-    else:
-        rebinned_sasms = sasms
+        i = np.array([sasm.getI() for sasm in rebinned_sasms])
+        err = np.array([sasm.getErr() for sasm in rebinned_sasms])
 
-    i = np.array([sasm.getI() for sasm in rebinned_sasms])
-    err = np.array([sasm.getErr() for sasm in rebinned_sasms])
+    else:
+        i = np.array([sasm.getI() for sasm in sasms])
+        err = np.array([sasm.getErr() for sasm in sasms])
 
     i = i.T #Because of how numpy does the SVD, to get U to be the scattering vectors and V to be the other, we have to transpose
     err = err.T
@@ -3747,8 +3761,10 @@ def validateSample(sub_sasms, frame_idx, intensity, rg, vcmw, vpmw,
     sim_test, sim_cor, sim_thresh, fast):
     max_i_idx = np.argmax(intensity)
 
-    ref_sasm = sub_sasms[max_i_idx].copy_no_metadata()
-    superimpose_sub_sasms = [sasm.copy_no_metadata() for sasm in sub_sasms]
+    # Views, as the profiles are scaled and the q ranges are changed for the
+    # similarity tests
+    ref_sasm = SASM.SASMView(sub_sasms[max_i_idx])
+    superimpose_sub_sasms = [SASM.SASMView(sasm) for sasm in sub_sasms]
     SASProc.superimpose(ref_sasm, superimpose_sub_sasms, 'Scale')
     qi, qf = ref_sasm.getQrange()
 
@@ -4329,15 +4345,9 @@ def processBaseline(unsub_sasms, sub_sasms, r1, r2, bl_type, min_iter, max_iter,
                 err = sasm.getErr() * i/sasm.getI()
 
 
-            parameters = copy.deepcopy(sasm.getAllParameters())
-
-            old_history = parameters['history']
-
-            history1 = []
-            history1.append(copy.deepcopy(sasm.getParameter('filename')))
+            parameters = SASM.copyParameters(sasm.getAllParameters())
 
-            for key in old_history:
-                history1.append({key:old_history[key]})
+            history1 = SASM.getHistoryRecord(sasm)
 
             history = {}
             history['baseline_correction'] = {'initial_file':history1,
@@ -4384,15 +4394,9 @@ def processBaseline(unsub_sasms, sub_sasms, r1, r2, bl_type, min_iter, max_iter,
                     baseline = np.zeros_like(i)
 
 
-            parameters = copy.deepcopy(sasm.getAllParameters())
-
-            old_history = parameters['history']
-
-            history1 = []
-            history1.append(copy.deepcopy(sasm.getParameter('filename')))
+            parameters = SASM.copyParameters(sasm.getAllParameters())
 
-            for key in old_history:
-                history1.append({key:old_history[key]})
+            history1 = SASM.getHistoryRecord(sasm)
 
             history = {}
             history['baseline_correction'] = {'initial_file':history1,
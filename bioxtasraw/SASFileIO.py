@@ -31,6 +31,7 @@ import six
 import hdf5plugin #This has to be imported before fabio, and h5py (and, I think, PIL/pillow) . . .
 
 import os
+import sys
 import re
 import time
 import struct
@@ -38,6 +39,10 @@ import json
 import copy
 import collections
 import datetime
+import threading
+import locale
+import weakref
+import operator
 from xml.dom import minidom
 import ast
 import traceback
@@ -107,14 +112,71 @@ def loadFabio(filename, hdf5_file=None, next_image=None):
 
     return img, img_hdr, num_frames
 
-def loadTiffImage(filename):
+def loadFabioStack(filename, hdf5_file, start, stop):
+    """
+    Loads frames start to stop (not inclusive) of a multi-frame hdf5 file
+    (such as an Eiger data file) as a single 3D array (frames, y, x). Where
+    possible the frames are read as one slice of the underlying h5py
+    datasets, rather than one frame at a time. The file is closed once the
+    last frame has been read.
+    """
+    fabio_img = hdf5_file
+
+    num_frames = fabio_img.nframes
+    stop = min(stop, num_frames)
+
+    datasets = getattr(fabio_img, 'dataset', None)
+
+    if (isinstance(datasets, list) and
+        all(ds is not None and ds.ndim == 3 for ds in datasets)):
+        img_blocks = []
+        ds_start = 0
+
+        for ds in datasets:
+            ds_stop = ds_start + ds.shape[0]
+
+            if ds_stop > start and ds_start < stop:
+                img_blocks.append(ds[max(start-ds_start, 0):min(stop, ds_stop)-ds_start])
+
+            ds_start = ds_stop
+
+        if len(img_blocks) == 1:
+            img = img_blocks[0]
+        else:
+            img = np.concatenate(img_blocks)
+
+        img_hdr = [copy.copy(fabio_img.header) for i in range(start, stop)]
+
+    else:
+        img_list = []
+        img_hdr = []
+
+        for i in range(start, stop):
+            frame = fabio_img.get_frame(i)
+            img_list.append(frame.data)
+            img_hdr.append(frame.header)
+
+        img = np.stack(img_list)
+
+    if stop == num_frames:
+        fabio_img.close()
+
+    return img, img_hdr, num_frames
+
+def loadTiffImage(filename, memmap=False):
     ''' Load TIFF image '''
     try:
-        im = Image.open(filename)
-        img = np.fromstring(im.tobytes(), np.uint16) #tobytes is compatible with pillow >=3.0, tostring was depreciated
+        if memmap:
+            img = memmapTiffImage(filename, np.uint16)
+        else:
+            img = None
 
-        img = np.reshape(img, im.size)
-        im.close()
+        if img is None:
+            im = Image.open(filename)
+            img = np.fromstring(im.tobytes(), np.uint16) #tobytes is compatible with pillow >=3.0, tostring was depreciated
+
+            img = np.reshape(img, im.size)
+            im.close()
     except IOError:
         return None, {}
 
@@ -122,14 +184,20 @@ def loadTiffImage(filename):
 
     return img, img_hdr
 
-def load32BitTiffImage(filename):
+def load32BitTiffImage(filename, memmap=False):
     ''' Load TIFF image '''
     try:
-        im = Image.open(filename)
-        img = np.fromstring(im.tobytes(), np.uint32) #tobytes is compatible with pillow >=3.0, tostring was depreciated
+        if memmap:
+            img = memmapTiffImage(filename, np.uint32)
+        else:
+            img = None
 
-        img = np.reshape(img, im.size)
-        im.close()
+        if img is None:
+            im = Image.open(filename)
+            img = np.fromstring(im.tobytes(), np.uint32) #tobytes is compatible with pillow >=3.0, tostring was depreciated
+
+            img = np.reshape(img, im.size)
+            im.close()
     #except IOError:
     except Exception as e:
         print(e)
@@ -139,9 +207,76 @@ def load32BitTiffImage(filename):
 
     return img, img_hdr
 
+# (PIL image mode, TIFF raw mode) pairs where the bytes in the file are the
+# same as the bytes PIL would give for the image on a little endian machine
+_memmap_tiff_modes = {
+    ('I;16', 'I;16')    : 2,
+    ('I', 'I;32S')      : 4,
+    ('I', 'I')          : 4,
+    ('F', 'F;32F')      : 4,
+    ('F', 'F')          : 4,
+    }
+
+def memmapTiffImage(filename, dtype):
+    '''
+    Memory maps the image data of an uncompressed TIFF file, rather than
+    reading it into memory. The image is mapped copy-on-write, so it can be
+    modified without changing the file. Returns the same array as reading
+    the PIL image bytes as dtype and reshaping to the image size, or None if
+    the image data isn't stored as a single uncompressed block that can be
+    mapped.
+
+    The array maps the file for as long as it is referenced, so the file
+    must not be truncated or rewritten while it is in use (the process
+    crashes with a bus error if it is), and on Windows the file can't be
+    deleted or moved. Because of this it is only used when the MemmapImages
+    setting is on, which is off by default and shouldn't be used with online
+    mode or network file systems, where files may be overwritten.
+    '''
+    if sys.byteorder != 'little':
+        return None
+
+    with Image.open(filename) as im:
+        mode = im.mode
+        size = im.size
+        tiles = list(im.tile)
+
+    if len(tiles) == 0:
+        return None
+
+    itemsize = np.dtype(dtype).itemsize
+    rawmode = tiles[0][3][0]
 
+    if _memmap_tiff_modes.get((mode, rawmode)) != itemsize:
+        return None
+
+    offset = tiles[0][2]
+    next_offset = offset
+    next_row = 0
+
+    # Strips have to be full width, in order, and next to each other in the file
+    for tile in tiles:
+        codec, extents, tile_offset, args = tile[:4]
+
+        if (codec != 'raw' or args[0] != rawmode
+            or (len(args) > 1 and args[1] not in (0, size[0]*itemsize))
+            or (len(args) > 2 and args[2] != 1)
+            or tile_offset != next_offset or extents[0] != 0
+            or extents[1] != next_row or extents[2] != size[0]):
+            return None
+
+        next_row = extents[3]
+        next_offset = tile_offset + (extents[3]-extents[1])*size[0]*itemsize
+
+    if next_row != size[1] or next_offset > os.path.getsize(filename):
+        return None
 
-def loadFrelonImage(filename):
+    img = np.memmap(filename, dtype=dtype, mode='c', offset=offset,
+        shape=size)
+
+    return img.view(np.ndarray)
+
+def loadFrelonImage(filename, memmap=False):
 
     with open(filename, 'rb') as fo:
 
@@ -152,7 +287,7 @@ def loadFrelonImage(filename):
 
         hdr_size = 1
         byte = None
-        while byte != '}' and hdr_size !=eof:
+        while byte != b'}' and hdr_size !=eof:
             byte = fo.read(1)
             hdr_size = hdr_size + 1
             if hdr_size > 10000:
@@ -160,7 +295,7 @@ def loadFrelonImage(filename):
 
         ######################## PARSE HEADER ###################
         fo.seek(0)
-        header = fo.read(hdr_size)
+        header = fo.read(hdr_size).decode('ascii', errors='ignore')
         header = header.split('\n')
 
         header_dict = {}
@@ -172,17 +307,22 @@ def loadFrelonImage(filename):
 
             if len(sp_line) == 2:
                 header_dict[sp_line[0].strip()] = sp_line[1].strip()[:-2]
-            elif len>2:
+            elif len(sp_line) > 2:
                 header_dict[sp_line[0].strip()] = each[each.find('=')+2:-2]
 
         #print header_dict
 
-        fo.seek(hdr_size)
+    dim1 = int(header_dict['Dim_1'])
+    dim2 = int(header_dict['Dim_2'])
 
-        dim1 = int(header_dict['Dim_1'])
-        dim2 = int(header_dict['Dim_2'])
-
-        img = np.fromfile(fo, dtype='<i2')
+    # The image is uncompressed after the header, so it can be memory mapped
+    # rather than read in (see memmapTiffImage for the constraints on this)
+    if memmap:
+        img = np.memmap(filename, dtype='<i2', mode='c', offset=hdr_size,
+            shape=(dim1, dim2)).view(np.ndarray)
+    else:
+        img = np.fromfile(filename, dtype='<i2', count=dim1*dim2,
+            offset=hdr_size)
         img = np.reshape(img, (dim1, dim2))
 
     img_hdr = header_dict
@@ -428,6 +568,179 @@ def parseCHESSF2CTSfile(filename, new_filename=None):
 
     return counters
 
+class CounterFileIndex(object):
+    """
+    The lines of a counter or log file (such as a SPEC file) that is read by
+    the header parsers for every image, along with an index of where the SPEC
+    scans start. The file is only read again if it changes. If it only grows,
+    as during data collection, just the new lines are read in.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lines = []
+        self.scans = {}
+
+        self._size = -1
+        self._mtime = None
+        self._read_offset = 0
+        self._tail = b''
+        self._partial_lines = []
+
+    def update(self):
+        file_stat = os.stat(self.filename)
+
+        if file_stat.st_size == self._size and file_stat.st_mtime_ns == self._mtime:
+            return
+
+        with open(self.filename, 'rb') as f:
+            # Only read the new part if the file was appended to, checked by
+            # the end of what was already read being unchanged
+            appended = (self._size >= 0 and file_stat.st_size > self._size
+                and file_stat.st_size >= self._read_offset)
+
+            if appended:
+                f.seek(self._read_offset - len(self._tail))
+                appended = f.read(len(self._tail)) == self._tail
+
+            if not appended:
+                self.lines = []
+                self.scans = {}
+                self._read_offset = 0
+                self._tail = b''
+
+            f.seek(self._read_offset)
+            data = f.read()
+
+        # Only complete lines are indexed, a partially written last line is
+        # read again next time
+        end = data.rfind(b'\n') + 1
+
+        new_lines = self._splitLines(data[:end])
+
+        for i, line in enumerate(new_lines):
+            if line.startswith('#S'):
+                splitline = line.split()
+
+                if (len(splitline) > 1 and splitline[0] == '#S'
+                    and splitline[1] not in self.scans):
+                    self.scans[splitline[1]] = len(self.lines) + i
+
+        self.lines.extend(new_lines)
+        self._read_offset += end
+        self._tail = (self._tail + data[:end])[-64:]
+
+        self._partial_lines = self._splitLines(data[end:])
+
+        self._size = file_stat.st_size
+        self._mtime = file_stat.st_mtime_ns
+
+    def _splitLines(self, data):
+        # Same line splitting as readlines with universal newlines
+        text = data.decode(locale.getpreferredencoding(False))
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+        lines = [line + '\n' for line in text.split('\n')]
+        lines[-1] = lines[-1][:-1]
+
+        if lines[-1] == '':
+            lines.pop()
+
+        return lines
+
+    def getLines(self):
+        if len(self._partial_lines) > 0:
+            lines = self.lines + self._partial_lines
+        else:
+            lines = self.lines
+
+        return lines
+
+    def findSpecScan(self, filenumber):
+        """
+        Returns the line numbers of the #S (start), #D (date), and #L (labels)
+        lines for a SPEC scan, or None for any that aren't found.
+        """
+        start_idx = None
+        label_idx = None
+        date_idx = None
+
+        filenumber = str(filenumber)
+
+        lines = self.getLines()
+
+        scan_start = self.scans.get(filenumber)
+
+        if scan_start is None:
+            for line_num in range(len(self.lines), len(lines)):
+                splitline = lines[line_num].split()
+
+                if (len(splitline) > 1 and splitline[0] == '#S'
+                    and splitline[1] == filenumber):
+                    scan_start = line_num
+                    break
+
+        if scan_start is not None:
+            for line_num in range(scan_start, len(lines)):
+                splitline = lines[line_num].split()
+
+                if len(splitline) > 1:
+                    if splitline[0] == '#S' and splitline[1] == filenumber:
+                        start_idx = line_num
+
+                    if splitline[0] == '#D':
+                        date_idx = line_num
+
+                    if splitline[0] == '#L':
+                        label_idx = line_num
+                        break
+
+        return start_idx, date_idx, label_idx
+
+# Least recently used cache of counter file indexes, keyed on path
+counter_file_cache_size = 16
+_counter_files = collections.OrderedDict()
+_counter_files_lock = threading.Lock()
+
+def getCounterFileIndex(filename):
+    """
+    Returns an up to date CounterFileIndex for the file. Raises an error
+    if the file can't be read.
+    """
+    filename = os.path.abspath(filename)
+
+    with _counter_files_lock:
+        index = _counter_files.get(filename)
+
+        if index is None:
+            index = CounterFileIndex(filename)
+        else:
+            del _counter_files[filename]
+
+        index.update()
+
+        _counter_files[filename] = index
+
+        while len(_counter_files) > counter_file_cache_size:
+            _counter_files.popitem(last=False)
+
+    return index
+
+def readCounterFileLines(filename):
+    """Returns the lines of a counter file, the same as readlines"""
+    return getCounterFileIndex(filename).getLines()
+
+def readSpecScan(countFilename, filenumber):
+    """
+    Returns the lines of a SPEC counter file and the line numbers of the
+    start, date, and label lines for the scan.
+    """
+    index = getCounterFileIndex(countFilename)
+
+    start_idx, date_idx, label_idx = index.findSpecScan(filenumber)
+
+    return index.getLines(), start_idx, date_idx, label_idx
+
 def parseCHESSEIGER4MCountFile(filename, new_filename=None):
     ''' Loads information from the counter file at CHESS, id7a from
     the image filename. EIGER .h5 files with 1-based frame numbers '''
@@ -452,31 +765,8 @@ def parseCHESSEIGER4MCountFile(filename, new_filename=None):
 
     countFilename = os.path.join(dir, countFile)
 
-    with open(countFilename,'rU') as f:
-        allLines = f.readlines()
-
-    line_num = 0
-    start_found = False
-    start_idx = None
-    label_idx = None
-    date_idx = None
-
-    for eachLine in allLines:
-        splitline = eachLine.split()
-
-        if len(splitline) > 1:
-            if splitline[0] == '#S' and splitline[1] == str(filenumber):
-                start_found = True
-                start_idx = line_num
-
-            if splitline[0] == '#D' and start_found:
-                date_idx = line_num
-
-            if splitline[0] == '#L' and start_found:
-                label_idx = line_num
-                break
-
-        line_num = line_num + 1
+    allLines, start_idx, date_idx, label_idx = readSpecScan(countFilename,
+        filenumber)
 
     counters = {}
     try:
@@ -520,31 +810,8 @@ def parseCHESSG1CountFile(filename, new_filename=None):
 
     countFilename = os.path.join(dir, countFile)
 
-    with open(countFilename,'rU') as f:
-        allLines = f.readlines()
-
-    line_num = 0
-    start_found = False
-    start_idx = None
-    label_idx = None
-    date_idx = None
-
-    for eachLine in allLines:
-        splitline = eachLine.split()
-
-        if len(splitline) > 1:
-            if splitline[0] == '#S' and splitline[1] == str(filenumber):
-                start_found = True
-                start_idx = line_num
-
-            if splitline[0] == '#D' and start_found:
-                date_idx = line_num
-
-            if splitline[0] == '#L' and start_found:
-                label_idx = line_num
-                break
-
-        line_num = line_num + 1
+    allLines, start_idx, date_idx, label_idx = readSpecScan(countFilename,
+        filenumber)
 
     counters = {}
     try:
@@ -586,31 +853,8 @@ def parseCHESSG1CountFileWAXS(filename, new_filename=None):
 
     countFilename = os.path.join(dir, countFile)
 
-    with open(countFilename,'rU') as f:
-        allLines = f.readlines()
-
-    line_num = 0
-    start_found = False
-    start_idx = None
-    label_idx = None
-    date_idx = None
-
-    for eachLine in allLines:
-        splitline = eachLine.split()
-
-        if len(splitline) > 1:
-            if splitline[0] == '#S' and splitline[1] == str(filenumber):
-                start_found = True
-                start_idx = line_num
-
-            if splitline[0] == '#D' and start_found:
-                date_idx = line_num
-
-            if splitline[0] == '#L' and start_found:
-                label_idx = line_num
-                break
-
-        line_num = line_num + 1
+    allLines, start_idx, date_idx, label_idx = readSpecScan(countFilename,
+        filenumber)
 
     counters = {}
     try:
@@ -655,31 +899,8 @@ def parseCHESSG1CountFileEiger(filename, new_filename=None):
 
     countFilename = os.path.join(dirname, countFile)
 
-    with open(countFilename,'rU') as f:
-        allLines = f.readlines()
-
-    line_num = 0
-    start_found = False
-    start_idx = None
-    label_idx = None
-    date_idx = None
-
-    for eachLine in allLines:
-        splitline = eachLine.split()
-
-        if len(splitline) > 1:
-            if splitline[0] == '#S' and splitline[1] == str(filenumber):
-                start_found = True
-                start_idx = line_num
-
-            if splitline[0] == '#D' and start_found:
-                date_idx = line_num
-
-            if splitline[0] == '#L' and start_found:
-                label_idx = line_num
-                break
-
-        line_num = line_num + 1
+    allLines, start_idx, date_idx, label_idx = readSpecScan(countFilename,
+        filenumber)
 
     counters = {}
 
@@ -790,8 +1011,7 @@ def parseBioCATlogfile(filename, new_filename=None):
         countFilename=os.path.join(datadir, '_'.join(fname.split('_')[:-1])+'.log')
         searchName='.'.join(fname.split('.')[:-1])
 
-    with open(countFilename,'rU') as f:
-        allLines=f.readlines()
+    allLines = readCounterFileLines(countFilename)
 
     line_num=0
 
@@ -991,6 +1211,9 @@ all_image_types = {
                    # 'NeXus'           : loadNeXusFile,
                                       }
 
+# Loaders that can memory map the image (see memmapTiffImage)
+memmap_image_loaders = [loadTiffImage, load32BitTiffImage, loadFrelonImage]
+
 
 def loadAllHeaders(filename, image_type, header_type, raw_settings):
     ''' returns the image header and the info from the header file only. '''
@@ -1041,9 +1264,9 @@ def loadAllHeaders(filename, image_type, header_type, raw_settings):
 
     if tbs_mask is not None:
         if isinstance(img, list):
-            roi_counter = img[0][tbs_mask==1].sum() #In the case of multiple images in the same file, load the ROI for the first one
+            roi_counter = SASImage.calcROICounter(img[0], tbs_mask) #In the case of multiple images in the same file, load the ROI for the first one
         else:
-            roi_counter = img[tbs_mask==1].sum()
+            roi_counter = SASImage.calcROICounter(img, tbs_mask)
 
         if hdr is None:
             hdr = {'roi_counter': roi_counter}
@@ -1081,19 +1304,26 @@ def loadHeader(filename, new_filename, header_type):
 
     return hdr
 
-def loadImage(filename, raw_settings, hdf5_file=None, next_image=None):
+def loadImage(filename, raw_settings, hdf5_file=None, next_image=None,
+    memmap=None):
     ''' returns the loaded image based on the image filename
-    and image type. '''
+    and image type. memmap overrides the MemmapImages setting if it isn't
+    None. '''
     image_type = raw_settings.get('ImageFormat')
     fliplr = raw_settings.get('DetectorFlipLR')
     flipud = raw_settings.get('DetectorFlipUD')
 
+    if memmap is None:
+        memmap = raw_settings.get('MemmapImages')
+
     num_frames = 1
 
     try:
         if all_image_types[image_type] == loadFabio:
             img, imghdr, num_frames = all_image_types[image_type](filename,
                 hdf5_file, next_image)
+        elif all_image_types[image_type] in memmap_image_loaders:
+            img, imghdr = all_image_types[image_type](filename, memmap)
         else:
             img, imghdr = all_image_types[image_type](filename)
     except (ValueError, TypeError, KeyError, fabio.fabioutils.NotGoodReader, Exception) as msg:
@@ -1123,6 +1353,25 @@ def loadImage(filename, raw_settings, hdf5_file=None, next_image=None):
 
     return img, imghdr, num_frames
 
+def loadImageStack(filename, raw_settings, hdf5_file, start, stop):
+    ''' returns frames start to stop of a multi-frame hdf5 image file
+    as a 3D array, along with a list of the frame headers. '''
+    fliplr = raw_settings.get('DetectorFlipLR')
+    flipud = raw_settings.get('DetectorFlipUD')
+
+    try:
+        img, imghdr, num_frames = loadFabioStack(filename, hdf5_file, start,
+            stop)
+    except (ValueError, TypeError, KeyError, fabio.fabioutils.NotGoodReader, Exception) as msg:
+        raise SASExceptions.WrongImageFormat('Error loading image, ' + str(msg))
+
+    if fliplr:
+        img = img[:, :, ::-1]
+    if flipud:
+        img = img[:, ::-1, :]
+
+    return img, imghdr, num_frames
+
 #################################
 #--- ** MAIN LOADING FUNCTION **
 #################################
@@ -1270,14 +1519,23 @@ def loadAsciiFile(filename, file_type):
     return sasm
 
 
-def loadImageFile(filename, raw_settings, hdf5_file=None, return_all_images=True):
+def loadImageFile(filename, raw_settings, hdf5_file=None, return_all_images=True,
+    chunk_size=100):
     hdr_fmt = raw_settings.get('ImageHdrFormat')
+    image_type = raw_settings.get('ImageFormat')
 
     if hdf5_file is not None:
         is_hdf5 = True
     else:
         is_hdf5 = False
 
+    if (is_hdf5 and hdf5_file.nframes > 1
+        and all_image_types.get(image_type) == loadFabio):
+        sasm_list, loaded_data = loadHdf5ImageStack(filename, raw_settings,
+            hdf5_file, return_all_images, chunk_size)
+
+        return sasm_list, loaded_data
+
     load_one_frame = False
 
     if is_hdf5 and hdf5_file.nframes > 1:
@@ -1359,7 +1617,246 @@ def loadImageFile(filename, raw_settings, hdf5_file=None, return_all_images=True
 
     return sasm_list, loaded_data
 
-def processImage(img, parameters, raw_settings):
+def loadHdf5ImageStack(filename, raw_settings, hdf5_file, return_all_images=True,
+    chunk_size=100):
+    """
+    Loads and integrates a multi-frame hdf5 file, such as an Eiger data file,
+    chunk_size frames at a time. Each chunk is read as a single 3D array and
+    integrated with one integration setup. Gives the same profiles and
+    filenames as loading and integrating the frames one at a time.
+    """
+    hdr_fmt = raw_settings.get('ImageHdrFormat')
+
+    num_frames = hdf5_file.nframes
+    chunk_size = max(int(chunk_size), 1)
+
+    base_filename = os.path.split(filename)[1]
+
+    base_hdr = loadHeader(filename, makeFrameFilename(base_filename, 1), hdr_fmt)
+
+    offset = getFrameOffset(filename, base_hdr)
+
+    loaded_data = []
+    sasm_list = []
+
+    for start in range(0, num_frames, chunk_size):
+        stop = min(start+chunk_size, num_frames)
+
+        imgs, img_hdrs, _ = loadImageStack(filename, raw_settings, hdf5_file,
+            start, stop)
+
+        if return_all_images:
+            loaded_data.extend(list(imgs))
+        elif start == 0:
+            loaded_data.append(np.array(imgs[0]))
+
+        parameters_list = []
+
+        for i in range(len(imgs)):
+            frame_num = start+i+offset+1
+            new_filename = makeFrameFilename(base_filename, frame_num)
+
+            if frame_num == 1:
+                hdrfile_info = base_hdr
+            else:
+                hdrfile_info = loadHeader(filename, new_filename, hdr_fmt)
+
+            parameters = {'imageHeader' : img_hdrs[i],
+                          'counters'    : hdrfile_info,
+                          'filename'    : new_filename,
+                          'load_path'   : filename}
+
+            parameters_list.append(parameters)
+
+        sasm_list.extend(processImageStack(imgs, parameters_list, raw_settings))
+
+    return sasm_list, loaded_data
+
+def getFrameOffset(filename, base_hdr, frames_per_file=1):
+    """
+    Returns the frame number offset of a multi-frame file, for data files
+    that are one of a numbered series (such as Eiger data files).
+    """
+    if not filename.endswith('master.h5'):
+        sname_offset = int(os.path.splitext(filename)[0].split('_')[-1])-1
+    else:
+        sname_offset = 0
+
+    if 'Number_of_images_per_file' in base_hdr:
+        mult = int(base_hdr['Number_of_images_per_file'])
+    else:
+        mult = frames_per_file
+
+    return sname_offset*mult
+
+def loadROICounters(filename, raw_settings, rois=None, chunk_size=100):
+    """
+    Calculates ROI counters for every frame of an image file without
+    radially averaging the images. rois is a dictionary of ROI names and
+    masks. If it's None, the transparent beamstop mask is used as the
+    roi_counter ROI, if it's set. Multi-frame hdf5 files are read chunk_size
+    frames at a time.
+
+    Returns a list of the frame filenames, a dictionary of ROI names and
+    arrays of the counter values for each frame, and a list of the header
+    file counters for each frame (including the ROI counters).
+    """
+    hdr_fmt = raw_settings.get('ImageHdrFormat')
+    image_type = raw_settings.get('ImageFormat')
+
+    if rois is None:
+        tbs_mask = raw_settings.get('Masks')['TransparentBSMask'][0]
+
+        if tbs_mask is not None:
+            rois = {'roi_counter': tbs_mask}
+        else:
+            rois = {}
+
+    if checkFileType(filename) == 'hdf5':
+        try:
+            hdf5_file = fabio.open(filename)
+        except Exception:
+            hdf5_file = None
+    else:
+        hdf5_file = None
+
+    base_filename = os.path.split(filename)[1]
+
+    filenames = []
+    roi_counters = {name: [] for name in rois}
+    counters = []
+
+    if (hdf5_file is not None and hdf5_file.nframes > 1
+        and all_image_types.get(image_type) == loadFabio):
+        num_frames = hdf5_file.nframes
+        chunk_size = max(int(chunk_size), 1)
+
+        base_hdr = loadHeader(filename, makeFrameFilename(base_filename, 1),
+            hdr_fmt)
+
+        offset = getFrameOffset(filename, base_hdr)
+
+        for start in range(0, num_frames, chunk_size):
+            stop = min(start+chunk_size, num_frames)
+
+            imgs, _, _ = loadImageStack(filename, raw_settings, hdf5_file,
+                start, stop)
+
+            chunk_counters = SASImage.calcROICountersStack(imgs, rois)
+
+            for name in rois:
+                roi_counters[name].append(chunk_counters[name])
+
+            for i in range(stop-start):
+                frame_num = start+i+offset+1
+                filenames.append(makeFrameFilename(base_filename, frame_num))
+
+        for i, new_filename in enumerate(filenames):
+            if i == 0 and offset == 0:
+                counters.append(base_hdr)
+            else:
+                counters.append(loadHeader(filename, new_filename, hdr_fmt))
+
+    else:
+        if hdf5_file is not None and hdf5_file.nframes > 1:
+            num_frames = hdf5_file.nframes
+            load_one_frame = True
+        else:
+            num_frames = 1
+            load_one_frame = False
+
+        offset = 0
+
+        for file_num in range(num_frames):
+            if load_one_frame:
+                imgs, _, _ = loadImage(filename, raw_settings, hdf5_file, file_num)
+            else:
+                imgs, _, _ = loadImage(filename, raw_settings, hdf5_file)
+
+            multi_frame = len(imgs) > 1 or hdf5_file is not None
+
+            if multi_frame and file_num == 0:
+                base_hdr = loadHeader(filename,
+                    makeFrameFilename(base_filename, 1), hdr_fmt)
+                offset = getFrameOffset(filename, base_hdr, len(imgs))
+
+            frame_counters = SASImage.calcROICountersStack(imgs, rois)
+
+            for name in rois:
+                roi_counters[name].append(frame_counters[name])
+
+            for i in range(len(imgs)):
+                if multi_frame:
+                    new_filename = makeFrameFilename(base_filename,
+                        i+file_num+offset+1)
+                else:
+                    new_filename = base_filename
+
+                filenames.append(new_filename)
+                counters.append(loadHeader(filename, new_filename, hdr_fmt))
+
+    roi_counters = {name: np.concatenate(roi_counters[name])
+        for name in roi_counters}
+
+    for i, hdr in enumerate(counters):
+        if hdr is None:
+            hdr = counters[i] = {}
+
+        for name in roi_counters:
+            hdr[name] = roi_counters[name][i]
+
+    return filenames, roi_counters, counters
+
+def makeFrameFilename(filename, frame_num):
+    temp_filename = filename.split('.')
+
+    if len(temp_filename) > 1:
+        temp_filename[-2] = temp_filename[-2] + '_%05i' %(frame_num)
+    else:
+        temp_filename[0] = temp_filename[0] + '_%05i' %(frame_num)
+
+    new_filename = '.'.join(temp_filename)
+
+    return new_filename
+
+def processImage(img, parameters, raw_settings, binnings=None):
+    setImageConc(parameters, raw_settings)
+
+    sasm = SASImage.integrateCalibrateNormalize(img, parameters, raw_settings,
+        binnings)
+
+    if binnings is not None:
+        sasm, binned_sasms = sasm
+
+        for binned_sasm in binned_sasms.values():
+            setImageUVVis(binned_sasm, raw_settings)
+
+    setImageUVVis(sasm, raw_settings)
+
+    if binnings is not None:
+        return sasm, binned_sasms
+    else:
+        return sasm
+
+def processImageStack(imgs, parameters_list, raw_settings, binnings=None):
+    for parameters in parameters_list:
+        setImageConc(parameters, raw_settings)
+
+    sasm_list = SASImage.integrateCalibrateNormalizeStack(imgs, parameters_list,
+        raw_settings, binnings)
+
+    for sasm in sasm_list:
+        if binnings is not None:
+            sasm, binned_sasms = sasm
+
+            for binned_sasm in binned_sasms.values():
+                setImageUVVis(binned_sasm, raw_settings)
+
+        setImageUVVis(sasm, raw_settings)
+
+    return sasm_list
+
+def setImageConc(parameters, raw_settings):
     for key in parameters['counters']:
         if key.lower().find('concentration') > -1 or key.lower().find('mg/ml') > -1:
             if ('BioCAT' in raw_settings.get('ImageHdrFormat') and
@@ -1375,11 +1872,9 @@ def processImage(img, parameters, raw_settings):
                 parameters['Conc'] = parameters['counters'][key]
                 break
 
-
-    sasm = SASImage.integrateCalibrateNormalize(img, parameters, raw_settings)
-
-    img_hdr = parameters['imageHeader']
-    hdrfile_info = parameters['counters']
+def setImageUVVis(sasm, raw_settings):
+    img_hdr = sasm.getParameter('imageHeader')
+    hdrfile_info = sasm.getParameter('counters')
 
     ### Check for UV data if set in bindlist
     if raw_settings.get('UseHeaderForCalib'):
@@ -1391,8 +1886,6 @@ def processImage(img, parameters, raw_settings):
                                                      'UVTransmission'     : uvvis[1],
                                                      'UVDarkTransmission' : uvvis[2]}
 
-    return sasm
-
 def loadHdf5File(filename, raw_settings):
     """
     General notes:
@@ -1988,21 +2481,261 @@ def load_series_sasm(group, data_name, q_raw=None, use_group_q=True, q_err_raw=N
 
     return sasm_data
 
-def load_series_sasm_list(group, excluded_keys=['raw', 'q', 'q_err']):
-    q_raw = None
-    q_err_raw = None
-    sasm_list = []
+def load_series_sasm_table(group):
+    """
+    Loads the profiles of a group saved by save_series_sasm_table.
+    """
+    q_vals = group['q'][()]
 
-    if 'raw' in group:
-        raw_group = group['raw']
+    if q_vals.ndim == 2:
+        q_raw = q_vals[:, 0]
+        q_err_raw = q_vals[:, 1]
+    else:
+        q_raw = q_vals
+        q_err_raw = None
 
-        if 'q' in raw_group:
-            q_raw = raw_group['q'][()]
+    intensity = group['intensity'][()]
+    error = group['error'][()]
+    frame_info = group['frame_info'][()]
 
-        elif 'q' in group:
-            q_raw = group['q'][()]
+    parameters = loadDatHeaders(group['parameters'][()])
 
-    elif 'q' in group:
+    sasm_list = []
+
+    for j in range(intensity.shape[0]):
+        sasm_data = {
+            'q_raw'             : q_raw,
+            'q_err_raw'         : q_err_raw,
+            'i_raw'             : intensity[j],
+            'err_raw'           : error[j],
+            'scale_factor'      : float(frame_info['scale_factor'][j]),
+            'offset_value'      : float(frame_info['offset_value'][j]),
+            'q_scale_factor'    : float(frame_info['q_scale_factor'][j]),
+            'selected_qrange'   : [int(frame_info['qrange_start'][j]),
+                int(frame_info['qrange_end'][j])],
+            'parameters'        : parameters[j],
+            }
+
+        sasm_list.append(sasm_data)
+
+    return sasm_list
+
+class LazySASM(SASM.SASM):
+    """
+    A profile read by a LazySasmList. Changing the profile's data, scale,
+    offset, q range, or metadata (through setParameter, setAllParameters, or
+    removeParameter) keeps it in the list, so the change isn't lost when the
+    profile is dropped from the cache and would otherwise be read from the
+    file again. Changes made directly to metadata dictionaries, such as the
+    dictionary from getParameter('analysis'), have to be set back with
+    setParameter to be kept. Copies and pickles are regular profiles.
+    """
+
+    __slots__ = ('_lazy_list', '_lazy_index')
+
+    def __reduce_ex__(self, protocol):
+        return (SASM.SASM.__new__, (SASM.SASM,), self.__getstate__())
+
+    def _changed(self):
+        # Not set while the profile is being made from the file
+        lazy_list = getattr(self, '_lazy_list', None)
+
+        if lazy_list is not None:
+            lazy_list._pin(self._lazy_index, self)
+
+    def _setDirty(self, totals_only=False):
+        SASM.SASM._setDirty(self, totals_only)
+        self._changed()
+
+    def setAllParameters(self, new_parameters):
+        SASM.SASM.setAllParameters(self, new_parameters)
+        self._changed()
+
+    def setParameter(self, key, value):
+        SASM.SASM.setParameter(self, key, value)
+        self._changed()
+
+    def removeParameter(self, key):
+        SASM.SASM.removeParameter(self, key)
+        self._changed()
+
+class LazySasmList(object):
+    """
+    Stands in for the list of profiles of a series file group saved as a
+    table (see save_series_sasm_table), reading each profile from the file
+    when it's first used. Supports len, indexing, slicing, and iteration.
+    Recently used profiles are kept in a least recently used cache, and a
+    profile stays the same object for as long as it's referenced elsewhere.
+    Profiles that have been changed are kept for the life of the list (see
+    LazySASM). Copying or pickling gives a regular list of the profiles. The
+    file is only open while profiles are read, and reading fails if the file
+    has changed since the list was made.
+    """
+
+    def __init__(self, filename, group_name, cache_size=256):
+        self.filename = filename
+        self.group_name = group_name
+        self.cache_size = cache_size
+
+        self._cache = collections.OrderedDict()
+        self._refs = weakref.WeakValueDictionary()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+        self._file_stat = self._getFileStat()
+
+        with h5py.File(filename, 'r') as f:
+            group = f[group_name]
+
+            q_vals = group['q'][()]
+            self._n_frames = group['intensity'].shape[0]
+
+        if q_vals.ndim == 2:
+            self._q_raw = q_vals[:, 0]
+            self._q_err_raw = q_vals[:, 1]
+        else:
+            self._q_raw = q_vals
+            self._q_err_raw = None
+
+    def __len__(self):
+        return self._n_frames
+
+    def __iter__(self):
+        # Profiles are read in blocks, so the file isn't opened for each one
+        block_size = max(self.cache_size//2, 1)
+
+        for start in range(0, self._n_frames, block_size):
+            for sasm in self[start:start+block_size]:
+                yield sasm
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(*index.indices(self._n_frames))
+
+            with self._lock:
+                return self._getSasms(indices)
+
+        index = operator.index(index)
+
+        if index < 0:
+            index += self._n_frames
+
+        if index < 0 or index >= self._n_frames:
+            raise IndexError('list index out of range')
+
+        with self._lock:
+            return self._getSasms([index])[0]
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(self), memo)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def _getSasms(self, indices):
+        sasms = {}
+
+        for index in indices:
+            sasm = self._cache.pop(index, None)
+
+            if sasm is None:
+                sasm = self._refs.get(index)
+
+            if sasm is not None:
+                sasms[index] = sasm
+
+        missing = [index for index in indices if index not in sasms]
+
+        if len(missing) > 0:
+            sasms.update(self._loadSasms(missing))
+
+        for index in indices:
+            self._cache[index] = sasms[index]
+
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return [sasms[index] for index in indices]
+
+    def _pin(self, index, sasm):
+        with self._lock:
+            self._pinned[index] = sasm
+
+    def _getFileStat(self):
+        file_stat = os.stat(self.filename)
+
+        return file_stat.st_mtime_ns, file_stat.st_size
+
+    def _loadSasms(self, indices):
+        if self._getFileStat() != self._file_stat:
+            raise IOError(('The series file {} has changed since it was '
+                'loaded.').format(self.filename))
+
+        # Frames are read as one block, which is what slicing usually needs
+        start = min(indices)
+        stop = max(indices) + 1
+
+        with h5py.File(self.filename, 'r') as f:
+            group = f[self.group_name]
+
+            intensity = group['intensity'][start:stop]
+            error = group['error'][start:stop]
+            frame_info = group['frame_info'][start:stop]
+            headers = group['parameters'][start:stop]
+
+        sasms = {}
+
+        for index in indices:
+            j = index - start
+
+            header = headers[j]
+            if isinstance(header, bytes):
+                header = header.decode('utf-8')
+
+            sasm_data = {
+                'q_raw'             : self._q_raw,
+                'q_err_raw'         : self._q_err_raw,
+                'i_raw'             : intensity[j],
+                'err_raw'           : error[j],
+                'scale_factor'      : float(frame_info['scale_factor'][j]),
+                'offset_value'      : float(frame_info['offset_value'][j]),
+                'q_scale_factor'    : float(frame_info['q_scale_factor'][j]),
+                'selected_qrange'   : [int(frame_info['qrange_start'][j]),
+                    int(frame_info['qrange_end'][j])],
+                'parameters'        : loadDatHeader(header),
+                }
+
+            sasm = makeSeriesSasm(sasm_data, LazySASM)
+            sasm._lazy_list = self
+            sasm._lazy_index = index
+
+            self._refs[index] = sasm
+            sasms[index] = sasm
+
+        return sasms
+
+def load_series_sasm_list(group, excluded_keys=['raw', 'q', 'q_err'],
+    lazy=False):
+    if group.attrs.get('layout', '') == 'table':
+        if lazy:
+            return LazySasmList(group.file.filename, group.name)
+        else:
+            return load_series_sasm_table(group)
+
+    q_raw = None
+    q_err_raw = None
+    sasm_list = []
+
+    if 'raw' in group:
+        raw_group = group['raw']
+
+        if 'q' in raw_group:
+            q_raw = raw_group['q'][()]
+
+        elif 'q' in group:
+            q_raw = group['q'][()]
+
+    elif 'q' in group:
         q_raw = group['q'][()]
 
     if q_raw is not None and q_raw.ndim == 2:
@@ -2016,10 +2749,16 @@ def load_series_sasm_list(group, excluded_keys=['raw', 'q', 'q_err']):
 
     return sasm_list
 
-def load_series(name):
+def load_series(name, lazy=False):
     seriesm_data = {}
 
-    with h5py.File(name, 'r', driver='core', backing_store=False) as f:
+    if lazy:
+        # Only what is read is loaded, profiles are read later as needed
+        file_kwargs = {}
+    else:
+        file_kwargs = {'driver': 'core', 'backing_store': False}
+
+    with h5py.File(name, 'r', **file_kwargs) as f:
         seriesm_data['series_type'] = str(f.attrs['series_type'])
         seriesm_data['parameters'] = loadDatHeader(f.attrs['parameters'])
 
@@ -2030,7 +2769,7 @@ def load_series(name):
         # Get data from unsubtracted group
         profiles = f['profiles']
         seriesm_data['sasm_list'] = load_series_sasm_list(profiles, ['raw', 'q',
-            'q_err', 'average_buffer_profile'])
+            'q_err', 'average_buffer_profile'], lazy)
 
         if len(profiles['average_buffer_profile']) > 0:
             seriesm_data['average_buffer_sasm'] = load_series_sasm(profiles,
@@ -2041,13 +2780,15 @@ def load_series(name):
         # Get data from subtracted group
 
         sub_profiles = f['subtracted_profiles']
-        seriesm_data['subtracted_sasm_list'] = load_series_sasm_list(sub_profiles)
+        seriesm_data['subtracted_sasm_list'] = load_series_sasm_list(sub_profiles,
+            lazy=lazy)
 
         seriesm_data['use_subtracted_sasm'] = sub_profiles.attrs['use_subtracted_sasm'][()]
 
         # Get data from baseline subtracted group
         baseline_profiles = f['baseline_subtracted_profiles']
-        seriesm_data['baseline_subtracted_sasm_list'] = load_series_sasm_list(baseline_profiles)
+        seriesm_data['baseline_subtracted_sasm_list'] = load_series_sasm_list(baseline_profiles,
+            lazy=lazy)
 
         seriesm_data['use_baseline_subtracted_sasm'] = baseline_profiles.attrs['use_baseline_subtracted_sasm'][()]
 
@@ -2074,6 +2815,15 @@ def load_series(name):
         else:
             seriesm_data['sample_range'] = list(map(tuple, sub_intensity.attrs['sample_range'][()]))
 
+        if lazy:
+            # The intensities saved with the series, so that the profiles
+            # aren't read to calculate them
+            for group_name, suffix in [('intensities', ''),
+                ('subtracted_intensities', '_sub'),
+                ('baseline_subtracted_intensities', '_bcsub')]:
+                seriesm_data['mean_i'+suffix] = f[group_name]['mean_intensities'][()]
+                seriesm_data['total_i'+suffix] = f[group_name]['total_intensities'][()]
+
         # Get calculated data
         calc_data = f['calculated_data']
         seriesm_data['rg'] = calc_data['rg'][:,0]
@@ -2091,7 +2841,8 @@ def load_series(name):
 
         # Get baseline
         baseline = f['baseline']
-        seriesm_data['baseline_corr'] = load_series_sasm_list(baseline['correction'])
+        seriesm_data['baseline_corr'] = load_series_sasm_list(baseline['correction'],
+            lazy=lazy)
 
         seriesm_data['baseline_fit_results'] = baseline['fit_parameters'][:]
 
@@ -2150,7 +2901,7 @@ def load_series(name):
 
     return seriesm_data
 
-def loadSeriesFile(filename, settings):
+def loadSeriesFile(filename, settings, lazy=False):
 
     name, ext = os.path.splitext(filename)
 
@@ -2176,10 +2927,14 @@ def loadSeriesFile(filename, settings):
             file.close()
 
     else:
-        secm_data = load_series(filename)
+        secm_data = load_series(filename, lazy)
 
     if secm_data is not None:
-        new_secm, line_data, calc_line_data = makeSeriesFile(secm_data, settings)
+        if lazy and ext != '.sec':
+            new_secm, line_data, calc_line_data = makeLazySeriesFile(secm_data,
+                settings)
+        else:
+            new_secm, line_data, calc_line_data = makeSeriesFile(secm_data, settings)
 
         new_secm.setParameter('filename', os.path.split(filename)[1])
     else:
@@ -2425,6 +3180,11 @@ def makeSeriesFile(secm_data, settings):
 
     new_secm._update()
 
+    line_data, calc_line_data = getSeriesLineData(secm_data)
+
+    return new_secm, line_data, calc_line_data
+
+def getSeriesLineData(secm_data):
     try:
         line_data = {'line_color' : secm_data['line_color'],
                      'line_width' : secm_data['line_width'],
@@ -2451,6 +3211,111 @@ def makeSeriesFile(secm_data, settings):
         line_data = None    #Backwards compatibility
         calc_line_data = None
 
+    return line_data, calc_line_data
+
+def makeSeriesSasm(sasm_data, sasm_class=SASM.SASM):
+    """
+    Makes a profile from the data for one profile of a series file, as an
+    instance of sasm_class.
+    """
+    if 'q_binned' in sasm_data:
+        q = sasm_data['q_binned']
+        i = sasm_data['i_binned']
+        err = sasm_data['err_binned']
+        q_err = None
+    else:
+        q = sasm_data['q_raw']
+        i = sasm_data['i_raw']
+        err = sasm_data['err_raw']
+        q_err = sasm_data['q_err_raw']
+
+    new_sasm = sasm_class(i, q, err, sasm_data['parameters'], q_err)
+
+    new_sasm.setScaleValues(sasm_data['scale_factor'], sasm_data['offset_value'],
+        sasm_data['q_scale_factor'])
+
+    new_sasm.setQrange(sasm_data['selected_qrange'])
+
+    try:
+        new_sasm.setParameter('analysis', sasm_data['parameters_analysis'])
+    except KeyError:
+        pass
+
+    new_sasm._update()
+
+    return new_sasm
+
+def makeSeriesSasmList(sasm_list):
+    if isinstance(sasm_list, LazySasmList):
+        return sasm_list
+
+    return [makeSeriesSasm(sasm_data) if sasm_data != -1 else -1
+        for sasm_data in sasm_list]
+
+def makeLazySeriesFile(secm_data, settings):
+    """
+    Makes a series from series file data loaded with lazy=True. The series
+    intensities are the ones saved in the file, and profiles saved as tables
+    are only read from the file when they are used (see LazySasmList).
+    Profiles keep their saved scale, offset, and q range.
+    """
+    # The series is made empty and then filled in, so no profiles are read
+    new_secm = SECM.SECM(secm_data['file_list'], [], secm_data['frame_list'],
+        secm_data['parameters'], settings)
+
+    new_secm._file_list = secm_data['file_list']
+    new_secm._sasm_list = makeSeriesSasmList(secm_data['sasm_list'])
+    new_secm.frame_list = np.array(secm_data['frame_list'], dtype=int)
+    new_secm.plot_frame_list = np.arange(len(new_secm.frame_list))
+    new_secm.time = secm_data['time']
+
+    new_secm.mean_i = np.array(secm_data['mean_i'])
+    new_secm.total_i = np.array(secm_data['total_i'])
+    new_secm.I_of_q = np.zeros_like(new_secm.mean_i)
+    new_secm.qrange_I = np.zeros_like(new_secm.mean_i)
+
+    new_secm.series_type = secm_data['series_type']
+    new_secm.window_size = secm_data['window_size']
+    new_secm.mol_type =secm_data['mol_type']
+    new_secm.calc_has_data = secm_data['calc_has_data']
+    new_secm.mol_density = secm_data['mol_density']
+    new_secm.already_subtracted = secm_data['already_subtracted']
+    new_secm.sample_range = secm_data['sample_range']
+    new_secm.buffer_range = secm_data['buffer_range']
+
+    new_secm.setCalcValues(secm_data['rg'], secm_data['rger'], secm_data['i0'],
+        secm_data['i0er'], secm_data['vcmw'], secm_data['vcmwer'],
+        secm_data['vpmw'])
+
+    new_secm.subtracted_sasm_list = makeSeriesSasmList(secm_data['subtracted_sasm_list'])
+    new_secm.use_subtracted_sasm = list(secm_data['use_subtracted_sasm'])
+    new_secm.mean_i_sub = np.array(secm_data['mean_i_sub'])
+    new_secm.total_i_sub = np.array(secm_data['total_i_sub'])
+    new_secm.I_of_q_sub = np.zeros_like(new_secm.mean_i_sub)
+    new_secm.qrange_I_sub = np.zeros_like(new_secm.mean_i_sub)
+
+    new_secm.baseline_start_range = secm_data['baseline_start_range']
+    new_secm.baseline_end_range = secm_data['baseline_end_range']
+    new_secm.baseline_type = secm_data['baseline_type']
+    new_secm.baseline_extrap = secm_data.get('baseline_extrap', True)
+    new_secm.baseline_fit_results = secm_data['baseline_fit_results']
+
+    new_secm.baseline_subtracted_sasm_list = makeSeriesSasmList(
+        secm_data['baseline_subtracted_sasm_list'])
+    new_secm.use_baseline_subtracted_sasm = list(secm_data['use_baseline_subtracted_sasm'])
+    new_secm.mean_i_bcsub = np.array(secm_data['mean_i_bcsub'])
+    new_secm.total_i_bcsub = np.array(secm_data['total_i_bcsub'])
+    new_secm.I_of_q_bcsub = np.zeros_like(new_secm.mean_i_bcsub)
+    new_secm.qrange_I_bcsub = np.zeros_like(new_secm.mean_i_bcsub)
+
+    new_secm.baseline_corr = makeSeriesSasmList(secm_data['baseline_corr'])
+
+    if (secm_data['average_buffer_sasm'] is not None
+        and secm_data['average_buffer_sasm'] != -1):
+        new_secm.average_buffer_sasm = makeSeriesSasm(secm_data['average_buffer_sasm'])
+
+    line_data, calc_line_data = getSeriesLineData(secm_data)
+
     return new_secm, line_data, calc_line_data
 
 
@@ -3038,10 +3903,6 @@ def loadDatFile(filename):
 def makeDatFile(lines, filename):
     iq_pattern = i_q_err_match
 
-    i = []
-    q = []
-    err = []
-
     comment = ''
     line = lines[0]
     j=0
@@ -3058,17 +3919,159 @@ def makeDatFile(lines, filename):
         #FoXS file with a fit! has four data columns
         is_foxs_fit=True
         is_sans_data = False
-        imodel = []
 
     elif comment.find('dQ') > -1:
         #ORNL SANS instrument file
         is_foxs_fit = False
         is_sans_data = True
-        qerr = []
     else:
         is_foxs_fit = False
         is_sans_data = False
 
+    if is_foxs_fit or is_sans_data:
+        min_cols = 4
+    else:
+        min_cols = 3
+
+    data, header = readDatBlocks(lines, iq_pattern, min_cols)
+
+    if data is not None:
+        q = data[:, 0].copy()
+        i = data[:, 1].copy()
+
+        if is_foxs_fit:
+            imodel = data[:, 2].copy()
+            err = np.abs(data[:, 3])
+
+        elif is_sans_data:
+            err = np.abs(data[:, 2])
+            qerr = np.abs(data[:, 3])
+
+        else:
+            err = np.abs(data[:, 2])
+
+    else:
+        q, i, err, imodel, qerr, header = _matchDatLines(lines, iq_pattern,
+            is_foxs_fit, is_sans_data)
+
+    if len(header)>0:
+        hdr_str = ''.join(each_line.lstrip('#') for each_line in header)
+
+        hdict = loadDatHeader(hdr_str)
+
+        for each in hdict:
+            if each != 'filename':
+                parameters[each] = hdict[each]
+
+    i = np.array(i)
+    q = np.array(q)
+    err = np.array(err)
+
+    sasm = SASM.SASM(i, q, err, parameters)
+
+    if is_foxs_fit:
+        parameters2 = copy.copy(parameters)
+        parameters2['filename'] = os.path.splitext(os.path.split(filename)[1])[0]+'_FIT'
+
+        sasm_model = SASM.SASM(imodel, q, err, parameters2)
+
+        return [sasm, sasm_model]
+
+    elif is_sans_data:
+        sasm.setRawQErr(np.array(qerr))
+        sasm._update()
+
+    return sasm
+
+def readDatBlocks(lines, iq_pattern, min_cols):
+    """
+    Finds the RAW header and the data in the lines of a .dat file, and reads
+    the data in with one call to readNumericBlock. The header is either at
+    the top, between the ### HEADER: and ### DATA: lines, or at the bottom
+    after the ### HEADER: line. Returns the data as a 2D array (or None if
+    the file has to be read line by line, see _matchDatLines) and the
+    header lines.
+    """
+    hdr_idx = None
+    data_idx = None
+
+    for j in [j for j, line in enumerate(lines) if '### ' in line]:
+        if hdr_idx is None and '### HEADER:' in lines[j]:
+            hdr_idx = j
+        elif data_idx is None and '### DATA:' in lines[j]:
+            data_idx = j
+
+    if hdr_idx is not None and data_idx is not None and hdr_idx < data_idx:
+        header = lines[hdr_idx+1:data_idx]
+        start = data_idx+1
+        end = len(lines)
+
+    elif hdr_idx is not None:
+        header = lines[hdr_idx+1:]
+        start = 0
+        end = hdr_idx
+
+    else:
+        header = []
+        start = 0
+        end = len(lines)
+
+    data, data_start, data_end = readNumericBlock(lines, iq_pattern, min_cols,
+        start=start, end=end)
+
+    return data, header
+
+def readNumericBlock(lines, iq_pattern, min_cols, max_cols=None, start=0,
+    end=None):
+    """
+    Reads the block of data lines in the lines of an ASCII profile, from the
+    first line between start and end that matches iq_pattern to the last
+    one, with a single np.loadtxt call. Only the lines outside of the block
+    are checked against the pattern. Returns a 2D array with one row per
+    data line, and the start and end of the block. The array is None if
+    the block isn't all numbers with the same number of columns (between
+    min_cols and max_cols). In that case the file has to be read line by
+    line.
+    """
+    if end is None:
+        end = len(lines)
+
+    data_start = start
+    while data_start < end and not iq_pattern.match(lines[data_start]):
+        data_start += 1
+
+    data_end = end
+    while data_end > data_start and not iq_pattern.match(lines[data_end-1]):
+        data_end -= 1
+
+    if data_start >= data_end:
+        return None, data_start, data_end
+
+    block = lines[data_start:data_end]
+
+    if ',' in block[0]:
+        delimiter = ','
+    else:
+        delimiter = None
+
+    try:
+        data = np.loadtxt(block, delimiter=delimiter, ndmin=2)
+    except ValueError:
+        return None, data_start, data_end
+
+    if (data.shape[1] < min_cols or (max_cols is not None
+        and data.shape[1] > max_cols) or not np.all(np.isfinite(data))):
+        data = None
+
+    return data, data_start, data_end
+
+def _matchDatLines(lines, iq_pattern, is_foxs_fit, is_sans_data):
+    i = []
+    q = []
+    err = []
+    imodel = []
+    qerr = []
+
     header = []
     header_start = False
 
@@ -3128,36 +4131,7 @@ def makeDatFile(lines, filename):
         elif header_start and not iq_match:
             header.append(lines[j])
 
-    if len(header)>0:
-        hdr_str = ''
-        for each_line in header:
-            hdr_str=hdr_str+each_line.lstrip('#')
-
-        hdict = loadDatHeader(hdr_str)
-
-        for each in hdict:
-            if each != 'filename':
-                parameters[each] = hdict[each]
-
-    i = np.array(i)
-    q = np.array(q)
-    err = np.array(err)
-
-    sasm = SASM.SASM(i, q, err, parameters)
-
-    if is_foxs_fit:
-        parameters2 = copy.copy(parameters)
-        parameters2['filename'] = os.path.splitext(os.path.split(filename)[1])[0]+'_FIT'
-
-        sasm_model = SASM.SASM(imodel, q, err, parameters2)
-
-        return [sasm, sasm_model]
-
-    elif is_sans_data:
-        sasm.setRawQErr(np.array(qerr))
-        sasm._update()
-
-    return sasm
+    return q, i, err, imodel, qerr, header
 
 def loadDatHeader(header):
     try:
@@ -3168,73 +4142,37 @@ def loadDatHeader(header):
         hdict = {}
 
     if hdict:
-        hdict = translateHeader(hdict, to_sasbdb=False)
+        hdict = translateHeader(hdict, to_sasbdb=False, copy_values=False)
 
     return hdict
 
 
-def loadRadFile(filename):
-    ''' NOTE : THIS IS THE OLD RAD FORMAT..     '''
-    ''' Loads a .rad file into a SASM object and attaches the filename and header into the parameters  '''
-
-    iq_pattern = four_col_fit
-    param_pattern = re.compile('[a-zA-Z0-9_]*\s*[:]\s+.*')
-
-    i = []
-    q = []
-    err = []
-    parameters = {'filename' : os.path.split(filename)[1]}
-
-    fileheader = {}
-
-    with open(filename, 'rU') as f:
-
-        for line in f:
-
-            iq_match = iq_pattern.match(line)
-            param_match = param_pattern.match(line)
-
-            if iq_match:
-                found = iq_match.group().split()
-                q.append(float(found[0]))
-
-                i.append(float(found[1]))
-
-                err.append(float(found[2]))
-
-            if param_match:
-                found = param_match.group().split()
-
-                if len(found) == 3:
-                    try:
-                        val = float(found[2])
-                    except ValueError:
-                        val = found[2]
-
-                    fileheader[found[0]] = val
+def loadDatHeaders(headers):
+    """
+    Loads a list of JSON headers, as loadDatHeader, with a single parse.
+    """
+    headers = [header.decode('utf-8') if isinstance(header, bytes) else header
+        for header in headers]
 
-                elif len(found) > 3:
-                    arr = []
-                    for each in range(2,len(found)):
-                        try:
-                            val = float(found[each])
-                        except ValueError:
-                            val = found[each]
+    try:
+        hdicts = [dict(hdict) for hdict in json.loads('[{}]'.format(','.join(headers)))]
+    except Exception:
+        hdicts = [loadDatHeader(header) for header in headers]
+    else:
+        hdicts = [translateHeader(hdict, to_sasbdb=False, copy_values=False)
+            for hdict in hdicts]
 
-                        arr.append(val)
+    return hdicts
 
-                    fileheader[found[0]] = arr
-                else:
-                    fileheader[found[0]] = ''
+def loadRadFile(filename):
+    ''' NOTE : THIS IS THE OLD RAD FORMAT..     '''
+    ''' Loads a .rad file into a SASM object and attaches the filename and header into the parameters  '''
 
+    q, i, err, fileheader = readRadFile(filename, four_col_fit, 4)
 
     parameters = {'filename' : os.path.split(filename)[1],
                   'fileHeader' : fileheader}
 
-    i = np.array(i)
-    q = np.array(q)
-    err = np.array(err)
-
     return SASM.SASM(i, q, err, parameters)
 
 
@@ -3242,22 +4180,46 @@ def loadNewRadFile(filename):
     ''' NOTE : This is a load function for the new rad format '''
     ''' Loads a .rad file into a SASM object and attaches the filename and header into the parameters  '''
 
-    iq_pattern = three_col_fit
+    q, i, err, fileheader = readRadFile(filename, three_col_fit, 3)
+
+    parameters = {'filename' : os.path.split(filename)[1],
+                  'counters' : fileheader}
+
+    return SASM.SASM(i, q, err, parameters)
+
+def readRadFile(filename, iq_pattern, n_cols):
+    '''
+    Reads the q, i, and error and the header parameters from a .rad file with
+    n_cols data columns. The data block is read at once if possible (see
+    readNumericBlock), and the header parameters from the lines around it.
+    '''
     param_pattern = re.compile('[a-zA-Z0-9_]*\s*[:]\s+.*')
 
+    with open(filename, 'rU') as f:
+        lines = f.readlines()
+
+    data, data_start, data_end = readNumericBlock(lines, iq_pattern, n_cols,
+        n_cols)
+
     i = []
     q = []
     err = []
-    parameters = {'filename' : os.path.split(filename)[1]}
 
     fileheader = {}
 
-    with open(filename, 'rU') as f:
+    if data is not None:
+        q = data[:, 0].copy()
+        i = data[:, 1].copy()
+        err = data[:, 2].copy()
 
-        for line in f:
+        param_lines = lines[:data_start] + lines[data_end:]
+    else:
+        param_lines = lines
+
+    for line in param_lines:
 
+        if data is None:
             iq_match = iq_pattern.match(line)
-            param_match = param_pattern.match(line)
 
             if iq_match:
                 found = iq_match.group().split()
@@ -3267,40 +4229,38 @@ def loadNewRadFile(filename):
 
                 err.append(float(found[2]))
 
-            if param_match:
-                found = param_match.group().split()
-
-                if len(found) == 3:
-                    try:
-                        val = float(found[2])
-                    except ValueError:
-                        val = found[2]
+        param_match = param_pattern.match(line)
 
-                    fileheader[found[0]] = val
+        if param_match:
+            found = param_match.group().split()
 
-                elif len(found) > 3:
-                    arr = []
-                    for each in range(2,len(found)):
-                        try:
-                            val = float(found[each])
-                        except ValueError:
-                            val = found[each]
+            if len(found) == 3:
+                try:
+                    val = float(found[2])
+                except ValueError:
+                    val = found[2]
 
-                        arr.append(val)
+                fileheader[found[0]] = val
 
-                    fileheader[found[0]] = arr
-                else:
-                    fileheader[found[0]] = ''
+            elif len(found) > 3:
+                arr = []
+                for each in range(2,len(found)):
+                    try:
+                        val = float(found[each])
+                    except ValueError:
+                        val = found[each]
 
+                    arr.append(val)
 
-    parameters = {'filename' : os.path.split(filename)[1],
-                  'counters' : fileheader}
+                fileheader[found[0]] = arr
+            else:
+                fileheader[found[0]] = ''
 
     i = np.array(i)
     q = np.array(q)
     err = np.array(err)
 
-    return SASM.SASM(i, q, err, parameters)
+    return q, i, err, fileheader
 
 
 def loadIntFile(filename):
@@ -3398,39 +4358,55 @@ def loadTxtFile(filename):
     err = []
 
     with open(filename, 'rU') as f:
+        lines = f.readlines()
 
-        firstLine = f.readline()
+    if len(lines) > 0:
+        firstLine = lines[0]
+    else:
+        firstLine = ''
 
-        match = [fit.match(firstLine) for fit in fit_list]
+    match = [fit.match(firstLine) for fit in fit_list]
 
-        if any(match):
-            fileHeader = {}
-        else:
-            fileHeader = {'comment':firstLine}
-            firstline_l = firstLine.lower()
-            if 'chi^2' in firstline_l:
-                chisq = firstline_l.split('chi^2')[-1].strip(':= ').split()[0].strip()
-                fileHeader['Chi_squared'] = float(chisq)
+    if any(match):
+        fileHeader = {}
+    else:
+        fileHeader = {'comment':firstLine}
+        firstline_l = firstLine.lower()
+        if 'chi^2' in firstline_l:
+            chisq = firstline_l.split('chi^2')[-1].strip(':= ').split()[0].strip()
+            fileHeader['Chi_squared'] = float(chisq)
 
-            if 'rg' in firstline_l:
-                rg = firstline_l.split('rg')[-1].strip('t:= ').split()[0].strip()
-                fileHeader['Rg'] = float(rg)
+        if 'rg' in firstline_l:
+            rg = firstline_l.split('rg')[-1].strip('t:= ').split()[0].strip()
+            fileHeader['Rg'] = float(rg)
 
-            if 'dro' in firstline_l:
-                dro = firstline_l.split('dro')[-1].strip(':= ').split()[0].strip()
-                fileHeader['Hydration_shell_contrast'] = float(dro)
+        if 'dro' in firstline_l:
+            dro = firstline_l.split('dro')[-1].strip(':= ').split()[0].strip()
+            fileHeader['Hydration_shell_contrast'] = float(dro)
 
-            if 'vol' in firstline_l:
-                vol = firstline_l.split('vol')[-1].strip(':= ').split()[0].strip()
-                fileHeader['Excluded_volume'] = float(vol)
+        if 'vol' in firstline_l:
+            vol = firstline_l.split('vol')[-1].strip(':= ').split()[0].strip()
+            fileHeader['Excluded_volume'] = float(vol)
 
-        parameters = {'filename' : os.path.split(filename)[1],
-                      'counters' : fileHeader}
+    parameters = {'filename' : os.path.split(filename)[1],
+                  'counters' : fileHeader}
 
-        if len(fileHeader) == 0:
-            q, i, err = _match_txt_lines(firstLine, q, i, err, fit_list)
+    if len(fileHeader) == 0:
+        start = 0
+    else:
+        start = 1
 
-        for line in f:
+    data, _, _ = readNumericBlock(lines, i_q_match, 2, 3, start=start)
+
+    if data is not None:
+        q = data[:, 0].copy()
+        i = data[:, 1].copy()
+
+        if data.shape[1] == 3:
+            err = data[:, 2].copy()
+
+    else:
+        for line in lines[start:]:
             q, i, err = _match_txt_lines(line, q, i, err, fit_list)
 
     i = np.array(i)
@@ -3588,7 +4564,13 @@ def save_series_sasm(profile_group, sasm_data, dataset_name, descrip='',
     dset.attrs['parameters'] = formatHeader(sasm_data['parameters'])
     dset.attrs['description'] = descrip
 
-def save_series_sasm_list(profile_group, sasm_list, frame_num_offset=0):
+def save_series_sasm_list(profile_group, sasm_list, frame_num_offset=0,
+    compression=None, first_frame=0):
+
+    if canSaveSasmTable(sasm_list):
+        save_series_sasm_table(profile_group, sasm_list, compression,
+            first_frame)
+        return
 
     if len(sasm_list) > 1:
         save_single_q = all([np.array_equal(sasm['q'], sasm_list[0]['q']) for sasm in sasm_list[1:]])
@@ -3659,8 +4641,384 @@ def save_series_sasm_list(profile_group, sasm_list, frame_num_offset=0):
         save_series_sasm(profile_group, sasm_data, "{:06d}".format(frame_num),
             save_single_q=save_single_q, save_single_q_raw=save_single_q_raw)
 
-def save_series(save_name, seriesm, save_gui_data=False):
+# Version of the series file layout. Version 2 stores the profiles of a group
+# as frames x q arrays (see save_series_sasm_table), version 1 files have
+# one dataset per profile.
+series_layout_version = 2
+
+frame_info_dtype = np.dtype([('scale_factor', np.float64),
+    ('offset_value', np.float64), ('q_scale_factor', np.float64),
+    ('qrange_start', np.int64), ('qrange_end', np.int64)])
+
+def canSaveSasmTable(sasm_list):
+    """
+    Whether a list of extracted profiles can be saved with
+    save_series_sasm_table, which needs all of them to have the same raw q.
+    """
+    if (len(sasm_list) == 0
+        or not all(isinstance(sasm, dict) for sasm in sasm_list)):
+        return False
+
+    q_raw = sasm_list[0]['q_raw']
+    q_err_raw = sasm_list[0]['q_err_raw']
+
+    for sasm in sasm_list[1:]:
+        if not np.array_equal(sasm['q_raw'], q_raw):
+            return False
+
+        if q_err_raw is None:
+            if sasm['q_err_raw'] is not None:
+                return False
+
+        elif (sasm['q_err_raw'] is None
+            or not np.array_equal(sasm['q_err_raw'], q_err_raw)):
+            return False
+
+    return True
+
+def getHdf5StringDtype():
+    try:
+        dtype = h5py.string_dtype() #h5py 2.10, python 3
+    except Exception:
+        if six.PY3:
+            dtype = h5py.special_dtype(vlen=str) #h5py < 2.10, python3
+        else:
+            dtype = h5py.special_dtype(vlen=unicode) #h5py < 2.10, python2
+
+    return dtype
+
+def save_series_sasm_table(profile_group, sasm_list, compression=None,
+    first_frame=0):
+    """
+    Saves a list of extracted profiles with the same raw q as a table: a
+    shared q vector, frames x q intensity and error arrays, and a per frame
+    table of scale, offset, and q range plus the per frame parameters. The
+    arrays are chunked by frame and can be extended, and can be compressed
+    by passing an h5py compression filter (e.g. 'gzip'). If the group already
+    has a table, as when appending to a series file, it is resized to the
+    profiles and only the profiles from first_frame on are written. Profiles
+    are written a chunk at a time, so only one chunk is held in memory.
+    """
+    n_frames = len(sasm_list)
+
+    q_raw = sasm_list[0]['q_raw']
+    q_err_raw = sasm_list[0]['q_err_raw']
+    n_q = len(q_raw)
+
+    if 'intensity' in profile_group:
+        datasets = [profile_group[name] for name in ['intensity', 'error',
+            'parameters']]
+
+        for dset in datasets:
+            dset.resize(n_frames, axis=0)
+
+    else:
+        first_frame = 0
+
+        profile_group.attrs['layout'] = 'table'
+
+        if q_err_raw is not None:
+            data = np.column_stack((q_raw, q_err_raw))
+        else:
+            data = q_raw
+
+        q_dataset = profile_group.create_dataset('q', data=data)
+        q_dataset.attrs['description'] = ('The q vector for all profiles in the '
+            '"intensity" and "error" datasets of this group. If present, column 1 '
+            'is dQ.')
+
+        # About 1 MB per chunk
+        chunks = (max(1, min(n_frames, 2**17//max(n_q, 1))), max(n_q, 1))
+
+        datasets = []
+
+        for name, descrip in [('intensity', 'I(q)'), ('error', 'sigma(q)')]:
+            dset = profile_group.create_dataset(name, shape=(n_frames, n_q),
+                dtype=np.float64, chunks=chunks, maxshape=(None, n_q),
+                compression=compression)
+            dset.attrs['description'] = ('{} for each profile, without scaling, '
+                'offset, or q trimming. Rows are profiles in frame order, columns '
+                'correspond to the q vector.'.format(descrip))
+
+            datasets.append(dset)
+
+        dset = profile_group.create_dataset('parameters', shape=(n_frames,),
+            dtype=getHdf5StringDtype(), chunks=True, maxshape=(None,))
+        dset.attrs['description'] = ('The metadata of each profile, as JSON.')
+
+        datasets.append(dset)
+
+    i_dset, err_dset, params_dset = datasets
+
+    block_size = i_dset.chunks[0]
+
+    for start in range(first_frame, n_frames, block_size):
+        block = sasm_list[start:start+block_size]
+        end = start + len(block)
 
+        i_dset[start:end] = [sasm_data['i_raw'] for sasm_data in block]
+        err_dset[start:end] = [sasm_data['err_raw'] for sasm_data in block]
+        params_dset[start:end] = [formatHeader(sasm_data['parameters'],
+            compact=True) for sasm_data in block]
+
+    frame_info = np.zeros(n_frames, dtype=frame_info_dtype)
+    frame_info['scale_factor'] = [sasm_data['scale_factor'] for sasm_data in sasm_list]
+    frame_info['offset_value'] = [sasm_data['offset_value'] for sasm_data in sasm_list]
+    frame_info['q_scale_factor'] = [sasm_data['q_scale_factor'] for sasm_data in sasm_list]
+
+    qrange = np.array([sasm_data['selected_qrange'] for sasm_data in sasm_list],
+        dtype=np.int64)
+    frame_info['qrange_start'] = qrange[:, 0]
+    frame_info['qrange_end'] = qrange[:, 1]
+
+    # Scale, offset, and q range are small enough to always write in full
+    if 'frame_info' in profile_group:
+        info_dset = profile_group['frame_info']
+        info_dset.resize(n_frames, axis=0)
+        info_dset[...] = frame_info
+    else:
+        info_dset = profile_group.create_dataset('frame_info', data=frame_info,
+            chunks=True, maxshape=(None,))
+        info_dset.attrs['description'] = ('The scale factor, offset, q scale '
+            'factor, and selected q range (start and end index) of each profile.')
+
+def writeSeriesDataset(group, name, data, dtype=None):
+    """
+    Writes a per frame dataset of a series file, which can be resized along
+    the first (frame) axis. An existing dataset is resized and overwritten if
+    the new data fits it, otherwise it is replaced.
+    """
+    if dtype is None:
+        data = np.asarray(data)
+        shape = data.shape
+    else:
+        shape = (len(data),)
+
+    if name in group:
+        dset = group[name]
+
+        if (dset.maxshape[0] is None and dset.shape[1:] == shape[1:]
+            and (dtype is not None or dset.dtype.kind == data.dtype.kind)):
+            dset.resize(shape[0], axis=0)
+
+            if shape[0] > 0:
+                dset[...] = data
+
+            return dset
+
+        del group[name]
+
+    return group.create_dataset(name, data=data, dtype=dtype, chunks=True,
+        maxshape=(None,)+shape[1:])
+
+# Profile lists of a series, in the same order as their groups in a series
+# file
+series_profile_keys = ['sasm_list', 'subtracted_sasm_list',
+    'baseline_subtracted_sasm_list', 'baseline_corr']
+
+# What was saved by the last save_series with append for each series, used
+# to append to the file on the next save
+_series_save_states = weakref.WeakKeyDictionary()
+_series_save_lock = threading.Lock()
+
+def getSeriesProfiles(seriesm):
+    """
+    Returns a dict of (copies of) the profile lists and the average buffer
+    profile of a series, using the same keys as SECM.extractAll.
+    """
+    sasms = {
+        'sasm_list'                     : list(seriesm._sasm_list),
+        'subtracted_sasm_list'          : list(seriesm.subtracted_sasm_list),
+        'baseline_subtracted_sasm_list' : list(seriesm.baseline_subtracted_sasm_list),
+        'baseline_corr'                 : list(seriesm.baseline_corr),
+        'average_buffer_sasm'           : seriesm.average_buffer_sasm,
+        }
+
+    return sasms
+
+def getSavedObjectState(obj):
+    if isinstance(obj, SASM.SASM):
+        state = weakref.ref(obj)
+    else:
+        state = obj
+
+    return state
+
+def getSavedObject(state):
+    if isinstance(state, weakref.ref):
+        obj = state()
+
+        if obj is None:
+            # Saved profile no longer exists
+            obj = False
+    else:
+        obj = state
+
+    return obj
+
+def getSavedProfilesState(sasm_list, sasm_data_list):
+    """
+    Returns what is needed to append to a saved profile list: weak references
+    to the saved profiles and their raw q, or None if the list was saved in a
+    layout that can't be appended to.
+    """
+    if len(sasm_data_list) == 0:
+        state = {'profiles': [], 'q': None}
+
+    elif canSaveSasmTable(sasm_data_list):
+        q_raw = np.array(sasm_data_list[0]['q_raw'])
+        q_err_raw = sasm_data_list[0]['q_err_raw']
+
+        if q_err_raw is not None:
+            q_err_raw = np.array(q_err_raw)
+
+        state = {'profiles': [weakref.ref(sasm) for sasm in sasm_list],
+            'q': (q_raw, q_err_raw)}
+
+    else:
+        state = None
+
+    return state
+
+def getSeriesAppendFrames(save_state, seriesm_dict, sasms):
+    """
+    Returns a dict of the first profile that has to be written in each
+    profile list to append the series to the file it was last saved to, or
+    None if the whole file has to be written.
+    """
+    if save_state is None:
+        return None
+
+    first_frames = {}
+
+    for key in series_profile_keys:
+        list_state = save_state['profiles'][key]
+        sasm_data_list = seriesm_dict[key]
+
+        if list_state is None:
+            return None
+
+        if len(sasm_data_list) > 0 and not canSaveSasmTable(sasm_data_list):
+            return None
+
+        if list_state['q'] is not None:
+            # Profiles have to match the saved q vector
+            q_raw, q_err_raw = list_state['q']
+
+            if (len(sasm_data_list) == 0
+                or not np.array_equal(sasm_data_list[0]['q_raw'], q_raw)
+                or (sasm_data_list[0]['q_err_raw'] is None) != (q_err_raw is None)
+                or (q_err_raw is not None
+                and not np.array_equal(sasm_data_list[0]['q_err_raw'], q_err_raw))):
+                return None
+
+        first_frame = 0
+
+        for sasm, sasm_ref in zip(sasms[key], list_state['profiles']):
+            if sasm_ref() is not sasm:
+                break
+
+            first_frame += 1
+
+        first_frames[key] = first_frame
+
+    return first_frames
+
+def saveAverageBufferChanged(save_state, sasms):
+    saved_sasm = getSavedObject(save_state['average_buffer'])
+    sasm = sasms['average_buffer_sasm']
+
+    if isinstance(sasm, SASM.SASM) or isinstance(saved_sasm, SASM.SASM):
+        changed = sasm is not saved_sasm
+    else:
+        changed = saved_sasm is False or saved_sasm != sasm
+
+    return changed
+
+def save_series(save_name, seriesm, save_gui_data=False, compression=None,
+    append=False):
+    """
+    Saves a series as an hdf5 file. Data is written straight from the series,
+    without copying it first. With append, if the file was last written by
+    saving the same series with append, only profiles that were added or
+    replaced since then are written, and the intensities, calculated values,
+    and other per frame data are resized and updated in place. This keeps
+    repeated saves during data collection fast as the series grows. The whole
+    file is written the first time, or if the file was changed by something
+    else. Appending assumes profiles that were already saved haven't been
+    modified in place, such changes need a save without append.
+
+    With append the series semaphore is held while saving, so it is safe to
+    save from one thread while another adds to the series, as long as the
+    caller doesn't already hold the semaphore.
+    """
+    save_name = os.path.abspath(save_name)
+
+    with _series_save_lock:
+        if append:
+            save_state = _series_save_states.get(seriesm)
+
+            if save_state is not None and save_state['filename'] == save_name:
+                try:
+                    file_stat = os.stat(save_name)
+                    file_stat = (file_stat.st_mtime_ns, file_stat.st_size)
+                except OSError:
+                    file_stat = None
+
+                if file_stat != save_state['file_stat']:
+                    save_state = None
+            else:
+                save_state = None
+
+            seriesm.acquireSemaphore()
+
+        try:
+            # Profiles not yet read from the file being written are read in
+            # before it's overwritten
+            if any(isinstance(sasm_list, LazySasmList)
+                and os.path.abspath(sasm_list.filename) == save_name
+                for sasm_list in [seriesm._sasm_list,
+                seriesm.subtracted_sasm_list,
+                seriesm.baseline_subtracted_sasm_list, seriesm.baseline_corr]):
+                seriesm._loadAllProfiles()
+
+            seriesm_data = getSeriesSaveDict(seriesm, save_gui_data)
+
+            if append:
+                sasms = getSeriesProfiles(seriesm)
+
+                first_frames = getSeriesAppendFrames(save_state, seriesm_data,
+                    sasms)
+            else:
+                first_frames = None
+
+            if first_frames is None:
+                _series_save_states.pop(seriesm, None)
+
+                with h5py.File(save_name, 'w', libver='earliest') as f:
+                    write_series(f, seriesm_data, save_gui_data, compression)
+            else:
+                with h5py.File(save_name, 'r+') as f:
+                    write_series(f, seriesm_data, save_gui_data, compression,
+                        first_frames, saveAverageBufferChanged(save_state,
+                        sasms))
+
+            if append:
+                file_stat = os.stat(save_name)
+
+                _series_save_states[seriesm] = {
+                    'filename'          : save_name,
+                    'file_stat'         : (file_stat.st_mtime_ns, file_stat.st_size),
+                    'profiles'          : {key: getSavedProfilesState(sasms[key],
+                        seriesm_data[key]) for key in series_profile_keys},
+                    'average_buffer'    : getSavedObjectState(sasms['average_buffer_sasm']),
+                    }
+
+        finally:
+            if append:
+                seriesm.releaseSemaphore()
+
+def getSeriesSaveDict(seriesm, save_gui_data=False):
     seriesm_dict = seriesm.extractAll()
 
     if save_gui_data:
@@ -3690,55 +5048,65 @@ def save_series(save_name, seriesm, save_gui_data=False):
 
     seriesm_dict['parameters_analysis'] = seriesm_dict['parameters']['analysis']  #pickle wont save this unless its raised up
 
-    seriesm_data = copy.deepcopy(seriesm_dict)
+    return seriesm_dict
 
-    with h5py.File(save_name, 'w', driver='core', libver='earliest') as f:
-        f.attrs['file_type'] = 'RAW_Series'
-        f.attrs['raw_version'] = RAWGlobals.version
-        f.attrs['parameters'] = formatHeader(seriesm_data['parameters'])
-        f.attrs['series_type'] = seriesm_data['series_type']
-
-        if save_gui_data:
-            try:
-                f.attrs['item_font_color'] = seriesm_data['item_font_color']
-                f.attrs['item_selected_for_plot'] = seriesm_data['item_selected_for_plot']
-            except Exception:
-                pass
+def write_series(f, seriesm_data, save_gui_data=False, compression=None,
+    first_frames=None, save_average_buffer=True):
+    """
+    Writes extracted series data to an open hdf5 file. If first_frames is
+    given, the file is an existing series file being appended to, and it
+    gives the first profile in each profile list that needs to be written.
+    """
+    if first_frames is None:
+        first_frames = {key: 0 for key in series_profile_keys}
 
-        # Add filename info
-        for j in range(len(seriesm_data['file_list'])):
-            seriesm_data['file_list'][j] = seriesm_data['file_list'][j].encode('utf-8')
+    f.attrs['file_type'] = 'RAW_Series'
+    f.attrs['raw_version'] = RAWGlobals.version
+    f.attrs['layout_version'] = series_layout_version
+    f.attrs['parameters'] = formatHeader(seriesm_data['parameters'])
+    f.attrs['series_type'] = seriesm_data['series_type']
 
+    if save_gui_data:
         try:
-            dtype = h5py.string_dtype() #h5py 2.10, python 3
+            f.attrs['item_font_color'] = seriesm_data['item_font_color']
+            f.attrs['item_selected_for_plot'] = seriesm_data['item_selected_for_plot']
         except Exception:
-            if six.PY3:
-                dtype = h5py.special_dtype(vlen=str) #h5py < 2.10, python3
-            else:
-                dtype = h5py.special_dtype(vlen=unicode) #h5py < 2.10, python2
+            pass
+
+    # Add filename info
+    file_names = [fname.encode('utf-8') for fname in seriesm_data['file_list']]
 
-        fname_data = f.create_dataset('file_names', data=seriesm_data['file_list'],
-            dtype=dtype)
-        fname_data.attrs['description'] = ('Ordered list of filenames, '
-            'corresponding to profile numbering order.')
+    fname_data = writeSeriesDataset(f, 'file_names', file_names,
+        dtype=getHdf5StringDtype())
+    fname_data.attrs['description'] = ('Ordered list of filenames, '
+        'corresponding to profile numbering order.')
 
-        # Add frame numbers
-        frames = f.create_dataset('frame_numbers', data=seriesm_data['frame_list'])
-        frames.attrs['description'] = ('List of frame numbers, corresponding to '
-            'profile numbers.')
+    # Add frame numbers
+    frames = writeSeriesDataset(f, 'frame_numbers', seriesm_data['frame_list'])
+    frames.attrs['description'] = ('List of frame numbers, corresponding to '
+        'profile numbers.')
 
-        # Add time
-        times = f.create_dataset('times', data=seriesm_data['time'])
-        times.attrs['description'] = ('Ordered list of acquisition time of the profiles, '
-            'corresponding to the profile numbering order (may not be available).')
-        times.attrs['unit'] = 's'
+    # Add time
+    times = writeSeriesDataset(f, 'times', seriesm_data['time'])
+    times.attrs['description'] = ('Ordered list of acquisition time of the profiles, '
+        'corresponding to the profile numbering order (may not be available).')
+    times.attrs['unit'] = 's'
 
 
-        # Add individual profiles
-        profiles = f.create_group('profiles')
-        profiles.attrs['profile_type'] = 'input'
-        profiles.attrs['description'] = ('Input scattering profiles without processing.')
-        save_series_sasm_list(profiles, seriesm_data['sasm_list'])
+    # Add individual profiles
+    profiles = f.require_group('profiles')
+    profiles.attrs['profile_type'] = 'input'
+    profiles.attrs['description'] = ('Input scattering profiles without processing.')
+    save_series_sasm_list(profiles, seriesm_data['sasm_list'],
+        compression=compression, first_frame=first_frames['sasm_list'])
+
+    if save_average_buffer:
+        # When appending, a changed average buffer replaces the saved one
+        if 'average_buffer_profile' in profiles:
+            del profiles['average_buffer_profile']
+
+        if 'raw' in profiles and 'average_buffer_profile' in profiles['raw']:
+            del profiles['raw']['average_buffer_profile']
 
         if (seriesm_data['average_buffer_sasm'] is None
             or seriesm_data['average_buffer_sasm'] == -1):
@@ -3751,198 +5119,203 @@ def save_series(save_name, seriesm, save_gui_data=False):
 
             save_series_sasm(profiles, sasm, "average_buffer_profile", descrip, descrip)
 
-        if save_gui_data:
-            try:
-                profiles.attrs['line_color'] = seriesm_data['line_color']
-                profiles.attrs['line_width'] = seriesm_data['line_width']
-                profiles.attrs['line_style'] = seriesm_data['line_style']
-                profiles.attrs['line_marker'] = seriesm_data['line_marker']
-                profiles.attrs['line_visible'] = seriesm_data['line_visible']
-                profiles.attrs['line_marker_face_color'] = seriesm_data['line_marker_face_color']
-                profiles.attrs['line_marker_edge_color'] = seriesm_data['line_marker_edge_color']
-                profiles.attrs['line_visible'] = seriesm_data['line_visible']
-                profiles.attrs['line_legend_label'] = seriesm_data['line_legend_label']
-            except Exception:
-                pass
+    if save_gui_data:
+        try:
+            profiles.attrs['line_color'] = seriesm_data['line_color']
+            profiles.attrs['line_width'] = seriesm_data['line_width']
+            profiles.attrs['line_style'] = seriesm_data['line_style']
+            profiles.attrs['line_marker'] = seriesm_data['line_marker']
+            profiles.attrs['line_visible'] = seriesm_data['line_visible']
+            profiles.attrs['line_marker_face_color'] = seriesm_data['line_marker_face_color']
+            profiles.attrs['line_marker_edge_color'] = seriesm_data['line_marker_edge_color']
+            profiles.attrs['line_visible'] = seriesm_data['line_visible']
+            profiles.attrs['line_legend_label'] = seriesm_data['line_legend_label']
+        except Exception:
+            pass
 
-        sub_profiles = f.create_group('subtracted_profiles')
-        sub_profiles.attrs['profile_type'] = 'subtracted'
-        sub_profiles.attrs['description'] = ('Subtracted scattering profiles.')
-        sub_profiles.attrs['use_subtracted_sasm'] = seriesm_data['use_subtracted_sasm']
-        save_series_sasm_list(sub_profiles, seriesm_data['subtracted_sasm_list'])
-
-        baseline_profiles = f.create_group('baseline_subtracted_profiles')
-        baseline_profiles.attrs['profile_type'] = 'subtracted_and_baseline_corrected'
-        baseline_profiles.attrs['description'] = ('Baseline corrected and subtracted '
-            'scattering profiles.')
-        baseline_profiles.attrs['use_baseline_subtracted_sasm'] = seriesm_data['use_baseline_subtracted_sasm']
-        save_series_sasm_list(baseline_profiles, seriesm_data['baseline_subtracted_sasm_list'])
-
-
-        # Add intensities
-        intensity = f.create_group('intensities')
-        intensity.attrs['intensity_type'] = 'input'
-        intensity.attrs['description'] = ('Intensities for each input scattering profile')
-        intensity.attrs['buffer_range'] = seriesm_data['buffer_range']
-        intensity.attrs['already_subtracted'] = seriesm_data['already_subtracted']
-
-        total_i_dset = intensity.create_dataset('total_intensities',
-            data=seriesm_data['total_i'])
-        total_i_dset.attrs['description'] = ('Total integrated intensity for each '
-            'input scattering profile.')
-
-        mean_i_dset = intensity.create_dataset('mean_intensities',
-            data=seriesm_data['mean_i'])
-        mean_i_dset.attrs['description'] = ('Mean intensity for each input '
-            'scattering profile.')
-
-        qref_i_dset = intensity.create_dataset('qref_intensities',
-            data=seriesm_data['i_of_q'])
-        qref_i_dset.attrs['description'] = ('Intensity at a single q value for each input '
-            'scattering profile (may not be available).')
-        qref_i_dset.attrs['q_value'] = seriesm_data['qref']
-
-        qrange_i_dset = intensity.create_dataset('qrange_intensities',
-            data=seriesm_data['qrange_I'])
-        qrange_i_dset.attrs['description'] = ('Intensity in a range q values '
-            'for each input scattering profile (may not be available).')
-        qrange_i_dset.attrs['q_range'] = seriesm_data['qrange']
-
-        # Add subtracted intensities
-        intensity = f.create_group('subtracted_intensities')
-        intensity.attrs['intensity_type'] = 'subtracted'
-        intensity.attrs['description'] = ('Intensities for each subtracted '
-            'scattering profile (if available)')
-        intensity.attrs['sample_range'] = seriesm_data['sample_range']
-
-        total_i_dset = intensity.create_dataset('total_intensities',
-            data=seriesm_data['total_i_sub'])
-        total_i_dset.attrs['description'] = ('Total integrated intensity for each '
-            'subtracted scattering profile.')
-
-        mean_i_dset = intensity.create_dataset('mean_intensities',
-            data=seriesm_data['mean_i_sub'])
-        mean_i_dset.attrs['description'] = ('Mean intensity for each subtracted '
-            'scattering profile.')
-
-        qref_i_dset = intensity.create_dataset('qref_intensities',
-            data=seriesm_data['I_of_q_sub'])
-        qref_i_dset.attrs['description'] = ('Intensity at a single q value for '
-            'each subtracted scattering profile (may not be available).')
-        qref_i_dset.attrs['q_value'] = seriesm_data['qref']
-
-        qrange_i_dset = intensity.create_dataset('qrange_intensities',
-            data=seriesm_data['qrange_I_sub'])
-        qrange_i_dset.attrs['description'] = ('Intensity in a range of q values for '
-            'each subtracted scattering profile (may not be available).')
-        qrange_i_dset.attrs['q_range'] = seriesm_data['qrange']
-
-        # Add baseline corrected intensities
-        intensity = f.create_group('baseline_subtracted_intensities')
-        intensity.attrs['intensity_type'] = 'subtracted_and_baseline_corrected'
-        intensity.attrs['description'] = ('Intensities for each baseline '
-            'corrected and subtracted scattering profile (if available)')
-
-        total_i_dset = intensity.create_dataset('total_intensities',
-            data=seriesm_data['total_i_bcsub'])
-        total_i_dset.attrs['description'] = ('Total integrated intensity for each '
-            'subtracted scattering profile.')
-
-        mean_i_dset = intensity.create_dataset('mean_intensities',
-            data=seriesm_data['mean_i_bcsub'])
-        mean_i_dset.attrs['description'] = ('Mean intensity for each baseline '
-            'corrected and subtracted scattering profile.')
-
-        qref_i_dset = intensity.create_dataset('qref_intensities',
-            data=seriesm_data['I_of_q_bcsub'])
-        qref_i_dset.attrs['description'] = ('Intensity at a single q value for '
-            'each baseline corrected and subtracted scattering profile (may not '
-            'be available).')
-        qref_i_dset.attrs['q_value'] = seriesm_data['qref']
-
-        qrange_i_dset = intensity.create_dataset('qrange_intensities',
-            data=seriesm_data['qrange_I_bcsub'])
-        qrange_i_dset.attrs['description'] = ('Intensity in a range of q values for '
-            'each baseline corrected and subtracted scattering profile (may not '
-            'be available).')
-        qrange_i_dset.attrs['q_range'] = seriesm_data['qrange']
-
-
-        # Add calculated data
-        calc_data = f.create_group('calculated_data')
-        calc_data.attrs['description'] = ('Automatically calculated parameters '
-            'for subtracted or baseline corrected data. Default value of -1 '
-            'for any value indiciates either no calculation or an unsuccessful '
-            'automatic result.')
-        calc_data.attrs['window_size'] = seriesm_data['window_size']
-        calc_data.attrs['molecule_type'] = seriesm_data['mol_type']
-        calc_data.attrs['molecule_density'] = seriesm_data['mol_density']
-        calc_data.attrs['has_data'] = seriesm_data['calc_has_data']
-
-        if save_gui_data:
-            try:
-                calc_data.attrs['line_color'] = seriesm_data['calc_line_color']
-                calc_data.attrs['line_width'] = seriesm_data['calc_line_width']
-                calc_data.attrs['line_style'] = seriesm_data['calc_line_style']
-                calc_data.attrs['line_marker'] = seriesm_data['calc_line_marker']
-                calc_data.attrs['line_visible'] = seriesm_data['calc_line_visible']
-                calc_data.attrs['line_marker_face_color'] = seriesm_data['calc_line_marker_face_color']
-                calc_data.attrs['line_marker_edge_color'] = seriesm_data['calc_line_marker_edge_color']
-                calc_data.attrs['line_visible'] = seriesm_data['calc_line_visible']
-                calc_data.attrs['line_legend_label'] = seriesm_data['calc_line_legend_label']
-            except Exception:
-                pass
+    sub_profiles = f.require_group('subtracted_profiles')
+    sub_profiles.attrs['profile_type'] = 'subtracted'
+    sub_profiles.attrs['description'] = ('Subtracted scattering profiles.')
+    sub_profiles.attrs['use_subtracted_sasm'] = seriesm_data['use_subtracted_sasm']
+    save_series_sasm_list(sub_profiles, seriesm_data['subtracted_sasm_list'],
+        compression=compression,
+        first_frame=first_frames['subtracted_sasm_list'])
+
+    baseline_profiles = f.require_group('baseline_subtracted_profiles')
+    baseline_profiles.attrs['profile_type'] = 'subtracted_and_baseline_corrected'
+    baseline_profiles.attrs['description'] = ('Baseline corrected and subtracted '
+        'scattering profiles.')
+    baseline_profiles.attrs['use_baseline_subtracted_sasm'] = seriesm_data['use_baseline_subtracted_sasm']
+    save_series_sasm_list(baseline_profiles,
+        seriesm_data['baseline_subtracted_sasm_list'], compression=compression,
+        first_frame=first_frames['baseline_subtracted_sasm_list'])
+
+
+    # Add intensities
+    intensity = f.require_group('intensities')
+    intensity.attrs['intensity_type'] = 'input'
+    intensity.attrs['description'] = ('Intensities for each input scattering profile')
+    intensity.attrs['buffer_range'] = seriesm_data['buffer_range']
+    intensity.attrs['already_subtracted'] = seriesm_data['already_subtracted']
+
+    total_i_dset = writeSeriesDataset(intensity, 'total_intensities',
+        data=seriesm_data['total_i'])
+    total_i_dset.attrs['description'] = ('Total integrated intensity for each '
+        'input scattering profile.')
+
+    mean_i_dset = writeSeriesDataset(intensity, 'mean_intensities',
+        data=seriesm_data['mean_i'])
+    mean_i_dset.attrs['description'] = ('Mean intensity for each input '
+        'scattering profile.')
+
+    qref_i_dset = writeSeriesDataset(intensity, 'qref_intensities',
+        data=seriesm_data['i_of_q'])
+    qref_i_dset.attrs['description'] = ('Intensity at a single q value for each input '
+        'scattering profile (may not be available).')
+    qref_i_dset.attrs['q_value'] = seriesm_data['qref']
+
+    qrange_i_dset = writeSeriesDataset(intensity, 'qrange_intensities',
+        data=seriesm_data['qrange_I'])
+    qrange_i_dset.attrs['description'] = ('Intensity in a range q values '
+        'for each input scattering profile (may not be available).')
+    qrange_i_dset.attrs['q_range'] = seriesm_data['qrange']
+
+    # Add subtracted intensities
+    intensity = f.require_group('subtracted_intensities')
+    intensity.attrs['intensity_type'] = 'subtracted'
+    intensity.attrs['description'] = ('Intensities for each subtracted '
+        'scattering profile (if available)')
+    intensity.attrs['sample_range'] = seriesm_data['sample_range']
+
+    total_i_dset = writeSeriesDataset(intensity, 'total_intensities',
+        data=seriesm_data['total_i_sub'])
+    total_i_dset.attrs['description'] = ('Total integrated intensity for each '
+        'subtracted scattering profile.')
+
+    mean_i_dset = writeSeriesDataset(intensity, 'mean_intensities',
+        data=seriesm_data['mean_i_sub'])
+    mean_i_dset.attrs['description'] = ('Mean intensity for each subtracted '
+        'scattering profile.')
+
+    qref_i_dset = writeSeriesDataset(intensity, 'qref_intensities',
+        data=seriesm_data['I_of_q_sub'])
+    qref_i_dset.attrs['description'] = ('Intensity at a single q value for '
+        'each subtracted scattering profile (may not be available).')
+    qref_i_dset.attrs['q_value'] = seriesm_data['qref']
+
+    qrange_i_dset = writeSeriesDataset(intensity, 'qrange_intensities',
+        data=seriesm_data['qrange_I_sub'])
+    qrange_i_dset.attrs['description'] = ('Intensity in a range of q values for '
+        'each subtracted scattering profile (may not be available).')
+    qrange_i_dset.attrs['q_range'] = seriesm_data['qrange']
+
+    # Add baseline corrected intensities
+    intensity = f.require_group('baseline_subtracted_intensities')
+    intensity.attrs['intensity_type'] = 'subtracted_and_baseline_corrected'
+    intensity.attrs['description'] = ('Intensities for each baseline '
+        'corrected and subtracted scattering profile (if available)')
+
+    total_i_dset = writeSeriesDataset(intensity, 'total_intensities',
+        data=seriesm_data['total_i_bcsub'])
+    total_i_dset.attrs['description'] = ('Total integrated intensity for each '
+        'subtracted scattering profile.')
+
+    mean_i_dset = writeSeriesDataset(intensity, 'mean_intensities',
+        data=seriesm_data['mean_i_bcsub'])
+    mean_i_dset.attrs['description'] = ('Mean intensity for each baseline '
+        'corrected and subtracted scattering profile.')
+
+    qref_i_dset = writeSeriesDataset(intensity, 'qref_intensities',
+        data=seriesm_data['I_of_q_bcsub'])
+    qref_i_dset.attrs['description'] = ('Intensity at a single q value for '
+        'each baseline corrected and subtracted scattering profile (may not '
+        'be available).')
+    qref_i_dset.attrs['q_value'] = seriesm_data['qref']
+
+    qrange_i_dset = writeSeriesDataset(intensity, 'qrange_intensities',
+        data=seriesm_data['qrange_I_bcsub'])
+    qrange_i_dset.attrs['description'] = ('Intensity in a range of q values for '
+        'each baseline corrected and subtracted scattering profile (may not '
+        'be available).')
+    qrange_i_dset.attrs['q_range'] = seriesm_data['qrange']
+
+
+    # Add calculated data
+    calc_data = f.require_group('calculated_data')
+    calc_data.attrs['description'] = ('Automatically calculated parameters '
+        'for subtracted or baseline corrected data. Default value of -1 '
+        'for any value indiciates either no calculation or an unsuccessful '
+        'automatic result.')
+    calc_data.attrs['window_size'] = seriesm_data['window_size']
+    calc_data.attrs['molecule_type'] = seriesm_data['mol_type']
+    calc_data.attrs['molecule_density'] = seriesm_data['mol_density']
+    calc_data.attrs['has_data'] = seriesm_data['calc_has_data']
 
-        rg_data = calc_data.create_dataset('rg',
-            data=np.column_stack((seriesm_data['rg'], seriesm_data['rger'])))
-        rg_data.attrs['description'] = ('Radius of gyration (Rg) calculated on a '
-            'frame by frame basis. Column 0 and 1 are Rg and Rg uncertainty '
-            'respectively')
-
-        rg_data = calc_data.create_dataset('I0',
-            data=np.column_stack((seriesm_data['i0'], seriesm_data['i0er'])))
-        rg_data.attrs['description'] = ('Scattering intensity at zero angle '
-            '(I(0)) calculated on a frame by frame basis. Column 0 and 1 are '
-            'I(0) and I(0) uncertainty respectively')
-
-        vp_data = calc_data.create_dataset('vp_mw', data=seriesm_data['vpmw'])
-        vp_data.attrs['description'] = ('Molecular weight calculated using the '
-            'adjusted Porod volume method calculated on a frame by frame basis.')
-
-        vc_data = calc_data.create_dataset('vc_mw',
-            data=np.column_stack((seriesm_data['vcmw'], seriesm_data['vcmwer'])))
-        vc_data.attrs['description'] = ('Molecular weight calculated using the '
-            'adjusted Porod volume method calculated on a frame by frame basis. '
-            'Columns 0 and 1 and MW and MW uncertainty respectively.')
-
-
-        # Add baseline
-        baseline = f.create_group('baseline')
-        baseline.attrs['description'] = ('Values for the baseline correction.')
-        baseline.attrs['baseline_start_range'] = seriesm_data['baseline_start_range']
-        baseline.attrs['baseline_end_range'] = seriesm_data['baseline_end_range']
-        baseline.attrs['baseline_type'] = seriesm_data['baseline_type']
-        baseline.attrs['baseline_extrapolation'] = seriesm_data['baseline_extrap']
-
-        correction = baseline.create_group('correction')
-        correction.attrs['description'] = ('The q dependent baseline correction '
-            'on a frame by frame basis.')
-
-        if seriesm_data['baseline_type'] == 'Linear' and not seriesm_data['baseline_extrap']:
-            frame_num_offset = seriesm_data['baseline_start_range'][0]
-        elif seriesm_data['baseline_type'] == 'Integral':
-            frame_num_offset = seriesm_data['baseline_start_range'][1]
-        else:
-            frame_num_offset = 0
+    if save_gui_data:
+        try:
+            calc_data.attrs['line_color'] = seriesm_data['calc_line_color']
+            calc_data.attrs['line_width'] = seriesm_data['calc_line_width']
+            calc_data.attrs['line_style'] = seriesm_data['calc_line_style']
+            calc_data.attrs['line_marker'] = seriesm_data['calc_line_marker']
+            calc_data.attrs['line_visible'] = seriesm_data['calc_line_visible']
+            calc_data.attrs['line_marker_face_color'] = seriesm_data['calc_line_marker_face_color']
+            calc_data.attrs['line_marker_edge_color'] = seriesm_data['calc_line_marker_edge_color']
+            calc_data.attrs['line_visible'] = seriesm_data['calc_line_visible']
+            calc_data.attrs['line_legend_label'] = seriesm_data['calc_line_legend_label']
+        except Exception:
+            pass
+
+    rg_data = writeSeriesDataset(calc_data, 'rg',
+        data=np.column_stack((seriesm_data['rg'], seriesm_data['rger'])))
+    rg_data.attrs['description'] = ('Radius of gyration (Rg) calculated on a '
+        'frame by frame basis. Column 0 and 1 are Rg and Rg uncertainty '
+        'respectively')
+
+    rg_data = writeSeriesDataset(calc_data, 'I0',
+        data=np.column_stack((seriesm_data['i0'], seriesm_data['i0er'])))
+    rg_data.attrs['description'] = ('Scattering intensity at zero angle '
+        '(I(0)) calculated on a frame by frame basis. Column 0 and 1 are '
+        'I(0) and I(0) uncertainty respectively')
+
+    vp_data = writeSeriesDataset(calc_data, 'vp_mw', data=seriesm_data['vpmw'])
+    vp_data.attrs['description'] = ('Molecular weight calculated using the '
+        'adjusted Porod volume method calculated on a frame by frame basis.')
+
+    vc_data = writeSeriesDataset(calc_data, 'vc_mw',
+        data=np.column_stack((seriesm_data['vcmw'], seriesm_data['vcmwer'])))
+    vc_data.attrs['description'] = ('Molecular weight calculated using the '
+        'adjusted Porod volume method calculated on a frame by frame basis. '
+        'Columns 0 and 1 and MW and MW uncertainty respectively.')
+
+
+    # Add baseline
+    baseline = f.require_group('baseline')
+    baseline.attrs['description'] = ('Values for the baseline correction.')
+    baseline.attrs['baseline_start_range'] = seriesm_data['baseline_start_range']
+    baseline.attrs['baseline_end_range'] = seriesm_data['baseline_end_range']
+    baseline.attrs['baseline_type'] = seriesm_data['baseline_type']
+    baseline.attrs['baseline_extrapolation'] = seriesm_data['baseline_extrap']
+
+    correction = baseline.require_group('correction')
+    correction.attrs['description'] = ('The q dependent baseline correction '
+        'on a frame by frame basis.')
+
+    if seriesm_data['baseline_type'] == 'Linear' and not seriesm_data['baseline_extrap']:
+        frame_num_offset = seriesm_data['baseline_start_range'][0]
+    elif seriesm_data['baseline_type'] == 'Integral':
+        frame_num_offset = seriesm_data['baseline_start_range'][1]
+    else:
+        frame_num_offset = 0
 
-        save_series_sasm_list(correction, seriesm_data['baseline_corr'])
+    save_series_sasm_list(correction, seriesm_data['baseline_corr'],
+        compression=compression, first_frame=first_frames['baseline_corr'])
 
-        fit_params = baseline.create_dataset("fit_parameters",
-            data=seriesm_data['baseline_fit_results'])
-        fit_params.attrs['description'] = ('Fit parameters for each q value '
-            'for a linear baseline correction. Columns 0-4 correspond to '
-            'intercept, slope, and the covariance for intercept and slope '
-            'respectively.')
+    fit_params = writeSeriesDataset(baseline, 'fit_parameters',
+        data=seriesm_data['baseline_fit_results'])
+    fit_params.attrs['description'] = ('Fit parameters for each q value '
+        'for a linear baseline correction. Columns 0-4 correspond to '
+        'intercept, slope, and the covariance for intercept and slope '
+        'respectively.')
 
 
 def saveAnalysisCsvFile(sasm_list, include_data, save_path):
@@ -4902,38 +6275,64 @@ def writeHeader(d, f2, ignore_list = []):
 
     f2.write('\n\n')
 
-def formatHeader(d):
-    d = translateHeader(d)
+def formatHeader(d, compact=False):
+    # Only the dicts need to be new, as history may be removed
+    d = translateHeader(d, copy_values=False)
+
+    if compact:
+        json_format = {'separators': (',', ':')}
+    else:
+        json_format = {'indent': 4}
+
+    header = json.dumps(d, sort_keys = True, cls = SASUtils.MyEncoder, **json_format)
 
-    header = json.dumps(d, indent = 4, sort_keys = True, cls = SASUtils.MyEncoder)
+    if compact:
+        # About the number of lines the indented header would have
+        n_lines = header.count(',') + header.count('{') + header.count('[')
+    else:
+        n_lines = header.count('\n')
 
-    if header.count('\n') > 3000:
+    if n_lines > 3000:
         try:
             del d['history']
-            header = json.dumps(d, indent = 4, sort_keys = True, cls = SASUtils.MyEncoder)
+            header = json.dumps(d, sort_keys = True, cls = SASUtils.MyEncoder,
+                **json_format)
         except Exception:
             pass
 
     return header
 
-def translateHeader(header, to_sasbdb=True):
+def translateHeader(header, to_sasbdb=True, copy_values=True):
     """
     Translates the header keywords to or from matching SASBDB format. This is
     to add compatibility with SASBDB while maintaining compatibility with older
-    RAW formats and RAW internals.
+    RAW formats and RAW internals. The dicts are always new, values are only
+    shared with the input header if copy_values is False.
     """
-    new_header = copy.deepcopy(header)
+    if to_sasbdb:
+        trans = sasbdb_trans
+    else:
+        trans = sasbdb_back_trans
+
+    if copy_values:
+        copy_value = copy.deepcopy
+    else:
+        copy_value = lambda value: value
 
-    for key in header.keys():
-        if isinstance(header[key], dict):
-            new_header[key] = translateHeader(header[key], to_sasbdb)
+    new_header = {}
+    translated = []
+
+    # Each value is only copied once, translated keys go at the end
+    for key, value in header.items():
+        if isinstance(value, dict):
+            new_header[key] = translateHeader(value, to_sasbdb, copy_values)
+        elif key in trans:
+            translated.append(key)
         else:
-            if to_sasbdb:
-                if key in sasbdb_trans:
-                    new_header[sasbdb_trans[key]] = new_header.pop(key)
-            else:
-                if key in sasbdb_back_trans:
-                    new_header[sasbdb_back_trans[key]] = new_header.pop(key)
+            new_header[key] = copy_value(value)
+
+    for key in translated:
+        new_header[trans[key]] = copy_value(header[key])
 
     return new_header
 
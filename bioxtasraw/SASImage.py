@@ -27,10 +27,14 @@ from builtins import object, range, map, zip
 from io import open
 
 import sys
+import copy
 import math
 import os
+import collections
+import threading
 
 import numpy as np
+import scipy.sparse
 import pyFAI
 
 raw_path = os.path.abspath(os.path.join('.', __file__, '..', '..'))
@@ -49,18 +53,28 @@ import bioxtasraw.SASProc as SASProc
 def calcExpression(expr, img_hdr, file_hdr):
 
         if expr != '':
-            mathparser = SASParser.PyMathParser()
-            mathparser.addDefaultFunctions()
-            mathparser.addDefaultVariables()
-            mathparser.addSpecialVariables(file_hdr)
-            mathparser.addSpecialVariables(img_hdr)
-            mathparser.expression = expr
-
-            val = mathparser.evaluate()
+            # Expressions are compiled once and reused for every image
+            mathparser = SASParser.compileExpression(expr)
+
+            val = mathparser.evaluate(img_hdr, file_hdr)
             return val
         else:
             return None
 
+def calcExpressionStack(expr, img_hdrs, file_hdrs):
+    """
+    Evaluates an expression for a stack of frames at once, using the header
+    and counter values of each frame as numpy arrays. Returns an array with
+    the value for each frame, or None if the expression is empty.
+    """
+    if expr != '':
+        mathparser = SASParser.compileExpression(expr)
+
+        val = mathparser.evaluateStack(img_hdrs, file_hdrs)
+        return val
+    else:
+        return None
+
 def getBindListDataFromHeader(raw_settings, img_hdr, file_hdr, keys):
 
     bind_list = raw_settings.get('HeaderBindList')
@@ -104,7 +118,224 @@ def getBindListDataFromHeader(raw_settings, img_hdr, file_hdr, keys):
 
     return result
 
-def integrateCalibrateNormalize(img, parameters, raw_settings):
+def integrateCalibrateNormalize(img, parameters, raw_settings, binnings=None):
+    """
+    Radially averages, calibrates, and normalizes an image. If binnings is
+    given (see makeBinnedSasms), rebinned profiles are also made from the
+    same integration, and the SASM and a dictionary of the binned SASMs are
+    returned.
+    """
+    integration_setup = prepareIntegration(img, parameters, raw_settings)
+
+    sasm = integrateWithSetup(img, parameters, integration_setup,
+        binnings=binnings)
+
+    return sasm
+
+def integrateCalibrateNormalizeStack(imgs, parameters_list, raw_settings,
+    binnings=None):
+    """
+    Radially averages a stack of images, such as all of the frames in an
+    Eiger hdf5 file, that share the same calibration, mask, and integration
+    settings. The integration setup is done once for the whole stack, instead
+    of once per image, and then applied to each frame.
+
+    If the calibration, mask, or configuration file are read from the image
+    header they can change from frame to frame, so in that case each image is
+    set up and integrated individually.
+
+    imgs should be a 3D array (frames, y, x) or a list of 2D images, and
+    parameters_list a list of the corresponding parameters dictionaries.
+    Returns a list of SASMs in the same order as the input images. If
+    binnings is given (see makeBinnedSasms), each entry in the list is the
+    SASM and a dictionary of binned SASMs for that image.
+    """
+    per_image_setup = (raw_settings.get('UseHeaderForConfig')
+        or raw_settings.get('UseHeaderForMask')
+        or raw_settings.get('UseHeaderForCalib'))
+
+    # Zingers are removed using the neighboring frames in the stack
+    if raw_settings.get('ZingerRemovalStack'):
+        imgs = removeZingersImageStack(imgs,
+            raw_settings.get('ZingerRemovalStackWindow'),
+            raw_settings.get('ZingerRemovalStackStd'))
+
+    if per_image_setup:
+        sasm_list = [integrateCalibrateNormalize(img, parameters, raw_settings,
+            binnings) for img, parameters in zip(imgs, parameters_list)]
+
+    elif len(parameters_list) > 0:
+        integration_setup = prepareIntegration(imgs[0], parameters_list[0],
+            raw_settings)
+
+        norm_values = calcNormValuesStack(imgs, parameters_list,
+            integration_setup)
+
+        plan = integration_setup['plan']
+
+        # The built in sparse integrator does the whole stack at once
+        if plan.csr_integrator is not None and not plan.zinger_removal:
+            sasm_list = integrateStackWithSetup(imgs, parameters_list,
+                integration_setup, norm_values, binnings)
+
+        else:
+            sasm_list = [integrateWithSetup(img, parameters, integration_setup,
+                norm_values[i], binnings) for i, (img, parameters)
+                in enumerate(zip(imgs, parameters_list))]
+
+    else:
+        sasm_list = []
+
+    return sasm_list
+
+def removeZingersImageStack(imgs, window_length=2, stds=5.0, chunk_size=65536):
+    """
+    Removes zingers from a stack of images, such as consecutive frames from
+    a SEC-SAXS run, using the temporal neighbors of each pixel. A pixel is
+    replaced by the median of the same pixel in the window_length frames on
+    either side if it is more than stds poisson standard deviations above
+    that median. This is done for all of the frames at once, chunk_size
+    pixels at a time. Returns a new 3D array, the input images aren't
+    modified.
+    """
+    imgs = np.asarray(imgs)
+    cleaned = imgs.copy()
+
+    if imgs.shape[0] < 2 or window_length < 1:
+        return cleaned
+
+    neighbors = SASProc.temporalNeighbors(imgs.shape[0], window_length)
+
+    flat_imgs = cleaned.reshape(imgs.shape[0], -1)
+
+    for start in range(0, flat_imgs.shape[1], chunk_size):
+        data = flat_imgs[:, start:start+chunk_size]
+
+        # The median is at least the minimum of the neighbors, so only pixels
+        # that are outliers compared to the minimum can be zingers
+        neighbor_min = data[neighbors[0]]
+        for idx in neighbors[1:]:
+            np.minimum(neighbor_min, data[idx], out=neighbor_min)
+
+        neighbor_min = neighbor_min.astype(float)
+
+        candidates = data - neighbor_min > stds*np.sqrt(np.maximum(neighbor_min, 1))
+
+        if not candidates.any():
+            continue
+
+        frames, pixels = np.nonzero(candidates)
+
+        values = data[frames, pixels]
+        median = np.median(data[neighbors[:, frames], pixels], axis=0)
+
+        zingers = values - median > stds*np.sqrt(np.maximum(median, 1))
+
+        if np.issubdtype(data.dtype, np.integer):
+            median = np.rint(median)
+
+        data[frames[zingers], pixels[zingers]] = median[zingers]
+
+    return cleaned
+
+# Least recently used cache of ROI pixel indices, keyed on the mask id
+roi_index_cache_size = 16
+_roi_indices = collections.OrderedDict()
+_roi_indices_lock = threading.Lock()
+
+def getROIIndices(mask):
+    """
+    Returns the row and column indices of the pixels in an ROI mask (pixels
+    equal to 1). Masks are matched by identity, as the settings replace
+    rather than modify them, so the indices are only found once per mask.
+    """
+    key = id(mask)
+
+    with _roi_indices_lock:
+        cached = _roi_indices.get(key)
+
+        if cached is not None and cached[0] is mask:
+            _roi_indices.move_to_end(key)
+            return cached[1]
+
+    indices = np.nonzero(mask == 1)
+
+    with _roi_indices_lock:
+        # Keep the mask so its id can't be reused while it's cached
+        _roi_indices[key] = (mask, indices)
+
+        while len(_roi_indices) > roi_index_cache_size:
+            _roi_indices.popitem(last=False)
+
+    return indices
+
+def calcROICounter(img, mask):
+    """Returns the sum of the image in the ROI mask, the ROI counter"""
+    rows, cols = getROIIndices(mask)
+
+    return img[rows, cols].sum()
+
+def calcROICountersStack(imgs, rois):
+    """
+    Calculates ROI counters for a stack of images. imgs is a 3D array (frame,
+    row, column) or a list of images, and rois is a dictionary of ROI names
+    and masks. Returns a dictionary of ROI names and arrays of the counter
+    for each image.
+    """
+    counters = {}
+
+    for name, mask in rois.items():
+        rows, cols = getROIIndices(mask)
+
+        if isinstance(imgs, np.ndarray) and imgs.ndim == 3:
+            counters[name] = imgs[:, rows, cols].sum(axis=1)
+        else:
+            counters[name] = np.array([img[rows, cols].sum() for img in imgs])
+
+    return counters
+
+def calcNormValuesStack(imgs, parameters_list, integration_setup):
+    """
+    Calculates the values of the normalization expressions for a stack of
+    images at once. Returns a list with the values for each image, to be
+    passed to integrateWithSetup, or a list of None if normalization isn't
+    enabled.
+    """
+    normlist = integration_setup['normlist']
+    tbs_mask = integration_setup['tbs_mask']
+
+    if normlist is None:
+        return [None]*len(parameters_list)
+
+    # The ROI counter can be used in the normalization expressions
+    if tbs_mask is not None:
+        roi_counters = calcROICountersStack(imgs, {'roi_counter': tbs_mask})
+
+        for i, parameters in enumerate(parameters_list):
+            parameters['counters']['roi_counter'] = roi_counters['roi_counter'][i]
+
+    img_hdrs = [parameters['imageHeader'] for parameters in parameters_list]
+    file_hdrs = [parameters['counters'] for parameters in parameters_list]
+
+    expr_vals = [calcExpressionStack(expr, img_hdrs, file_hdrs)
+        for op, expr in normlist]
+
+    norm_values = []
+
+    for i in range(len(parameters_list)):
+        norm_values.append([vals[i] if vals is not None else None
+            for vals in expr_vals])
+
+    return norm_values
+
+def prepareIntegration(img, parameters, raw_settings):
+    """
+    Reads the settings and sets up the mask, calibration, and azimuthal
+    integrator needed to radially average the image. Returns a dictionary
+    that is passed to integrateWithSetup. The setup only depends on the image
+    shape and, if header values are used for the configuration, mask, or
+    calibration, on the image header.
+    """
     use_hdr_config = raw_settings.get('UseHeaderForConfig')
 
     img_hdr = parameters['imageHeader']
@@ -134,24 +365,11 @@ def integrateCalibrateNormalize(img, parameters, raw_settings):
                                                 'Config file ' + settings_path + ' does not exist.',
                                                 'Check the path in the "General Settings" options. Clear the field to make RAW look for the config file in the same folder as the image.'])
 
-        RAWSettings.loadSettings(raw_settings, settings_path, auto_load = True)
-
-        mask_dict = raw_settings.get('Masks')
-        img_dim = raw_settings.get('MaskDimension')
-
-        #Create the masks
-        for each_key in mask_dict:
-            masks = mask_dict[each_key][1]
+        # Loads the settings and creates the masks, reusing them if this
+        # config file was recently loaded
+        RAWSettings.loadSettingsCached(raw_settings, settings_path, auto_load = True)
 
-            if masks is not None:
-                mask_img = SASMask.createMaskMatrix(img_dim, masks)
-                mask_param = mask_dict[each_key]
-                mask_param[0] = mask_img
-                mask_param[1] = masks
-                mask_param[2] = np.logical_not(mask_img)
-
-    else:
-        mask_dict = raw_settings.get('Masks')
+    mask_dict = raw_settings.get('Masks')
 
     # Get settings
     use_hdr_mask = raw_settings.get('UseHeaderForMask')
@@ -177,16 +395,12 @@ def integrateCalibrateNormalize(img, parameters, raw_settings):
     angular_unit = raw_settings.get('AngularUnit')
     error_model = raw_settings.get('ErrorModel')
     use_image_for_variance = raw_settings.get('UseImageForVariance')
-    ai = raw_settings.get('AzimuthalIntegrator')
 
     if not do_polarization:
         polarization_factor = None
 
     if use_image_for_variance:
-        variance = img
         error_model = None
-    else:
-        variance = None
 
     if not do_flatfield:
         flatfield_image = None
@@ -244,10 +458,6 @@ def integrateCalibrateNormalize(img, parameters, raw_settings):
     else:
         bs_mask = mask_dict['BeamStopMask'][2]
         tbs_mask = mask_dict['TransparentBSMask'][0]
-
-    if bs_mask is None:
-        bs_mask = np.zeros(img.shape)
-
     # Get values from image header if applicable
     if use_hdr_calib:
         result = getBindListDataFromHeader(raw_settings, img_hdr, file_hdr,
@@ -286,82 +496,259 @@ def integrateCalibrateNormalize(img, parameters, raw_settings):
         if pixel_size_y < 1:
             pixel_size_y = pixel_size_y*1000
 
-    # ********* WARNING WARNING WARNING ****************#
-    # Hmm.. axes start from the lower left, but array coords starts
-    # from upper left:
-    #####################################################
-    y_c = img.shape[0]-y_c
+    metadata = None
+    if raw_settings.get('EnableMetadata'):
+        meta_list = raw_settings.get('MetadataList')
+        if meta_list is not None and len(meta_list) > 0:
+            metadata = {key:value for (key, value) in meta_list}
+
+    if normlist is None or not do_normalization:
+        normlist = None
+
+    if abs_scale_water:
+        abs_scale = {'Method'                   : 'Water',
+                    'Absolute_scale_factor'     : abs_scale_water_factor,
+                    }
+        abs_scale_factor = abs_scale_water_factor
+
+    elif abs_scale_gc and abs_scale_gc_ignore_bkg:
+        abs_scale = {'Method'                   : 'Glassy_carbon',
+                    'Ignore_background'         : True,
+                    'Absolute_scale_factor'     : abs_scale_gc_factor,
+                    }
+        abs_scale_factor = abs_scale_gc_factor
+
+    else:
+        abs_scale = None
+        abs_scale_factor = 1.0
+
+    plan_kwargs = {
+        'img_shape'             : img.shape,
+        'sd_distance'           : sd_distance,
+        'x_c'                   : x_c,
+        'y_c'                   : y_c,
+        'det_tilt'              : det_tilt,
+        'det_tilt_plan_rot'     : det_tilt_plan_rot,
+        'pixel_size_x'          : pixel_size_x,
+        'pixel_size_y'          : pixel_size_y,
+        'wavelength'            : wavelength,
+        'bin_type'              : bin_type,
+        'bin_size'              : bin_size,
+        'mask'                  : bs_mask,
+        'do_solidangle'         : do_solidangle,
+        'polarization_factor'   : polarization_factor,
+        'integration_method'    : integration_method,
+        'angular_unit'          : angular_unit,
+        'error_model'           : error_model,
+        'flatfield_image'       : flatfield_image,
+        'dark_image'            : dark_image,
+        'zinger_removal'        : zinger_removal,
+        'zinger_thres'          : zinger_thres,
+        'zinger_iter'           : zinger_iter,
+        }
 
-    # Find the maximum distance to the edge in the image:
-    # img = np.float64(img)
-    ylen, xlen = img.shape
+    # A mask read from the header can change with every image, so it isn't
+    # cached
+    plan = getIntegrationPlan(use_cache=not use_hdr_mask, **plan_kwargs)
+
+    raw_settings.set('AzimuthalIntegrator', plan.ai)
+
+    integration_setup = {
+        'plan'                      : plan,
+        'use_image_for_variance'    : use_image_for_variance,
+        'tbs_mask'                  : tbs_mask,
+        'normlist'                  : normlist,
+        'abs_scale'                 : abs_scale,
+        'abs_scale_factor'          : abs_scale_factor,
+        'config_file'               : raw_settings.get('CurrentCfg'),
+        'metadata'                  : metadata,
+        }
 
-    xlen = int(xlen)
-    ylen = int(ylen)
-    maxlen1 = int(max(xlen - x_c, ylen - y_c, xlen - (xlen - x_c), ylen - (ylen - y_c)))
+    return integration_setup
 
-    diag1 = int(np.sqrt((xlen-x_c)**2 + y_c**2))
-    diag2 = int(np.sqrt((x_c**2 + y_c**2)))
-    diag3 = int(np.sqrt((x_c**2 + (ylen-y_c)**2)))
-    diag4 = int(np.sqrt((xlen-x_c)**2 + (ylen-y_c)**2))
+def integrateWithSetup(img, parameters, integration_setup, norm_values=None,
+    binnings=None):
+    """
+    Radially averages, calibrates, and normalizes a single image using a
+    setup made by prepareIntegration. Only the per-image values (ROI counter
+    and normalization from the header values) are calculated here, the rest
+    comes from the setup's IntegrationPlan. If given, norm_values are the
+    already calculated values of the normalization expressions for the
+    image, as returned by calcNormValuesStack.
 
-    maxlen = int(max(diag1, diag2, diag3, diag4, maxlen1))
+    If binnings is given (see makeBinnedSasms), rebinned profiles are made
+    from the same integration, and the SASM and a dictionary of the binned
+    SASMs are returned.
+    """
+    plan = integration_setup['plan']
 
-    if bin_type == 'Linear' and bin_size != 1:
-        npts = maxlen//bin_size
+    ai = plan.ai
+    npts = plan.npts
+    zinger_removal = plan.zinger_removal
+
+    norm_factor, all_norms_mult = setImageParameters(img, parameters,
+        integration_setup, norm_values)
+
+    integration_kwargs = copy.copy(plan.integration_kwargs)
+
+    if integration_setup['use_image_for_variance']:
+        integration_kwargs['variance'] = img
     else:
-        npts = maxlen
+        integration_kwargs['variance'] = None
 
+    sums = None
 
-    # Create radially averaged file metadata
-    parameters['normalizations'] = {}
-    if do_solidangle:
-        parameters['normalizations']['Solid_Angle_Correction'] = 'On'
-
-    parameters['normalizations']['Polarization'] = {'Used' : do_polarization}
-    if do_polarization:
-        parameters['normalizations']['Polarization']['Factor'] = polarization_factor
-
-    calibrate_dict = {'Sample_Detector_Distance'    : sd_distance,
-                    'Detector_X_Pixel_Size'         : pixel_size_x,
-                    'Detector_Y_Pixel_Size'         : pixel_size_y,
-                    'Wavelength'                    : wavelength,
-                    'Beam_Center_X'                 : x_c,
-                    'Beam_Center_Y'                 : y_c,
-                    'Detector Tilt'                 : det_tilt,
-                    'Detector Tilt Plane Rotation'  : det_tilt_plan_rot,
-                    'Radial_Average_Method'         : 'pyFAI',
-                    'Integration Method'            : integration_method,
-                    }
+    #Carry out the integration
+    if plan.csr_integrator is not None and not zinger_removal:
+        q, iq, errorbars, sums = plan.csr_integrator.integrate(img,
+            norm_factor, integration_kwargs['variance'], return_sums=True)
+
+    else:
+        if not zinger_removal:
+            integrate_func = ai.integrate1d
+
+            integration_kwargs['normalization_factor'] = norm_factor
+
+        else:
+            integrate_func = ai.sigma_clip_ng
+
+            #Necessary for the legacy version, hopefully the ng will be available soon
+            # del integration_kwargs['variance']
+            # del integration_kwargs['radial_range']
+            # del integration_kwargs['error_model']
+
+            # normalization_factor is not passed, to work around a bug that should
+            # be fixed in pyFAI 0.22
+
+        result = integrate_func(img, npts, **integration_kwargs)
+        q, iq, errorbars = result
+
+        if binnings is not None:
+            sums = getIntegrationSums(result, iq)
 
-    parameters['calibration_params'] = calibrate_dict
+        if zinger_removal:
+            iq /= norm_factor
+            errorbars /= norm_factor
+
+            if sums is not None:
+                sums = (sums[0], sums[1]*norm_factor, sums[2])
+
+    sasm = makeIntegratedSasm(q, iq, errorbars, parameters, integration_setup,
+        norm_values, all_norms_mult, binnings, sums)
+
+    return sasm
+
+def getIntegrationSums(result, iq):
+    """
+    Returns the per-bin sums of the signal, normalization, and variance from
+    a pyFAI integration result, or None if they aren't available (such as
+    for the legacy integration methods).
+    """
+    sums = []
+
+    for name in ('sum_signal', 'sum_normalization', 'sum_variance'):
+        try:
+            val = getattr(result, name)
+        except AttributeError:
+            val = None
+
+        if val is None or np.shape(val) != np.shape(iq):
+            return None
+
+        sums.append(np.asarray(val, dtype=float))
+
+    return tuple(sums)
+
+def integrateStackWithSetup(imgs, parameters_list, integration_setup,
+    norm_values_list, binnings=None):
+    """
+    Radially averages, calibrates, and normalizes a stack of images at once
+    with the built in sparse matrix integrator (see CSRIntegrator) of the
+    setup's IntegrationPlan. Returns a list of SASMs, or if binnings is given
+    (see makeBinnedSasms) a list of the SASMs and binned SASMs for each
+    image.
+    """
+    plan = integration_setup['plan']
+
+    norm_factors = []
+    all_mult_list = []
+
+    for img, parameters, norm_values in zip(imgs, parameters_list,
+        norm_values_list):
+        norm_factor, all_norms_mult = setImageParameters(img, parameters,
+            integration_setup, norm_values)
+
+        norm_factors.append(norm_factor)
+        all_mult_list.append(all_norms_mult)
+
+    if binnings is not None:
+        q, iqs, errorbars, sums = plan.csr_integrator.integrateStack(imgs,
+            norm_factors, integration_setup['use_image_for_variance'],
+            return_sums=True)
+    else:
+        q, iqs, errorbars = plan.csr_integrator.integrateStack(imgs,
+            norm_factors, integration_setup['use_image_for_variance'])
+
+    sasm_list = []
+
+    for i, parameters in enumerate(parameters_list):
+        if binnings is not None:
+            image_sums = (sums[0][i], sums[1][i], sums[2][i])
+        else:
+            image_sums = None
+
+        sasm_list.append(makeIntegratedSasm(q, iqs[i], errorbars[i],
+            parameters, integration_setup, norm_values_list[i],
+            all_mult_list[i], binnings, image_sums))
+
+    return sasm_list
+
+def setImageParameters(img, parameters, integration_setup, norm_values=None):
+    """
+    Adds the radially averaged file metadata and ROI counter to the image
+    parameters, and calculates the normalization factor for the integration.
+    Returns the normalization factor and whether all of the normalizations
+    are multiplicative (and so included in the factor).
+    """
+    img_hdr = parameters['imageHeader']
+    file_hdr = parameters['counters']
+
+    plan = integration_setup['plan']
+
+    tbs_mask = integration_setup['tbs_mask']
+    normlist = integration_setup['normlist']
+    abs_scale = integration_setup['abs_scale']
+
+    # Create radially averaged file metadata
+    parameters['normalizations'] = copy.deepcopy(plan.normalizations)
+    parameters['calibration_params'] = copy.copy(plan.calibrate_dict)
     parameters['raw_version'] = RAWGlobals.version
-    parameters['config_file'] = raw_settings.get('CurrentCfg')
+    parameters['config_file'] = integration_setup['config_file']
 
-    if raw_settings.get('EnableMetadata'):
-        meta_list = raw_settings.get('MetadataList')
-        if meta_list is not None and len(meta_list) > 0:
-            metadata = {key:value for (key, value) in meta_list}
-            parameters['metadata'] = metadata
+    if integration_setup['metadata'] is not None:
+        parameters['metadata'] = copy.copy(integration_setup['metadata'])
 
     # Calculate the ROI if applicable
     if tbs_mask is not None:
-        roi_counter = img[tbs_mask==1].sum()
+        roi_counter = calcROICounter(img, tbs_mask)
         parameters['counters']['roi_counter'] = roi_counter
 
     all_norms_mult = True
     norm_factor = 1.0
     #Calculate the normalization parameter if applicable
-    if normlist is not None and do_normalization:
+    if normlist is not None:
         parameters['normalizations']['Counter_norms'] = normlist
 
-        for op, expr in normlist:
+        for i, (op, expr) in enumerate(normlist):
             if op != '/' and op != '*':
                 all_norms_mult = False
                 break
 
             else:
-                val = calcExpression(expr, img_hdr, file_hdr)
+                if norm_values is not None:
+                    val = norm_values[i]
+                else:
+                    val = calcExpression(expr, img_hdr, file_hdr)
 
                 if val is not None:
                     val = float(val)
@@ -382,113 +769,106 @@ def integrateCalibrateNormalize(img, parameters, raw_settings):
         if not all_norms_mult:
             norm_factor = 1.0
 
-    if abs_scale_water:
-        parameters['normalizations']['Absolute_scale'] = {}
-        parameters['normalizations']['Absolute_scale']['Method'] = 'Water'
-        parameters['normalizations']['Absolute_scale']['Absolute_scale_factor'] = abs_scale_water_factor
-
-        norm_factor = norm_factor * abs_scale_water_factor
-
-    elif abs_scale_gc and abs_scale_gc_ignore_bkg:
-        parameters['normalizations']['Absolute_scale'] = {}
-        parameters['normalizations']['Absolute_scale']['Method'] = 'Glassy_carbon'
-        parameters['normalizations']['Absolute_scale']['Ignore_background'] = True
-        parameters['normalizations']['Absolute_scale']['Absolute_scale_factor'] = abs_scale_gc_factor
+    if abs_scale is not None:
+        parameters['normalizations']['Absolute_scale'] = copy.copy(abs_scale)
 
-        norm_factor = norm_factor * abs_scale_gc_factor
+        norm_factor = norm_factor * integration_setup['abs_scale_factor']
 
     # pyFAI expects a divisible normalization factor
     norm_factor = 1./norm_factor
 
-    #Put everything in appropriate units
-    wavelength = wavelength*1e-10 #convert wl to m
+    return norm_factor, all_norms_mult
 
-    if ai is None:
-        ai = pyFAI.azimuthalIntegrator.AzimuthalIntegrator()
-        ai.set_wavelength(wavelength)
+def makeIntegratedSasm(q, iq, errorbars, parameters, integration_setup,
+    norm_values, all_norms_mult, binnings=None, sums=None):
+    """
+    Makes the SASM for a radially averaged image, applying the normalizations
+    that couldn't be included in the integration and the log binning.
 
-    if wavelength != ai.get_wavelength():
-        ai.set_wavelength(wavelength)
+    If binnings is given, the profile is also rebinned in each of the ways
+    given (see makeBinnedSasms), and the SASM and a dictionary of the binned
+    SASMs are returned.
+    """
+    plan = integration_setup['plan']
 
-    try:
-        ai_settings = ai.getFit2D()
-        reinitialize_ai = not (round(ai_settings['directDist'], 6) == round(sd_distance, 6)
-            and round(ai_settings['centerX'], 6) == round(x_c, 6)
-            and round(ai_settings['centerY'], 6) == round(y_c, 6)
-            and round(ai_settings['tilt'], 6) == round(det_tilt, 6)
-            and round(ai_settings['tiltPlanRotation'], 6) == round(det_tilt_plan_rot, 6)
-            and round(ai.get_pixel2()*1e6, 6) == round(pixel_size_x, 6)
-            and round(ai.get_pixel1()*1e6, 6) == round(pixel_size_y, 6))
-    except Exception:
-        reinitialize_ai = True
-
-    if reinitialize_ai:
-        ai.setFit2D(sd_distance, x_c, y_c, det_tilt, det_tilt_plan_rot, pixel_size_x,
-            pixel_size_y)
+    errorbars = np.nan_to_num(errorbars)
 
-        raw_settings.set('AzimuthalIntegrator', ai)
+    sasm = SASM.SASM(iq, q, errorbars, parameters)
 
-    if pixel_size_x == pixel_size_y and angular_unit == 'q_A^-1':
-        qmin_theta = SASCalib.calcTheta(sd_distance*1e-3, pixel_size_x*1e-6, 0)
-        qmin = ((4 * math.pi * math.sin(qmin_theta)) / (wavelength*1e10))
+    applyNormalizations(sasm, integration_setup, norm_values, all_norms_mult)
 
-        qmax_theta = SASCalib.calcTheta(sd_distance*1e-3, pixel_size_x*1e-6, maxlen)
-        qmax = ((4 * math.pi * math.sin(qmax_theta)) / (wavelength*1e10))
+    if binnings is not None:
+        binned_sasms = makeBinnedSasms(q, iq, errorbars, sasm,
+            integration_setup, norm_values, all_norms_mult, binnings, sums)
 
-        q_range = (qmin, qmax)
+    if plan.bin_type == 'Log10' and plan.bin_size != 1:
+        sasm = SASProc.logBinning(sasm, len(q)//plan.bin_size)
 
+    if binnings is not None:
+        return sasm, binned_sasms
     else:
-        q_range = None
-
-    integration_kwargs = {
-        'mask'                  : bs_mask,
-        'variance'              : variance,
-        'correctSolidAngle'     : do_solidangle,
-        'error_model'           : error_model,
-        'unit'                  : angular_unit,
-        'radial_range'          : q_range,
-        'method'                : integration_method,
-        'normalization_factor'  : norm_factor,
-        'polarization_factor'   : polarization_factor,
-        'flat'                  : flatfield_image,
-        'dark'                  : dark_image,
-        }
-
-    #Carry out the integration
-    if not zinger_removal:
-        integrate_func = ai.integrate1d
-
-    else:
-        integrate_func = ai.sigma_clip_ng
-
-        integration_kwargs['thres'] = zinger_thres
-        integration_kwargs['max_iter'] = zinger_iter
+        return sasm
+
+def makeBinnedSasms(q, iq, errorbars, sasm, integration_setup, norm_values,
+    all_norms_mult, binnings, sums=None):
+    """
+    Makes rebinned SASMs for a radially averaged image, from the same
+    integration as the full profile. binnings is a dictionary where each key
+    is a name and each value a dictionary of the npts, rebin_factor, and
+    log_rebin keyword arguments of SASProc.binEdges. sums are the per-bin
+    sums of the signal, normalization, and variance from the integration.
+    With them each new bin is the average of all of its pixels. Without
+    them the bins are averaged, as SASProc.rebin does. Returns a dictionary
+    of the binned SASMs.
+    """
+    if sums is None:
+        sums = (iq, np.ones_like(iq), errorbars**2)
+
+    binned_sasms = {}
+
+    for name, bin_kwargs in binnings.items():
+        edges = SASProc.binEdges(len(q), **bin_kwargs)
+
+        binned_q, binned_i, binned_err = SASProc.binAccumulated(q, sums[0],
+            sums[1], sums[2], edges)
+
+        parameters = SASM.copyParameters(sasm.getAllParameters())
+
+        if bin_kwargs.get('log_rebin', False):
+            history_key = 'log_binning'
+        else:
+            history_key = 'linear_binning'
 
-        #Necessary for the legacy version, hopefully the ng will be available soon
-        # del integration_kwargs['variance']
-        # del integration_kwargs['radial_range']
-        # del integration_kwargs['error_model']
+        parameters['history'][history_key] = {'initial_points' : len(q),
+            'final_points' : len(binned_q)}
 
-        del integration_kwargs['normalization_factor'] #Work around a bug that should be fixed in pyFAI 0.22
+        binned_sasm = SASM.SASM(binned_i, binned_q, binned_err, parameters)
 
-    q, iq, errorbars = integrate_func(img, npts, **integration_kwargs)
+        applyNormalizations(binned_sasm, integration_setup, norm_values,
+            all_norms_mult)
 
-    if zinger_removal:
-        iq /= norm_factor
-        errorbars /= norm_factor
+        binned_sasms[name] = binned_sasm
 
-    errorbars = np.nan_to_num(errorbars)
+    return binned_sasms
 
-    sasm = SASM.SASM(iq, q, errorbars, parameters)
+def applyNormalizations(sasm, integration_setup, norm_values, all_norms_mult):
+    """
+    Applies the normalizations that couldn't be included in the integration
+    normalization factor to a radially averaged profile.
+    """
+    normlist = integration_setup['normlist']
 
     img_hdr = sasm.getParameter('imageHeader')
     file_hdr = sasm.getParameter('counters')
 
-    if normlist is not None and do_normalization and not all_norms_mult:
-        for each in normlist:
+    if normlist is not None and not all_norms_mult:
+        for i, each in enumerate(normlist):
             op, expr = each
 
-            val = calcExpression(expr, img_hdr, file_hdr)
+            if norm_values is not None:
+                val = norm_values[i]
+            else:
+                val = calcExpression(expr, img_hdr, file_hdr)
 
             if val is not None:
                 val = float(val)
@@ -513,7 +893,435 @@ def integrateCalibrateNormalize(img, parameters, raw_settings):
             elif op == '-':
                 sasm.offsetRawIntensity(-val)
 
-    if bin_type == 'Log10' and bin_size != 1:
-        sasm = SASProc.logBinning(sasm, len(q)//bin_size)
 
-    return sasm
+class CSRIntegrator(object):
+    """
+    A radial integrator that uses a precomputed sparse (CSR) matrix mapping
+    each unmasked pixel to its q bin, so that integrating an image is a
+    single sparse matrix-vector product and integrating a stack of images is
+    a sparse matrix-matrix product. Pixels aren't split between bins, and
+    the matrix is the one pyFAI builds for its nosplit_csr method, so the
+    bins are the same as pyFAI's. The combined per pixel correction (solid
+    angle, polarization, flatfield) of the IntegrationPlan is summed for
+    each bin ahead of time. Errors are
+    propagated the same way as by pyFAI for the poisson and azimuthal error
+    models, or from a given variance.
+
+    Selected with the 'raw_csr' integration method.
+    """
+
+    # Number of frames integrated together in integrateStack, to limit the
+    # memory needed for the floating point copies of the frames
+    stack_chunk_size = 16
+
+    def __init__(self, ai, img_shape, npts, mask, unit, radial_range,
+        correction, dark_image, error_model):
+
+        self.img_shape = img_shape
+        self.npts = npts
+        self.error_model = error_model
+
+        # The pixel to bin matrix is taken from pyFAI's no split CSR
+        # integrator, set up the same way as for its nosplit_csr method, so
+        # that the bins are the same as pyFAI's by construction
+        if mask is None:
+            mask = ai.mask
+
+        engine = ai.setup_sparse_integrator(img_shape, npts, mask=mask,
+            pos0_range=radial_range, unit=unit, split='no', algo='CSR')
+
+        unit = pyFAI.units.to_unit(unit)
+        self.q = np.asarray(engine.bin_centers, dtype=float)*unit.scale
+
+        n_pixels = img_shape[0]*img_shape[1]
+
+        csr = scipy.sparse.csr_matrix((np.asarray(engine.data, dtype=float),
+            np.asarray(engine.indices), np.asarray(engine.indptr)),
+            shape=(npts, n_pixels))
+
+        # Per pixel normalization. As in pyFAI, pixels without a valid
+        # normalization are masked
+        if correction is not None:
+            pixel_norm = np.ravel(correction).astype(float)
+            invalid = ~np.isfinite(pixel_norm) | (pixel_norm == 0)
+
+            if invalid.any():
+                csr = csr.multiply(~invalid).tocsr()
+                csr.eliminate_zeros()
+        else:
+            pixel_norm = np.ones(n_pixels)
+
+        self.csr = csr
+
+        self.pixel_norm = pixel_norm
+        self.sum_norm = self.csr.dot(pixel_norm)
+        self.empty_bins = self.sum_norm == 0
+
+        if dark_image is not None:
+            self.dark = np.ravel(dark_image).astype(float)
+        else:
+            self.dark = None
+
+    def integrate(self, img, normalization_factor=1.0, variance=None,
+        return_sums=False):
+        """
+        Integrates an image. The intensity is divided by the
+        normalization_factor, as in pyFAI. If variance is None, the errors are
+        calculated using the error model. Returns q, intensity, and errors,
+        and if return_sums is True the per-bin sums of the signal,
+        normalization (including the normalization_factor), and variance.
+        """
+        raw = np.reshape(img, (-1, 1))
+
+        if variance is not None:
+            variance = np.reshape(variance, (-1, 1))
+
+        iq, errorbars, sums = self._integrateChunk(raw,
+            np.array([normalization_factor], dtype=float), variance)
+
+        if return_sums:
+            return (self.q, iq[:, 0], errorbars[:, 0],
+                tuple(each[:, 0] for each in sums))
+        else:
+            return self.q, iq[:, 0], errorbars[:, 0]
+
+    def integrateStack(self, imgs, normalization_factors,
+        use_image_for_variance=False, return_sums=False):
+        """
+        Integrates a stack of images (a 3D array or list of images) at once.
+        Returns q, and 2D arrays of intensity and errors with one row per
+        image, and if return_sums is True 2D arrays of the per-bin sums (see
+        integrate).
+        """
+        normalization_factors = np.asarray(normalization_factors, dtype=float)
+
+        iq = np.empty((len(normalization_factors), self.npts))
+        errorbars = np.empty_like(iq)
+
+        if return_sums:
+            sums = tuple(np.empty_like(iq) for j in range(3))
+
+        for start in range(0, len(normalization_factors), self.stack_chunk_size):
+            stop = start + self.stack_chunk_size
+
+            # Pixels along the rows and frames along the columns, so that the
+            # sparse matrix product reads each pixel's values together
+            raw = np.stack([np.ravel(img) for img in imgs[start:stop]]).T
+
+            if use_image_for_variance:
+                variance = raw
+            else:
+                variance = None
+
+            chunk_iq, chunk_err, chunk_sums = self._integrateChunk(raw,
+                normalization_factors[start:stop], variance)
+
+            iq[start:stop] = chunk_iq.T
+            errorbars[start:stop] = chunk_err.T
+
+            if return_sums:
+                for each, chunk_each in zip(sums, chunk_sums):
+                    each[start:stop] = chunk_each.T
+
+        if return_sums:
+            return self.q, iq, errorbars, sums
+        else:
+            return self.q, iq, errorbars
+
+    def _integrateChunk(self, raw, normalization_factors, variance):
+        # raw is (pixels, frames), results are (bins, frames)
+        if raw.dtype.kind == 'f':
+            invalid = ~np.isfinite(raw)
+            has_invalid = invalid.any()
+        else:
+            has_invalid = False
+
+        raw = np.array(raw, dtype=float, order='C')
+
+        if has_invalid:
+            raw[invalid] = 0
+
+        signal = raw
+        if self.dark is not None:
+            signal = raw - self.dark[:, np.newaxis]
+
+            if has_invalid:
+                signal[invalid] = 0
+
+        sum_signal = self.csr.dot(signal)
+
+        if has_invalid:
+            # Pixels that aren't finite are masked for that frame only
+            pixel_norm = np.where(invalid, 0, self.pixel_norm[:, np.newaxis])
+            sum_norm = self.csr.dot(pixel_norm)
+        else:
+            pixel_norm = self.pixel_norm[:, np.newaxis]
+            sum_norm = np.broadcast_to(self.sum_norm[:, np.newaxis],
+                sum_signal.shape)
+
+        empty_bins = sum_norm == 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            avg = sum_signal/sum_norm
+
+        avg[empty_bins] = 0
+
+        if variance is not None:
+            variance = np.ascontiguousarray(variance, dtype=float)
+
+            if has_invalid:
+                variance = np.where(invalid, 0, variance)
+
+            sum_var = self.csr.dot(variance)
+
+        elif self.error_model == 'poisson':
+            # Same as pyFAI's CSR integrators, which don't add the dark
+            # current to the variance
+            variance = np.maximum(raw, 1.0)
+
+            if has_invalid:
+                variance[invalid] = 0
+
+            sum_var = self.csr.dot(variance)
+
+        elif self.error_model == 'azimuthal':
+            # Deviation of each pixel from the average intensity of its bin
+            deviation = (signal - pixel_norm*self.csr.T.dot(avg))**2
+
+            if has_invalid:
+                deviation[invalid] = 0
+
+            sum_var = self.csr.dot(deviation)
+
+        else:
+            sum_var = np.zeros_like(sum_signal)
+
+        iq = avg/normalization_factors
+
+        sum_norm = sum_norm*normalization_factors
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            errorbars = np.sqrt(sum_var)/sum_norm
+
+        errorbars[empty_bins] = 0
+
+        return iq, errorbars, (sum_signal, sum_norm, sum_var)
+
+
+class IntegrationPlan(object):
+    """
+    Everything needed to radially average images that share the same shape,
+    geometry, mask, and corrections: the pyFAI azimuthal integrator, the mask,
+    the number of q bins and q range, the integration keywords, and the
+    normalization and calibration metadata templates. Plans are built by
+    getIntegrationPlan, which keeps recently used plans in a cache so that
+    the setup is only done once per configuration.
+    """
+
+    def __init__(self, img_shape, sd_distance, x_c, y_c, det_tilt,
+        det_tilt_plan_rot, pixel_size_x, pixel_size_y, wavelength, bin_type,
+        bin_size, mask, do_solidangle, polarization_factor, integration_method,
+        angular_unit, error_model, flatfield_image, dark_image, zinger_removal,
+        zinger_thres, zinger_iter):
+
+        self.img_shape = img_shape
+        self.bin_type = bin_type
+        self.bin_size = bin_size
+        self.zinger_removal = zinger_removal
+
+        if mask is None:
+            mask = np.zeros(img_shape)
+
+        self.mask = mask
+
+        # ********* WARNING WARNING WARNING ****************#
+        # Hmm.. axes start from the lower left, but array coords starts
+        # from upper left:
+        #####################################################
+        y_c = img_shape[0]-y_c
+
+        # Find the maximum distance to the edge in the image:
+        ylen, xlen = img_shape
+
+        xlen = int(xlen)
+        ylen = int(ylen)
+        maxlen1 = int(max(xlen - x_c, ylen - y_c, xlen - (xlen - x_c), ylen - (ylen - y_c)))
+
+        diag1 = int(np.sqrt((xlen-x_c)**2 + y_c**2))
+        diag2 = int(np.sqrt((x_c**2 + y_c**2)))
+        diag3 = int(np.sqrt((x_c**2 + (ylen-y_c)**2)))
+        diag4 = int(np.sqrt((xlen-x_c)**2 + (ylen-y_c)**2))
+
+        maxlen = int(max(diag1, diag2, diag3, diag4, maxlen1))
+
+        if bin_type == 'Linear' and bin_size != 1:
+            self.npts = maxlen//bin_size
+        else:
+            self.npts = maxlen
+
+        self.normalizations = {}
+        if do_solidangle:
+            self.normalizations['Solid_Angle_Correction'] = 'On'
+
+        do_polarization = polarization_factor is not None
+
+        self.normalizations['Polarization'] = {'Used' : do_polarization}
+        if do_polarization:
+            self.normalizations['Polarization']['Factor'] = polarization_factor
+
+        self.calibrate_dict = {'Sample_Detector_Distance'    : sd_distance,
+                            'Detector_X_Pixel_Size'         : pixel_size_x,
+                            'Detector_Y_Pixel_Size'         : pixel_size_y,
+                            'Wavelength'                    : wavelength,
+                            'Beam_Center_X'                 : x_c,
+                            'Beam_Center_Y'                 : y_c,
+                            'Detector Tilt'                 : det_tilt,
+                            'Detector Tilt Plane Rotation'  : det_tilt_plan_rot,
+                            'Radial_Average_Method'         : 'pyFAI',
+                            'Integration Method'            : integration_method,
+                            }
+
+        #Put everything in appropriate units
+        wavelength = wavelength*1e-10 #convert wl to m
+
+        self.ai = pyFAI.azimuthalIntegrator.AzimuthalIntegrator()
+        self.ai.set_wavelength(wavelength)
+        self.ai.setFit2D(sd_distance, x_c, y_c, det_tilt, det_tilt_plan_rot,
+            pixel_size_x, pixel_size_y)
+
+        if pixel_size_x == pixel_size_y and angular_unit == 'q_A^-1':
+            qmin_theta = SASCalib.calcTheta(sd_distance*1e-3, pixel_size_x*1e-6, 0)
+            qmin = ((4 * math.pi * math.sin(qmin_theta)) / (wavelength*1e10))
+
+            qmax_theta = SASCalib.calcTheta(sd_distance*1e-3, pixel_size_x*1e-6, maxlen)
+            qmax = ((4 * math.pi * math.sin(qmax_theta)) / (wavelength*1e10))
+
+            self.q_range = (qmin, qmax)
+
+        else:
+            self.q_range = None
+
+        # Precompute the correction arrays
+        if do_solidangle:
+            self.solid_angle = self.ai.solidAngleArray(img_shape)
+        else:
+            self.solid_angle = None
+
+        if do_polarization:
+            self.polarization = self.ai.polarization(img_shape,
+                polarization_factor)
+        else:
+            self.polarization = None
+
+        # The flatfield, solid angle, and polarization corrections are
+        # combined into one per pixel normalization array that is passed to
+        # pyFAI as the flatfield, so pyFAI applies a single array to each
+        # image instead of checking and applying each correction. It and the
+        # dark image are stored in the single precision pyFAI uses, so they
+        # aren't converted on every call.
+        self.correction = None
+
+        for correction in (flatfield_image, self.solid_angle, self.polarization):
+            if correction is not None:
+                if self.correction is None:
+                    self.correction = np.array(correction, dtype=float)
+                else:
+                    self.correction = self.correction*correction
+
+        if self.correction is not None:
+            self.correction = np.ascontiguousarray(self.correction,
+                dtype=np.float32)
+
+        if dark_image is not None:
+            self.dark = np.ascontiguousarray(dark_image, dtype=np.float32)
+        else:
+            self.dark = None
+
+        self.integration_kwargs = {
+            'mask'                  : self.mask,
+            'correctSolidAngle'     : False,
+            'error_model'           : error_model,
+            'unit'                  : angular_unit,
+            'radial_range'          : self.q_range,
+            'method'                : integration_method,
+            'polarization_factor'   : None,
+            'flat'                  : self.correction,
+            'dark'                  : self.dark,
+            }
+
+        if zinger_removal:
+            self.integration_kwargs['thres'] = zinger_thres
+            self.integration_kwargs['max_iter'] = zinger_iter
+
+        # The built in sparse integrator. pyFAI's equivalent method is used
+        # for sigma clipping, which the built in integrator doesn't do
+        if integration_method == 'raw_csr':
+            self.integration_kwargs['method'] = 'nosplit_csr'
+
+            self.csr_integrator = CSRIntegrator(self.ai, img_shape, self.npts,
+                self.mask, angular_unit, self.q_range, self.correction,
+                self.dark, error_model)
+
+        else:
+            self.csr_integrator = None
+
+# Least recently used cache of integration plans, shared by all settings
+integration_plan_cache_size = 4
+_integration_plans = collections.OrderedDict()
+_integration_plans_lock = threading.Lock()
+
+def getIntegrationPlan(use_cache=True, **plan_kwargs):
+    """
+    Returns an IntegrationPlan for the given keyword arguments (see
+    IntegrationPlan). If use_cache is True, a matching plan from the cache is
+    returned if available, otherwise the new plan is added to the cache and
+    the least recently used plan is dropped if the cache is full.
+
+    Arrays (mask, flatfield, and dark images) are matched by identity, as the
+    settings replace rather than modify them when they change. The cache
+    keeps the arrays, so their ids can't be reused while the plan is cached.
+    """
+    if not use_cache or integration_plan_cache_size < 1:
+        return IntegrationPlan(**plan_kwargs)
+
+    key = tuple((name, id(value)) if isinstance(value, np.ndarray)
+        else (name, value) for name, value in sorted(plan_kwargs.items()))
+
+    arrays = [value for name, value in sorted(plan_kwargs.items())
+        if isinstance(value, np.ndarray)]
+
+    plan = None
+
+    with _integration_plans_lock:
+        cached = _integration_plans.get(key)
+
+        if cached is not None and all(cached_array is array for cached_array,
+            array in zip(cached[0], arrays)):
+            _integration_plans.move_to_end(key)
+            plan = cached[1]
+
+    if plan is None:
+        plan = IntegrationPlan(**plan_kwargs)
+
+        with _integration_plans_lock:
+            _integration_plans[key] = (arrays, plan)
+
+            while len(_integration_plans) > integration_plan_cache_size:
+                _integration_plans.popitem(last=False)
+
+    return plan
+
+def clearIntegrationPlanCache():
+    with _integration_plans_lock:
+        _integration_plans.clear()
+
+# Settings whose arrays are used for the plan corrections. Setting them
+# clears the cached plans, as the old arrays may have been modified in place
+# and the plans would otherwise keep them in memory
+_plan_correction_keys = ('NormFlatfieldImage', 'DarkCorrImage')
+
+def _onSettingsChange(key):
+    if key in _plan_correction_keys:
+        clearIntegrationPlanCache()
+
+RAWSettings.addSettingsChangeCallback(_onSettingsChange)
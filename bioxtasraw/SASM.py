@@ -31,6 +31,7 @@ from io import open
 
 import copy
 import os
+import types
 
 import numpy as np
 from scipy import integrate as integrate
@@ -47,22 +48,40 @@ class SASM(object):
     Small Angle Scattering Measurement (SASM) Object. Essentially a
     scattering profile with q, i, and uncertainty, plus a lot of metadata.
 
+    Only the raw vectors are stored, the scaled vectors and the total and
+    mean intensity are calculated when they are first used after a change.
+
     Attributes
     ----------
     q: numpy.array
         The scaled q vector, without the trimming specified by
-        :func:`setQrange`.
+        :func:`setQrange`. Read only.
     i: numpy.array
         The scaled intensity vector, without the trimming specified by
-        :func:`setQrange`.
+        :func:`setQrange`. Read only.
     err: numpy.array
         The scaled error vector, without the trimming specified by
-        :func:`setQrange`.
+        :func:`setQrange`. Read only.
     q_err: numpy.array
         The scaled q error vector, without the trimming specified by
-        :func:`setQrange`. Typically only used with SANS data.
+        :func:`setQrange`. Typically only used with SANS data. Read only.
+    total_intensity: float
+        The total integrated intensity, as returned by :func:`getTotalI`.
+    mean_intensity: float
+        The mean intensity, as returned by :func:`getMeanI`.
     """
 
+    __slots__ = ('_i_raw', '_q_raw', '_err_raw', '_q_err_raw', '_parameters',
+        '_scale_factor', '_offset_value', '_q_scale_factor',
+        '_selected_q_range', '_i', '_q', '_err', '_q_err', '_total_intensity',
+        '_mean_intensity', 'item_panel', 'itempanel', 'plot_panel', 'line',
+        'err_line', 'axes', 'canvas', 'is_plotted', '_series_values',
+        '__weakref__')
+
+    # Values calculated from the raw vectors, None when they need updating
+    _cached_attrs = ('_i', '_q', '_err', '_q_err', '_total_intensity',
+        '_mean_intensity')
+
     def __init__(self, i, q, err, parameters, q_err=None):
         """
         Constructor
@@ -99,22 +118,14 @@ class SASM(object):
         if 'unit' not in self._parameters:
             self._parameters['unit'] = ''
 
-        #Modified intensity variables
-        self.i = self._i_raw.copy()
-        self.q = self._q_raw.copy()
-        self.err = self._err_raw.copy()
-
         #For SANS data with a qerr column
         try:
             if q_err is not None:
                 self._q_err_raw = np.array(q_err)
-                self.q_err = self._q_err_raw.copy()
             else:
                 self._q_err_raw = None
-                self.q_err = None
         except Exception:
             self._q_err_raw = None
-            self.q_err = None
 
         self._scale_factor = 1
         self._offset_value = 0
@@ -129,26 +140,33 @@ class SASM(object):
         self.is_plotted = False
         self._selected_q_range = (0, len(self._q_raw))
 
-        #Calculated values
-        try:
-            if len(self.q)>0:
-                self.total_intensity = integrate.trapz(self.getI(), self.getQ())
-                self.mean_intensity = self.getI().mean()
-            else:
-                self.total_intensity = -1
-                self.mean_intensity = -1
+        self._setDirty()
 
-        except Exception as e:
-            print(e)
-            self.total_intensity = -1
-            self.mean_intensity = -1
+    def __getstate__(self):
+        # Calculated values aren't pickled, they're recalculated when needed
+        state = {}
+
+        self._readSeriesValues()
+
+        for key in SASM.__slots__:
+            if (key not in ('__weakref__', '_series_values')
+                and key not in self._cached_attrs and hasattr(self, key)):
+                state[key] = getattr(self, key)
+
+        return state
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+        self._setDirty()
 
     def __deepcopy__(self, memo):
         #Raw intensity variables
         i_raw = copy.deepcopy(self._i_raw, memo)
         q_raw = copy.deepcopy(self._q_raw, memo)
         err_raw = copy.deepcopy(self._err_raw, memo)
-        parameters = copy.deepcopy(self._parameters, memo)
+        parameters = copyParameters(self._parameters, memo)
 
         newsasm = SASM(i_raw, q_raw, err_raw, parameters)
 
@@ -186,17 +204,159 @@ class SASM(object):
 
         return newsasm
 
-    def _update(self):
-        ''' updates modified intensity after scale, normalization and offset changes '''
+    def _setDirty(self, totals_only=False):
+        # Marks the calculated values as needing to be recalculated
+        if not totals_only:
+            self._i = None
+            self._q = None
+            self._err = None
+            self._q_err = None
+
+        self._total_intensity = None
+        self._mean_intensity = None
+
+        # Series matrices holding the profile are given the change
+        series_values = getattr(self, '_series_values', None)
+
+        if series_values:
+            self._readSeriesValues()
+
+            for values in list(series_values):
+                series_values[values] = values.version
+
+                matrix = values.matrix()
+
+                if matrix is not None:
+                    matrix._profileChanged(self)
+
+    def _addSeriesValues(self, values):
+        # Called by a SECM.SeriesMatrix when it stores the profile
+        self._readSeriesValues()
+
+        if getattr(self, '_series_values', None) is None:
+            self._series_values = {}
+
+        self._series_values[values] = values.version
+
+    def _removeSeriesValues(self, values):
+        # Called by a SECM.SeriesMatrix when it stops storing the profile
+        self._readSeriesValues()
+
+        if getattr(self, '_series_values', None) is not None:
+            self._series_values.pop(values, None)
+
+    def _readSeriesValues(self):
+        # Series set the scale, offset, and q range of all of their profiles
+        # at once (see SECM.SeriesValues), and each profile reads the values
+        # set since it was last changed when it's next used
+        series_values = getattr(self, '_series_values', None)
 
-        self.i = (self._i_raw * self._scale_factor) + self._offset_value
-        self.err = self._err_raw * abs(self._scale_factor)
-        self.q = self._q_raw * self._q_scale_factor
+        if series_values:
+            new_values = [values for values, version in series_values.items()
+                if values.version > version]
 
-        if self._q_err_raw is not None:
-            self.q_err = self._q_err_raw*self._q_scale_factor
+            if new_values:
+                new_values.sort(key=lambda values: values.version)
 
-        # print self.err_line
+                for values in new_values:
+                    series_values[values] = values.version
+
+                    self._scale_factor = values.scale_factor
+                    self._offset_value = values.offset_value
+
+                    if values.qrange is not None:
+                        self._selected_q_range = list(values.qrange)
+
+                for key in self._cached_attrs:
+                    setattr(self, key, None)
+
+    @staticmethod
+    def _scaleArray(raw, scale_factor, offset_value=0):
+        # Without a scale or offset the scaled array is a read only view of
+        # the raw array, rather than a copy
+        if scale_factor == 1 and offset_value == 0:
+            scaled = _readOnlyView(raw)
+        else:
+            scaled = raw * scale_factor
+            if offset_value != 0:
+                scaled = scaled + offset_value
+
+        return scaled
+
+    @property
+    def i(self):
+        self._readSeriesValues()
+
+        if self._i is None:
+            self._i = self._scaleArray(self._i_raw, self._scale_factor,
+                self._offset_value)
+
+        return self._i
+
+    @property
+    def q(self):
+        self._readSeriesValues()
+
+        if self._q is None:
+            self._q = self._scaleArray(self._q_raw, self._q_scale_factor)
+
+        return self._q
+
+    @property
+    def err(self):
+        self._readSeriesValues()
+
+        if self._err is None:
+            self._err = self._scaleArray(self._err_raw, abs(self._scale_factor))
+
+        return self._err
+
+    @property
+    def q_err(self):
+        self._readSeriesValues()
+
+        if self._q_err is None and self._q_err_raw is not None:
+            self._q_err = self._scaleArray(self._q_err_raw,
+                self._q_scale_factor)
+
+        return self._q_err
+
+    @property
+    def total_intensity(self):
+        self._readSeriesValues()
+
+        if self._total_intensity is None:
+            self._calcIntensities()
+
+        return self._total_intensity
+
+    @property
+    def mean_intensity(self):
+        self._readSeriesValues()
+
+        if self._mean_intensity is None:
+            self._calcIntensities()
+
+        return self._mean_intensity
+
+    def _calcIntensities(self):
+        try:
+            if len(self.q)>0:
+                self._total_intensity = integrate.trapz(self.getI(), self.getQ())
+                self._mean_intensity = self.getI().mean()
+            else:
+                self._total_intensity = -1
+                self._mean_intensity = -1
+
+        except Exception as e:
+            print(e)
+            self._total_intensity = -1
+            self._mean_intensity = -1
+
+    def _update(self):
+        ''' updates modified intensity after scale, normalization and offset changes '''
+
+        self._setDirty()
 
         if self.err_line is not None:
             #Update errorbar positions
@@ -217,20 +377,6 @@ class SASM(object):
             # Update the error bars
             barlinecols[0].set_segments(list(zip(list(zip(x,y-yerr)), list(zip(x,y+yerr)))))
 
-        #Calculated values
-        try:
-            if len(self.q)>0:
-                self.total_intensity = integrate.trapz(self.getI(), self.getQ())
-                self.mean_intensity = self.getI().mean()
-            else:
-                self.total_intensity = -1
-                self.mean_intensity = -1
-
-        except Exception as e:
-            print(e)
-            self.total_intensity = -1
-            self.mean_intensity = -1
-
     def getScale(self):
         """
         Returns the scale factor for the profile.
@@ -240,6 +386,8 @@ class SASM(object):
         scale: float
             The scale factor.
         """
+        self._readSeriesValues()
+
         return self._scale_factor
 
     def getOffset(self):
@@ -251,8 +399,23 @@ class SASM(object):
         offset: float
             The offset.
         """
+        self._readSeriesValues()
+
         return self._offset_value
 
+    def getQScale(self):
+        """
+        Returns the q scale factor for the profile.
+
+        Returns
+        -------
+        q_scale: float
+            The q scale factor.
+        """
+        self._readSeriesValues()
+
+        return self._q_scale_factor
+
     def getLine(self):
         """
         Returns the plotted line for the profile. Only used in the RAW GUI.
@@ -278,6 +441,8 @@ class SASM(object):
             The relative scale factor to be applied to the the profile
             intensity and uncertainty.
         """
+        self._readSeriesValues()
+
         self._scale_factor = abs(self._scale_factor * relscale)
         self._update()
 
@@ -295,6 +460,8 @@ class SASM(object):
             uncertainty.
         """
 
+        self._readSeriesValues()
+
         self._scale_factor = abs(scale_factor)
         self._update()
 
@@ -312,6 +479,8 @@ class SASM(object):
             The offset to be applied to the profile intensity.
         """
 
+        self._readSeriesValues()
+
         self._offset_value = offset_value
         self._update()
 
@@ -343,6 +512,8 @@ class SASM(object):
             The scale factor to be applied to the profile q values.
         """
 
+        self._readSeriesValues()
+
         self._q_scale_factor = q_scale_factor
         self._update()
 
@@ -360,6 +531,8 @@ class SASM(object):
             The relative scale factor to be applied to the the profile
             intensity and uncertainty.
         """
+        self._readSeriesValues()
+
         self._q_scale_factor = self._q_scale_factor * relscale
         self._update()
 
@@ -368,14 +541,14 @@ class SASM(object):
         Removes scale and offset values from the intensity, uncertainty, and q.
         """
 
-        self.i = self._i_raw.copy()
-        self.q = self._q_raw.copy()
-        self.err = self._err_raw.copy()
+        self._readSeriesValues()
 
         self._scale_factor = 1
         self._offset_value = 0
         self._q_scale_factor = 1
 
+        self._setDirty()
+
     def setQrange(self, qrange):
         """
         Sets the q range used for the profile. Useful for trimming leading or
@@ -389,6 +562,8 @@ class SASM(object):
             index of the q vector to be used, such that q[start:end] returns
             the desired q range.
         """
+        self._readSeriesValues()
+
         if qrange[0] < 0 or qrange[1] > (len(self._q_raw)):
             msg = ('Qrange: ' + str(qrange) + ' is not a valid q-range for a '
                 'q-vector of length ' + str(len(self._q_raw)-1))
@@ -396,18 +571,7 @@ class SASM(object):
         else:
             self._selected_q_range = list(map(int, qrange))
 
-            try:
-                if len(self.q)>0:
-                    self.total_intensity = integrate.trapz(self.getI(), self.getQ())
-                    self.mean_intensity = self.getI().mean()
-                else:
-                    self.total_intensity = -1
-                    self.mean_intensity = -1
-
-            except Exception as e:
-                print(e)
-                self.total_intensity = -1
-                self.mean_intensity = -1
+            self._setDirty(totals_only=True)
 
 
     def getQrange(self):
@@ -421,6 +585,8 @@ class SASM(object):
             A tuple with 2 indices, the start and end of the selected
             q range, such that q[start:end] returns the desired q range.
         """
+        self._readSeriesValues()
+
         return self._selected_q_range
 
     def setAllParameters(self, new_parameters):
@@ -585,6 +751,7 @@ class SASM(object):
             The new intensity vector.
         """
         self._i_raw = new_raw_i
+        self._setDirty()
 
     def setRawQ(self, new_raw_q):
         """
@@ -597,6 +764,7 @@ class SASM(object):
             The new q vector.
         """
         self._q_raw = new_raw_q
+        self._setDirty()
 
     def setRawErr(self, new_raw_err):
         """
@@ -609,6 +777,7 @@ class SASM(object):
             The new error vector.
         """
         self._err_raw = new_raw_err
+        self._setDirty()
 
     def setRawQErr(self, new_raw_q_err):
         """
@@ -624,6 +793,7 @@ class SASM(object):
             The new error vector.
         """
         self._q_err_raw = new_raw_q_err
+        self._setDirty()
 
     def setScaleValues(self, scale_factor, offset_value, q_scale_factor):
         """
@@ -640,6 +810,8 @@ class SASM(object):
         q_scale_factor: float
             The scale factor to be applied to the profile q values.
         """
+        self._readSeriesValues()
+
         self._scale_factor = scale_factor
         self._offset_value = offset_value
         self._q_scale_factor = q_scale_factor
@@ -691,6 +863,8 @@ class SASM(object):
             correspond to those values from the SASM.
         """
 
+        self._readSeriesValues()
+
         all_data = {}
 
         all_data['i_raw'] = self._i_raw
@@ -729,7 +903,7 @@ class SASM(object):
         """
 
         sasm = SASM(copy.deepcopy(self.i), copy.deepcopy(self.q),
-            copy.deepcopy(self.err), copy.deepcopy(self._parameters))
+            copy.deepcopy(self.err), copyParameters(self._parameters))
         sasm.setRawQErr(self._q_err_raw)
 
         return sasm
@@ -858,6 +1032,49 @@ class SASM(object):
         return q_err
 
 
+class SASMView(SASM):
+    """
+    A read only view of a SASM. The view shares the q, intensity, and error
+    vectors and the metadata of the profile, but has its own scale, offset,
+    and q range, so these can be changed without changing the profile.
+    Views are much cheaper to make than copies, and can be used anywhere a
+    SASM is read, for example by the similarity tests used to validate
+    buffer and sample ranges.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, sasm):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        sasm: bioxtasraw.SASM.SASM
+            The profile to view. The view starts with the scale, offset,
+            q scale, and q range of the profile.
+        """
+        self._i_raw = _readOnlyView(sasm.getRawI())
+        self._q_raw = _readOnlyView(sasm.getRawQ())
+        self._err_raw = _readOnlyView(sasm.getRawErr())
+        self._q_err_raw = _readOnlyView(sasm.getRawQErr())
+        self._parameters = types.MappingProxyType(sasm.getAllParameters())
+
+        self._scale_factor = sasm.getScale()
+        self._offset_value = sasm.getOffset()
+        self._q_scale_factor = sasm.getQScale()
+        self._selected_q_range = tuple(sasm.getQrange())
+
+        self.item_panel = None
+        self.plot_panel = None
+        self.line = None
+        self.err_line = None
+        self.axes = None
+        self.is_plotted = False
+
+        self._setDirty()
+
+
 class IFTM(object):
     """
     Inverse Fourier transform measurement (IFTM) object. Contains the P(r), r
@@ -1147,3 +1364,57 @@ def postProcessSasm(sasm, raw_settings):
         start_idx = raw_settings.get('ZingerRemoveIdx')
 
         sasm.removeZingers(start_idx, winlen, std)
+
+def copyParameters(parameters, memo=None):
+    """
+    Copies a profile parameters (metadata) dictionary. All of the dictionaries
+    are new, so the copy can be changed without changing the original, but
+    immutable values are shared rather than copied. The entries of the
+    history are shared too, as history entries are never changed once they
+    are made, only added to the history of new profiles.
+    """
+    new_parameters = {}
+
+    for key, value in parameters.items():
+        if key == 'history' and isinstance(value, dict):
+            new_parameters[key] = dict(value)
+        else:
+            new_parameters[key] = _copyParameterValue(value, memo)
+
+    return new_parameters
+
+def _copyParameterValue(value, memo):
+    if isinstance(value, dict):
+        new_value = {key: _copyParameterValue(item, memo) for key, item
+            in value.items()}
+    elif isinstance(value, (str, bytes, int, float, complex, np.generic,
+        type(None))):
+        new_value = value
+    else:
+        new_value = copy.deepcopy(value, memo)
+
+    return new_value
+
+def getHistoryRecord(sasm):
+    """
+    Gets the record of a profile that goes into the history of profiles made
+    from it: the profile filename followed by a {key: entry} dictionary for
+    each entry in the profile history. The entries reference the profile
+    history entries instead of copying them.
+    """
+    history = sasm.getParameter('history')
+
+    record = [sasm.getParameter('filename')]
+
+    if history is not None:
+        record.extend({key: history[key]} for key in history)
+
+    return record
+
+def _readOnlyView(array):
+    # A view of the array that can't be used to change it
+    if array is not None:
+        array = array.view()
+        array.flags.writeable = False
+
+    return array
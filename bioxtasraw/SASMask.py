@@ -73,6 +73,9 @@ class Mask(object):
     def getFillPoints(self):
         pass    # overridden when inherited
 
+    def fillMatrix(self, mask, value):
+        pass    # overridden when inherited
+
     def getSaveFormat(self):
         pass   # overridden when inherited
 
@@ -127,31 +130,57 @@ class CircleMask(Mask):
         self._calcFillPoints()
 
     def _calcFillPoints(self):
+        # Fill points are only made if asked for, createMaskMatrix uses fillMatrix
+        self.coords = None
+
+    def getFillPoints(self):
+        ''' Really Clumsy! Can be optimized alot! triplicates the points in the middle!'''
+
+        if self.coords is None:
+            radiusC = abs(self._points[1][0] - self._points[0][0])
+
+            P = calcBresenhamCirclePoints(radiusC, self._points[0][1], self._points[0][0])
+            self.coords = []
+
+            for i in range(0, len(P)//8):
+                Pp = P[i*8 : i*8 + 8]
+
+                q_ud1 = ( Pp[0][0], list(range(int(Pp[1][1]), int(Pp[0][1]+1))) )
+                q_ud2 = ( Pp[2][0], list(range(int(Pp[3][1]), int(Pp[2][1]+1))) )
+
+                q_lr1 = ( Pp[4][1], list(range(int(Pp[6][0]), int(Pp[4][0]+1))) )
+                q_lr2 = ( Pp[5][1], list(range(int(Pp[7][0]), int(Pp[5][0]+1))) )
+
+                for i in range(0, len(q_ud1[1])):
+                    self.coords.append( (int(q_ud1[0]), int(q_ud1[1][i])) )
+                    self.coords.append( (int(q_ud2[0]), int(q_ud2[1][i])) )
+                    self.coords.append( (int(q_lr1[1][i]), int(q_lr1[0])) )
+                    self.coords.append( (int(q_lr2[1][i]), int(q_lr2[0])) )
+
+        return self.coords
 
+    def fillMatrix(self, mask, value):
+        ''' Sets the mask pixels covered by the circle to value. Covers the
+        same pixels as getFillPoints, but fills each Bresenham line as a
+        slice. '''
         radiusC = abs(self._points[1][0] - self._points[0][0])
 
         P = calcBresenhamCirclePoints(radiusC, self._points[0][1], self._points[0][0])
-        self.coords = []
 
         for i in range(0, len(P)//8):
             Pp = P[i*8 : i*8 + 8]
 
-            q_ud1 = ( Pp[0][0], list(range(int(Pp[1][1]), int(Pp[0][1]+1))) )
-            q_ud2 = ( Pp[2][0], list(range(int(Pp[3][1]), int(Pp[2][1]+1))) )
-
-            q_lr1 = ( Pp[4][1], list(range(int(Pp[6][0]), int(Pp[4][0]+1))) )
-            q_lr2 = ( Pp[5][1], list(range(int(Pp[7][0]), int(Pp[5][0]+1))) )
-
-            for i in range(0, len(q_ud1[1])):
-                self.coords.append( (int(q_ud1[0]), int(q_ud1[1][i])) )
-                self.coords.append( (int(q_ud2[0]), int(q_ud2[1][i])) )
-                self.coords.append( (int(q_lr1[1][i]), int(q_lr1[0])) )
-                self.coords.append( (int(q_lr2[1][i]), int(q_lr2[0])) )
+            ud_start = int(Pp[1][1])
+            ud_stop = int(Pp[0][1]+1)
+            npts = max(ud_stop - ud_start, 0)
 
-    def getFillPoints(self):
-        ''' Really Clumsy! Can be optimized alot! triplicates the points in the middle!'''
+            lr_start = int(Pp[6][0])
+            lr_stop = min(int(Pp[4][0]+1), lr_start + npts)
 
-        return self.coords
+            _fillRowSlice(mask, int(Pp[0][0]), ud_start, ud_stop, value)
+            _fillRowSlice(mask, int(Pp[2][0]), ud_start, ud_stop, value)
+            _fillColumnSlice(mask, int(Pp[4][1]), lr_start, lr_stop, value)
+            _fillColumnSlice(mask, int(Pp[5][1]), lr_start, lr_stop, value)
 
     def getSaveFormat(self):
         save = {'type'          :   self._type,
@@ -199,6 +228,10 @@ class RectangleMask(Mask):
         pass
 
     def _calcFillPoints(self):
+        # Fill points are only made if asked for, createMaskMatrix uses fillMatrix
+        self.coords = None
+
+    def _getIndexRange(self):
         startPoint, endPoint = self._points
         '''  startPoint and endPoint: [(x1,y1) , (x2,y2)]  '''
 
@@ -208,35 +241,32 @@ class RectangleMask(Mask):
         endPointX = int(endPoint[1])
         endPointY = int(endPoint[0])
 
-        self.coords = []
+        x_range = (min(startPointX, endPointX), max(startPointX, endPointX)+1)
+        y_range = (min(startPointY, endPointY), max(startPointY, endPointY)+1)
 
-        if startPointX > endPointX:
+        return x_range, y_range
 
-            if startPointY > endPointY:
+    def getFillPoints(self):
 
-                for c in range(endPointY, startPointY + 1):
-                    for i in range(endPointX, startPointX + 1):
-                        self.coords.append( (int(i), int(c)) )
-            else:
-                for c in range(startPointY, endPointY + 1):
-                    for i in range(endPointX, startPointX + 1):
-                        self.coords.append( (int(i), int(c)) )
+        if self.coords is None:
+            x_range, y_range = self._getIndexRange()
 
-        else:
+            self.coords = [(int(i), int(c)) for c in range(*y_range)
+                for i in range(*x_range)]
 
-            if startPointY > endPointY:
+        return self.coords
 
-                for c in range(endPointY, startPointY + 1):
-                    for i in range(startPointX, endPointX + 1):
-                        self.coords.append( (int(i),int(c)) )
-            else:
-                for c in range(startPointY, endPointY + 1):
-                    for i in range(startPointX, endPointX + 1):
-                        self.coords.append( (int(i), int(c)) )
+    def fillMatrix(self, mask, value):
+        ''' Sets the mask pixels covered by the rectangle to value '''
+        x_range, y_range = self._getIndexRange()
 
-    def getFillPoints(self):
+        x_start = max(x_range[0], 0)
+        x_stop = min(x_range[1], mask.shape[0])
+        y_start = max(y_range[0], 0)
+        y_stop = min(y_range[1], mask.shape[1])
 
-        return self.coords
+        if x_start < x_stop and y_start < y_stop:
+            mask[x_start:x_stop, y_start:y_stop] = value
 
     def getSaveFormat(self):
         save = {'type'          :   self._type,
@@ -256,28 +286,74 @@ class PolygonMask(Mask):
         self.setPoints(points)
 
     def _calcFillPoints(self):
-        proper_formatted_points = []
-        yDim, xDim = self._img_dimension
+        # Fill points are only made if asked for, createMaskMatrix uses fillMatrix
+        self.coords = None
 
-        for each in self._points:
-            proper_formatted_points.append(list(each))
+    def getFillPoints(self):
 
-        proper_formatted_points = np.array(proper_formatted_points)
+        if self.coords is None:
+            proper_formatted_points = []
+            yDim, xDim = self._img_dimension
 
-        pb = Polygeom(proper_formatted_points)
+            for each in self._points:
+                proper_formatted_points.append(list(each))
 
-        grid = np.mgrid[0:xDim,0:yDim].reshape(2,-1).swapaxes(0,1)
+            proper_formatted_points = np.array(proper_formatted_points)
 
-        inside = pb.inside(grid)
+            pb = Polygeom(proper_formatted_points)
 
-        p = np.where(inside==True)
+            grid = np.mgrid[0:xDim,0:yDim].reshape(2,-1).swapaxes(0,1)
 
-        self.coords = getCoords(p, (int(yDim), int(xDim)))
+            inside = pb.inside(grid)
 
-    def getFillPoints(self):
+            p = np.where(inside==True)
+
+            self.coords = getCoords(p, (int(yDim), int(xDim)))
 
         return self.coords
 
+    def fillMatrix(self, mask, value):
+        ''' Sets the mask pixels inside the polygon to value. Uses a scanline
+        fill with the same crossing test as npnpoly, so it covers the same
+        pixels as getFillPoints. '''
+        yDim, xDim = self._img_dimension
+
+        verts = np.array([list(each) for each in self._points])
+
+        xpi = verts[:,0]
+        ypi = verts[:,1]
+        xpj = xpi[np.arange(xpi.size)-1]
+        ypj = ypi[np.arange(ypi.size)-1]
+
+        xmin = np.min(xpi)
+        xmax = np.max(xpi)
+        ymin = np.min(ypi)
+        ymax = np.max(ypi)
+
+        # Rows are the polygon y values, columns the x values
+        row_start = max(int(np.ceil(ymin)), 0)
+        row_stop = min(int(np.floor(ymax))+1, int(yDim), mask.shape[0])
+        col_start = max(int(np.ceil(xmin)), 0)
+        col_stop = min(int(np.floor(xmax))+1, int(xDim), mask.shape[1])
+
+        if row_start >= row_stop or col_start >= col_stop:
+            return
+
+        cols = np.arange(col_start, col_stop)
+
+        for y in range(row_start, row_stop):
+            crosses = ((ypi <= y) & (y < ypj)) | ((ypj <= y) & (y < ypi))
+
+            if not crosses.any():
+                continue
+
+            x_cross = np.sort((xpj[crosses]-xpi[crosses])*(y - ypi[crosses])
+                / (ypj[crosses] - ypi[crosses]) + xpi[crosses])
+
+            n_right = x_cross.size - np.searchsorted(x_cross, cols, side='right')
+
+            mask[y, col_start:col_stop][n_right % 2 == 1] = value
+
     def getSaveFormat(self):
         save = {'type'      :   self._type,
                 'vertices'  :   self._points,
@@ -339,30 +415,33 @@ def createMaskMatrix(img_dim, masks):
     else:
         mask = np.ones(img_dim)
 
-    maxy = mask.shape[1]
-    maxx = mask.shape[0]
-
     for each in masks:
-        fillPoints = each.getFillPoints()
-
         if each.isNegativeMask() == True:
-            for eachp in fillPoints:
-                if eachp[0] < maxx and eachp[0] >= 0 and eachp[1] < maxy and eachp[1] >= 0:
-                    y = int(eachp[1])
-                    x = int(eachp[0])
-                    mask[(x,y)] = 1
+            each.fillMatrix(mask, 1)
         else:
-            for eachp in fillPoints:
-                if eachp[0] < maxx and eachp[0] >= 0 and eachp[1] < maxy and eachp[1] >= 0:
-                    y = int(eachp[1])
-                    x = int(eachp[0])
-                    mask[(x,y)] = 0
+            each.fillMatrix(mask, 0)
 
     #Mask is flipped (older RAW versions had flipped image)
     mask = np.flipud(mask)
 
     return mask
 
+def _fillRowSlice(mask, row, start, stop, value):
+    if row >= 0 and row < mask.shape[0]:
+        start = max(start, 0)
+        stop = min(stop, mask.shape[1])
+
+        if start < stop:
+            mask[row, start:stop] = value
+
+def _fillColumnSlice(mask, col, start, stop, value):
+    if col >= 0 and col < mask.shape[1]:
+        start = max(start, 0)
+        stop = min(stop, mask.shape[0])
+
+        if start < stop:
+            mask[start:stop, col] = value
+
 def createMaskFromHdr(img, img_hdr, flipped = False):
 
     try:
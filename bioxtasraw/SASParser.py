@@ -21,6 +21,9 @@ from builtins import object, range, map, zip
 from io import open
 
 import math
+import functools
+
+import numpy as np
 
 class PyMathParser(object):
     '''
@@ -158,3 +161,134 @@ class PyMathParser(object):
             pass
         mylist.sort()
         return mylist
+
+
+class CompiledExpression(object):
+    '''
+    A mathematical expression that is compiled once and can then be evaluated
+    for any number of headers. Variables in the expression are looked up in
+    the image header, then the file header (counters), then the default
+    variables, using the same functions as PyMathParser.
+    '''
+
+    def __init__(self, expression):
+        self.expression = expression
+
+        self._code = compile(expression.strip(), '<expression>', 'eval')
+
+        parser = PyMathParser()
+        parser.addDefaultFunctions()
+
+        self._functions = {key : parser.functions[key] for key in parser.getFunctionNames()}
+        self._defaults = {'pi' : math.pi}
+
+        # Names used in the expression that have to come from the headers
+        self.names = [name for name in self._code.co_names
+            if name not in self._functions]
+
+    def _lookup(self, name, img_hdr, file_hdr):
+        for hdr in (img_hdr, file_hdr):
+            if hdr is not None and name in hdr:
+                try:
+                    return float(hdr[name])
+                except Exception:
+                    pass
+
+        return self._defaults.get(name)
+
+    def evaluate(self, img_hdr=None, file_hdr=None):
+        '''
+        Evaluates the expression using the values in the image and file
+        header dictionaries.
+        '''
+        variables = {'__builtins__' : None}
+
+        for name in self.names:
+            val = self._lookup(name, img_hdr, file_hdr)
+
+            if val is not None:
+                variables[name] = val
+
+        return eval(self._code, variables, self._functions)
+
+    def evaluateStack(self, img_hdrs, file_hdrs):
+        '''
+        Evaluates the expression for a stack of frames at once, with each
+        variable taken as a numpy array of the header (counter) values for
+        all of the frames. img_hdrs and file_hdrs are lists with the header
+        dictionaries for each frame. Returns an array with one value per frame.
+
+        Frames where the vectorized result isn't finite are evaluated
+        individually, so that they raise the same errors as evaluate.
+        '''
+        n_frames = len(img_hdrs)
+
+        variables = {'__builtins__' : None}
+
+        for name in self.names:
+            vals = [self._lookup(name, img_hdr, file_hdr) for img_hdr, file_hdr
+                in zip(img_hdrs, file_hdrs)]
+
+            if any(val is None for val in vals):
+                if all(val is None for val in vals):
+                    continue
+
+                return np.array([self.evaluate(img_hdr, file_hdr) for
+                    img_hdr, file_hdr in zip(img_hdrs, file_hdrs)], dtype=float)
+
+            variables[name] = np.array(vals, dtype=float)
+
+        with np.errstate(all='ignore'):
+            result = eval(self._code, variables, _stack_functions)
+
+        result = np.broadcast_to(np.asarray(result, dtype=float),
+            (n_frames,)).copy()
+
+        for idx in np.flatnonzero(~np.isfinite(result)):
+            result[idx] = self.evaluate(img_hdrs[idx], file_hdrs[idx])
+
+        return result
+
+def _stackLog(x, base=None):
+    if base is None:
+        return np.log(x)
+    else:
+        return np.log(x)/np.log(base)
+
+# numpy versions of the PyMathParser default functions, used to evaluate an
+# expression for a whole stack of frames at once
+_stack_functions = {
+    'acos'      : np.arccos,
+    'asin'      : np.arcsin,
+    'atan'      : np.arctan,
+    'atan2'     : np.arctan2,
+    'ceil'      : np.ceil,
+    'cos'       : np.cos,
+    'cosh'      : np.cosh,
+    'degrees'   : np.degrees,
+    'exp'       : np.exp,
+    'fabs'      : np.fabs,
+    'floor'     : np.floor,
+    'fmod'      : np.fmod,
+    'frexp'     : np.frexp,
+    'hypot'     : np.hypot,
+    'ldexp'     : np.ldexp,
+    'log'       : _stackLog,
+    'log10'     : np.log10,
+    'modf'      : np.modf,
+    'pow'       : np.power,
+    'radians'   : np.radians,
+    'sin'       : np.sin,
+    'sinh'      : np.sinh,
+    'sqrt'      : np.sqrt,
+    'tan'       : np.tan,
+    'tanh'      : np.tanh,
+    }
+
+@functools.lru_cache(maxsize=256)
+def compileExpression(expression):
+    '''
+    Returns a CompiledExpression for the expression string. Compiled
+    expressions are cached, so each expression is only parsed once.
+    '''
+    return CompiledExpression(expression)
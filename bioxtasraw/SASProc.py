@@ -34,7 +34,6 @@ import traceback
 import os
 import numpy as np
 import scipy.interpolate as interp
-import numba
 
 raw_path = os.path.abspath(os.path.join('.', __file__, '..', '..'))
 if raw_path not in os.sys.path:
@@ -59,7 +58,7 @@ def subtract(sasm1, sasm2, forced=False, full=False, copy_params=True):
     if np.all(np.round(sasm1.q[q1_min:q1_max],5) == np.round(sasm2.q[q2_min:q2_max],5)):
         i = sasm1.i[q1_min:q1_max] - sasm2.i[q2_min:q2_max]
 
-        q = copy.deepcopy(sasm1.q)[q1_min:q1_max]
+        q = sasm1.q[q1_min:q1_max]
         err = np.sqrt( np.power(sasm1.err[q1_min:q1_max], 2) + np.power(sasm2.err[q2_min:q2_max],2))
 
     elif not np.all(np.round(sasm1.q[q1_min:q1_max],5) == np.round(sasm2.q[q2_min:q2_max],5)) and forced:
@@ -97,16 +96,16 @@ def subtract(sasm1, sasm2, forced=False, full=False, copy_params=True):
             i = i1[q1_idx1:q1_idx2] - i2[q2_idx1:q2_idx2]
             err = np.sqrt( np.power(err1[q1_idx1:q1_idx2], 2) + np.power(err2[q2_idx1:q2_idx2],2))
 
-            q = copy.deepcopy(sasm1.q[q1_idx1:q1_idx2])
+            q = sasm1.q[q1_idx1:q1_idx2]
 
         else:
             q1space=q1[1]-q1[0]
             q2space=q2[1]-q2[0]
 
             if q1space>q2space:
-                npts=(end-start)//q1space+1
+                npts=int((end-start)//q1space)+1
             else:
-                npts=(end-start)//q2space+1
+                npts=int((end-start)//q2space)+1
 
             refq=np.linspace(start,end,npts,endpoint=True)
 
@@ -133,15 +132,9 @@ def subtract(sasm1, sasm2, forced=False, full=False, copy_params=True):
 
         history = {}
 
-        history1 = []
-        history1.append(copy.deepcopy(sasm1.getParameter('filename')))
-        for key in sasm1.getParameter('history'):
-            history1.append({ key : copy.deepcopy(sasm1.getParameter('history')[key])})
+        history1 = SASM.getHistoryRecord(sasm1)
 
-        history2 = []
-        history2.append(copy.deepcopy(sasm2.getParameter('filename')))
-        for key in sasm2.getParameter('history'):
-            history2.append({key : copy.deepcopy(sasm2.getParameter('history')[key])})
+        history2 = SASM.getHistoryRecord(sasm2)
 
         history['subtraction'] = {'initial_file':history1, 'subtracted_file':history2}
 
@@ -150,7 +143,8 @@ def subtract(sasm1, sasm2, forced=False, full=False, copy_params=True):
     else:
         sub_parameters = {'filename': copy.deepcopy(sasm1.getParameter('filename'))}
 
-    newSASM = SASM.SASM(i, q, err, sub_parameters, copy.deepcopy(sasm1.getQErr()))
+    # The new SASM copies the arrays, so they aren't copied here
+    newSASM = SASM.SASM(i, q, err, sub_parameters, sasm1.getQErr())
 
     return newSASM
 
@@ -165,11 +159,11 @@ def average(sasm_list, forced=False, copy_params=True):
 
         q_min, q_max = first_sasm.getQrange()
 
-        avg_q = copy.deepcopy(first_sasm.q[q_min:q_max])
-        avg_i = copy.deepcopy(first_sasm.i[q_min:q_max])
-        avg_err = copy.deepcopy(first_sasm.err[q_min:q_max])
-        avg_parameters = copy.deepcopy(first_sasm.getAllParameters())
-        avg_q_err = copy.deepcopy(first_sasm.getQErr())
+        avg_q = first_sasm.q[q_min:q_max]
+        avg_i = first_sasm.i[q_min:q_max]
+        avg_err = first_sasm.err[q_min:q_max]
+        avg_parameters = SASM.copyParameters(first_sasm.getAllParameters())
+        avg_q_err = first_sasm.getQErr()
 
     else:
         #Check average is possible with provided curves:
@@ -180,29 +174,27 @@ def average(sasm_list, forced=False, copy_params=True):
             if not np.all(np.round(each.q[each_q_min:each_q_max], 5) == np.round(first_sasm.q[first_q_min:first_q_max], 5)) and not forced:
                 raise SASExceptions.DataNotCompatible('Average list contains data sets with different q vectors.')
 
-        all_i = first_sasm.i[first_q_min : first_q_max]
-
-        all_err = first_sasm.err[first_q_min : first_q_max]
+        all_i = []
+        all_err = []
 
         avg_filelist = []
-        avg_filelist.append(first_sasm.getParameter('filename'))
 
-        for idx in range(1, len(sasm_list)):
-            each_q_min, each_q_max = sasm_list[idx].getQrange()
-            all_i = np.vstack((all_i, sasm_list[idx].i[each_q_min:each_q_max]))
-            all_err = np.vstack((all_err, sasm_list[idx].err[each_q_min:each_q_max]))
-            avg_filelist.append(sasm_list[idx].getParameter('filename'))
+        for each in sasm_list:
+            each_q_min, each_q_max = each.getQrange()
+            all_i.append(each.i[each_q_min:each_q_max])
+            all_err.append(each.err[each_q_min:each_q_max])
+            avg_filelist.append(each.getParameter('filename'))
+
+        all_i = np.vstack(all_i)
+        all_err = np.vstack(all_err)
 
         avg_i = np.mean(all_i, 0)
 
         avg_err = np.sqrt( np.sum( np.power(all_err,2), 0 ) ) / len(all_err)  #np.sqrt(len(all_err))
 
-        avg_i = copy.deepcopy(avg_i)
-        avg_err = copy.deepcopy(avg_err)
-
-        avg_q = copy.deepcopy(first_sasm.q)[first_q_min:first_q_max]
+        avg_q = first_sasm.q[first_q_min:first_q_max]
 
-        avg_q_err = copy.deepcopy(first_sasm.getQErr())
+        avg_q_err = first_sasm.getQErr()
 
     if copy_params:
         avg_parameters = get_shared_header(sasm_list)
@@ -214,13 +206,7 @@ def average(sasm_list, forced=False, copy_params=True):
         history_list = []
 
         for eachsasm in sasm_list:
-            each_history = []
-            each_history.append(copy.deepcopy(eachsasm.getParameter('filename')))
-
-            for key in eachsasm.getParameter('history'):
-                each_history.append({key : copy.deepcopy(eachsasm.getParameter('history')[key])})
-
-            history_list.append(each_history)
+            history_list.append(SASM.getHistoryRecord(eachsasm))
 
         history['averaged_files'] = history_list
         avg_parameters['history'] = history
@@ -243,11 +229,11 @@ def weightedAverage(sasm_list, weightByError, weightCounter, forced=False,
         #testing. Otherwise we should never have less than one profile to average
         q_min, q_max = first_sasm.getQrange()
 
-        avg_q = copy.deepcopy(first_sasm.q[q_min:q_max])
-        avg_i = copy.deepcopy(first_sasm.i[q_min:q_max])
-        avg_err = copy.deepcopy(first_sasm.err[q_min:q_max])
-        avg_parameters = copy.deepcopy(first_sasm.getAllParameters())
-        avg_q_err = copy.deepcopy(first_sasm.getQErr())
+        avg_q = first_sasm.q[q_min:q_max]
+        avg_i = first_sasm.i[q_min:q_max]
+        avg_err = first_sasm.err[q_min:q_max]
+        avg_parameters = SASM.copyParameters(first_sasm.getAllParameters())
+        avg_q_err = first_sasm.getQErr()
 
     else:
         #Check average is possible with provided curves:
@@ -316,11 +302,8 @@ def weightedAverage(sasm_list, weightByError, weightCounter, forced=False,
             avg_i = np.average(all_i, axis=0, weights = all_err)
             avg_err = np.sqrt(1/np.sum(all_err,0))
 
-        avg_i = copy.deepcopy(avg_i)
-        avg_err = copy.deepcopy(avg_err)
-
-        avg_q = copy.deepcopy(first_sasm.q)[first_q_min:first_q_max]
-        avg_q_err = copy.deepcopy(first_sasm.getQErr())
+        avg_q = first_sasm.q[first_q_min:first_q_max]
+        avg_q_err = first_sasm.getQErr()
 
     if copy_params:
         avg_parameters = get_shared_header(sasm_list)
@@ -332,13 +315,7 @@ def weightedAverage(sasm_list, weightByError, weightCounter, forced=False,
         history_list = []
 
         for eachsasm in sasm_list:
-            each_history = []
-            each_history.append(copy.deepcopy(eachsasm.getParameter('filename')))
-
-            for key in eachsasm.getParameter('history'):
-                each_history.append({key : copy.deepcopy(eachsasm.getParameter('history')[key])})
-
-            history_list.append(each_history)
+            history_list.append(SASM.getHistoryRecord(eachsasm))
 
         history['averaged_files'] = history_list
         avg_parameters['history'] = history
@@ -504,13 +481,7 @@ def merge(sasm_star, sasm_list, copy_params=True):
         history_list = []
 
         for eachsasm in [s1, s2]:
-            each_history = []
-            each_history.append(copy.deepcopy(eachsasm.getParameter('filename')))
-
-            for key in eachsasm.getParameter('history'):
-                each_history.append({key : copy.deepcopy(eachsasm.getParameter('history')[key])})
-
-            history_list.append(each_history)
+            history_list.append(SASM.getHistoryRecord(eachsasm))
 
         history['merged_files'] = history_list
         merge_parameters['history'] = history
@@ -580,15 +551,9 @@ def interpolateToFit(sasm_star, sasm, copy_params=True):
 
         history = {}
 
-        history1 = []
-        history1.append(copy.deepcopy(s1.getParameter('filename')))
-        for key in s1.getParameter('history'):
-            history1.append({ key : copy.deepcopy(s1.getParameter('history')[key])})
+        history1 = SASM.getHistoryRecord(s1)
 
-        history2 = []
-        history2.append(copy.deepcopy(s2.getParameter('filename')))
-        for key in s2.getParameter('history'):
-            history2.append({key : copy.deepcopy(s2.getParameter('history')[key])})
+        history2 = SASM.getHistoryRecord(s2)
 
         history['interpolation'] = {'initial_file':history1, 'interpolated_to_q_of':history2}
 
@@ -607,146 +572,221 @@ def logBinning(sasm, no_points, copy_params=True):
     q = sasm.getQ()
     i = sasm.getI()
     err = sasm.getErr()
-    err_sqr = err**2
-
     q_err = sasm.getQErr()
 
-    if q_err is not None:
-        q_err_sqr = q_err**2
-
     total_pts = len(q)
 
-    if no_points <=1:
-        no_points = total_pts
+    binned_q, binned_i, binned_err, binned_q_err = logBinArrays(q, i, err,
+        no_points, q_err)
 
-    if no_points >= total_pts:
-        binned_q = q
-        binned_i = i
-        binned_err = err
-        binned_q_err = q_err
-        bins = np.empty_like(q)
+    if copy_params:
+        parameters = SASM.copyParameters(sasm.getAllParameters())
 
-    else:
-        bins_calc = False
-        min_pt = 1
+        history1 = SASM.getHistoryRecord(sasm)
 
-        while not bins_calc:
-            bins = np.geomspace(min_pt, total_pts, no_points+1-min_pt)
+        history = {}
+        history['log_binning'] = {'initial_file' : history1,
+            'initial_points' : total_pts, 'final_points': len(binned_q)}
 
-            pos_min_diff = np.argwhere(np.ediff1d(bins)>1)[0][0]
+        parameters['history'] = history
 
-            if pos_min_diff == 0:
-                bins_calc = True
+    else:
+        parameters = {'filename' : copy.deepcopy(sasm.getParameter('filename'))}
 
-            else:
-                pos_min_diff = pos_min_diff + 1
-                min_pt = int(np.floor(bins[pos_min_diff]))
+    newSASM = SASM.SASM(binned_i, binned_q, binned_err, parameters, binned_q_err)
 
-        bins = bins.astype(int)
-        bins[0] = min_pt
+    return newSASM
+
+def logBinEdges(total_pts, no_points):
+    """
+    Returns the edges (indices of the first point of each bin, and the end)
+    of no_points logarithmically spaced bins for total_pts points. Bins at
+    the start that would be less than one point wide are single points.
+    """
+    bins_calc = False
+    min_pt = 1
+
+    while not bins_calc:
+        bins = np.geomspace(min_pt, total_pts, no_points+1-min_pt)
 
-        log_bins = np.concatenate((np.arange(min_pt, dtype=int), bins))
+        pos_min_diff = np.argwhere(np.ediff1d(bins)>1)[0][0]
 
-        binned_q = np.empty(log_bins.shape[0]-1)
-        binned_i = np.empty(log_bins.shape[0]-1)
-        binned_err = np.empty(log_bins.shape[0]-1)
+        if pos_min_diff == 0:
+            bins_calc = True
 
-        if q_err is not None:
-            binned_q_err = np.empty(log_bins.shape[0]-1)
         else:
-            binned_q_err = None
+            pos_min_diff = pos_min_diff + 1
+            min_pt = int(np.floor(bins[pos_min_diff]))
 
-        binned_q, binned_i, binned_err, binned_q_err = inner_log_bin(q, i, err_sqr,
-            q_err, binned_q, binned_i, binned_err, binned_q_err, log_bins)
+    bins = bins.astype(int)
+    bins[0] = min_pt
 
-    if copy_params:
-        parameters = copy.deepcopy(sasm.getAllParameters())
+    log_bins = np.concatenate((np.arange(min_pt, dtype=int), bins))
 
-        old_history = parameters['history']
+    return log_bins
 
-        history1 = []
-        history1.append(copy.deepcopy(sasm.getParameter('filename')))
+def binEdges(total_pts, npts=100, rebin_factor=1, log_rebin=False):
+    """
+    Returns the bin edges (see logBinEdges) for rebinning total_pts points,
+    with the same meaning of npts, rebin_factor, and log_rebin as the
+    RAWAPI rebin function. Points past the last full linear bin are dropped,
+    as in rebin.
+    """
+    if rebin_factor != 1:
+        if rebin_factor != 0:
+            rb_pts = int(np.floor(total_pts/rebin_factor))
+        else:
+            rb_pts = total_pts
 
-        for key in old_history:
-            history1.append({key:old_history[key]})
+        rb_fac = rebin_factor
+    else:
+        if npts >= 1:
+            rb_fac = int(np.floor(total_pts/float(npts)))
+        else:
+            rb_fac = 1
 
-        history = {}
-        history['log_binning'] = {'initial_file' : history1,
-            'initial_points' : total_pts, 'final_points': len(binned_q)}
+        rb_pts = npts
 
-        parameters['history'] = history
+    if log_rebin:
+        rb_pts = int(rb_pts)
+
+        if rb_pts <= 1 or rb_pts >= total_pts:
+            edges = np.arange(total_pts+1)
+        else:
+            edges = logBinEdges(total_pts, rb_pts)
 
     else:
-        parameters = {'filename' : copy.deepcopy(sasm.getParameter('filename'))}
+        rb_fac = max(int(rb_fac), 1)
+        no_of_bins = max(total_pts//rb_fac, 1)
 
-    newSASM = SASM.SASM(binned_i, binned_q, binned_err, parameters, binned_q_err)
+        edges = np.arange(0, no_of_bins*rb_fac+1, rb_fac)
+        edges[-1] = min(edges[-1], total_pts)
 
-    return newSASM
+    return edges
+
+def binAccumulated(q, sum_signal, sum_norm, sum_var, edges):
+    """
+    Rebins a radial average from its per-bin sums of the signal,
+    normalization, and variance of the pixels in each bin, as returned by
+    the integration. The sums of the bins between each pair of edges (see
+    binEdges) are added together, so each new bin is the average of all of
+    its pixels, as if the image had been integrated with the wider bins.
+    q is averaged over the bins, the same as rebin. Returns q, I, and
+    errors.
+    """
+    widths = np.diff(edges)
+
+    binned_q = _sumBins(q, edges)/widths
+    binned_signal = _sumBins(sum_signal, edges)
+    binned_norm = _sumBins(sum_norm, edges)
+    binned_var = _sumBins(sum_var, edges)
+
+    empty = binned_norm == 0
 
-@numba.jit(nopython=True, cache=True)
-def inner_log_bin(q, i, err_sqr, q_err, binned_q, binned_i,
-    binned_err, binned_q_err, log_bins):
-    for j in range(log_bins.shape[0]-1):
-        start_idx = log_bins[j]
-        end_idx = log_bins[j+1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        binned_i = binned_signal/binned_norm
+        binned_err = np.sqrt(binned_var)/binned_norm
 
-        binned_q[j] = np.sum(q[start_idx:end_idx])/(end_idx-start_idx)
-        binned_i[j] = np.sum(i[start_idx:end_idx])/(end_idx-start_idx)
-        binned_err[j] = np.sqrt(np.sum(err_sqr[start_idx:end_idx]))/(end_idx-start_idx)
+    binned_i[empty] = 0
+    binned_err[empty] = 0
 
-        if q_err is not None:
-            binned_q_err[j] =np.sqrt(np.sum(q_err_sqr[start_idx:end_idx]))/(end_idx-start_idx)
+    return binned_q, binned_i, binned_err
+
+def binArrays(q, i, err, edges, q_err=None, widths=None):
+    """
+    Bins profiles between each pair of edges (the index of the first point
+    of each bin, and the end). i and err can be a single profile, or 2D
+    arrays with one profile per row that share the same q, so that a whole
+    series is binned at once. Each bin is the average of its points, and
+    the errors are added in quadrature. If given, widths are the number of
+    points each bin is divided by, instead of the bin sizes. Returns q, I,
+    errors, and the q errors (None if q_err isn't given).
+    """
+    if widths is None:
+        widths = np.diff(edges)
+
+    binned_q = _sumBins(q, edges)/widths
+    binned_i = _sumBins(i, edges)/widths
+    binned_err = np.sqrt(_sumBins(np.square(err), edges))/widths
+
+    if q_err is not None:
+        binned_q_err = np.sqrt(_sumBins(np.square(q_err), edges))/widths
+    else:
+        binned_q_err = None
 
     return binned_q, binned_i, binned_err, binned_q_err
 
-def rebin(sasm, rebin_factor, copy_params=True):
-    ''' Sets the bin size of the I_q plot
-        end_idx will be lowered to fit the bin_size
-        if needed.
-    '''
+def _sumBins(data, edges):
+    # Sums along the last axis between the edges
+    return np.add.reduceat(data[..., :edges[-1]], edges[:-1], axis=-1)
 
+def rebinArrays(q, i, err, rebin_factor, q_err=None):
+    """
+    Linearly rebins profiles by rebin_factor, the same as rebin. i and err
+    can be 2D, see binArrays. Returns q, I, errors, and q errors.
+    """
     rebin_factor = int(rebin_factor)
 
     if rebin_factor < 1:
         rebin_factor = 1
 
-    len_iq = len(sasm.getI())
-
-    no_of_bins = int(np.floor(len_iq / rebin_factor))
+    no_of_bins = int(np.floor(len(q) / rebin_factor))
 
     if no_of_bins < 1:
         no_of_bins = 1
 
-    end_idx = no_of_bins * rebin_factor
+    edges = np.arange(no_of_bins+1)*rebin_factor
 
-    start_idx = 0
-    i_roi = sasm.getI()[start_idx:end_idx]
-    q_roi = sasm.getQ()[start_idx:end_idx]
-    err_roi = sasm.getErr()[start_idx:end_idx]
+    return binArrays(q, i, err, edges, q_err, rebin_factor)
 
-    err_sqr = err_roi**2
+def logBinArrays(q, i, err, no_points, q_err=None):
+    """
+    Logarithmically bins profiles to no_points, the same as logBinning. i
+    and err can be 2D, see binArrays. Returns q, I, errors, and q errors.
+    """
+    no_points = int(no_points)
+
+    total_pts = len(q)
+
+    if no_points <=1:
+        no_points = total_pts
+
+    if no_points >= total_pts:
+        return q, i, err, q_err
 
-    if sasm.q_err is not None:
-        q_err_roi = sasm.getQErr()[start_idx:end_idx]
-        q_err_sqr = q_err_roi**2
     else:
-        q_err_roi = None
-        q_err_sqr = None
+        log_bins = logBinEdges(total_pts, no_points)
 
-    new_i, new_q, new_err, new_q_err = inner_bin(i_roi, q_roi, err_sqr,
-        q_err_sqr, no_of_bins, rebin_factor)
+        return binArrays(q, i, err, log_bins, q_err)
 
+def rebin(sasm, rebin_factor, copy_params=True):
+    ''' Sets the bin size of the I_q plot
+        end_idx will be lowered to fit the bin_size
+        if needed.
+    '''
 
-    if copy_params:
-        parameters = copy.deepcopy(sasm.getAllParameters())
+    rebin_factor = int(rebin_factor)
+
+    if rebin_factor < 1:
+        rebin_factor = 1
+
+    len_iq = len(sasm.getI())
+
+    if sasm.q_err is not None:
+        q_err = sasm.getQErr()
+    else:
+        q_err = None
 
-        old_history = parameters['history']
+    new_q, new_i, new_err, new_q_err = rebinArrays(sasm.getQ(), sasm.getI(),
+        sasm.getErr(), rebin_factor, q_err)
 
-        history1 = []
-        history1.append(copy.deepcopy(sasm.getParameter('filename')))
+    no_of_bins = len(new_q)
 
-        for key in old_history:
-            history1.append({key:old_history[key]})
+
+    if copy_params:
+        parameters = SASM.copyParameters(sasm.getAllParameters())
+
+        history1 = SASM.getHistoryRecord(sasm)
 
         history = {}
         history['linear_binning'] = {'initial_file' : history1,
@@ -761,47 +801,30 @@ def rebin(sasm, rebin_factor, copy_params=True):
 
     return newSASM
 
-@numba.jit(nopython=True, cache=True)
-def inner_bin(i_roi, q_roi, err_sqr, q_err_sqr, no_of_bins, rebin_factor):
-    new_i = np.zeros(no_of_bins)
-    new_q = np.zeros(no_of_bins)
-    new_err = np.zeros(no_of_bins)
-
-    if q_err_sqr is not None:
-        new_q_err = np.zeros(no_of_bins)
-    else:
-        new_q_err = None
-
-    for eachbin in range(0, no_of_bins):
-        first_idx = eachbin * rebin_factor
-        last_idx = (eachbin * rebin_factor) + rebin_factor
-
-        new_i[eachbin] = np.sum(i_roi[first_idx:last_idx]) / rebin_factor
-        new_q[eachbin] = np.sum(q_roi[first_idx:last_idx]) / rebin_factor
-        new_err[eachbin] = np.sqrt(np.sum(err_sqr[first_idx:last_idx])) / (last_idx-first_idx)
-
-        if q_err_sqr is not None:
-            new_q_err[eachbin] = np.sqrt(np.sum(q_err_sqr[first_idx:last_idx])) / (last_idx-first_idx)
-
-    return new_i, new_q, new_err, new_q_err
-
 def binfixed(q, I, er, refq):
     """
     This function bins the input q, I, and er into the fixed bins of qref
     """
     dq=refq[1]-refq[0]
 
-    qn=np.linspace(refq[0]-dq/2.,refq[-1]+1.5*dq, np.around((refq[-1]+2*dq-refq[0])/dq,0)+1,endpoint=True )
-
+    qn=np.linspace(refq[0]-dq/2.,refq[-1]+1.5*dq, int(np.around((refq[-1]+2*dq-refq[0])/dq,0))+1,endpoint=True )
 
     dig=np.digitize(q,qn)
 
-    In=np.array([I[dig==i].mean() for i in range(1,len(qn)-1)])
+    # Sums for each bin, bins 1 to len(qn)-2 are kept
+    n_bins = len(qn)+1
 
+    counts = np.bincount(dig, minlength=n_bins)[1:len(qn)-1]
+    sum_i = np.bincount(dig, weights=I, minlength=n_bins)[1:len(qn)-1]
 
-    mI = np.ma.masked_equal(I,0)
+    # Relative errors, points with zero intensity are left out
+    rel_err = np.divide(er, I, out=np.zeros(len(I)), where=I!=0)
+    sum_rel_err = np.bincount(dig, weights=np.square(rel_err),
+        minlength=n_bins)[1:len(qn)-1]
 
-    Iern=np.array([np.sqrt(np.sum(np.square(er[dig==i]/mI[dig==i])))/len(I[dig==i]) for i in range(1,len(qn)-1)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        In = sum_i/counts
+        Iern = np.sqrt(sum_rel_err)/counts
 
     Iern=Iern*In
 
@@ -809,17 +832,88 @@ def binfixed(q, I, er, refq):
 
     return qn, In, np.nan_to_num(Iern)
 
+def temporalNeighbors(n_frames, window_length):
+    """
+    Returns an array with the indices of the window_length frames on either
+    side of each frame (not including the frame itself), shape
+    (2*window_length, n_frames). Near the ends of the stack the missing
+    neighbors are taken from the other side of the frame.
+    """
+    frames = np.arange(n_frames)
+    neighbors = []
+
+    for offset in range(1, window_length+1):
+        for sign in (-1, 1):
+            idx = frames + sign*offset
+
+            # Reflect about the frame, then clip if the stack is too short
+            out_of_range = np.logical_or(idx < 0, idx >= n_frames)
+            idx[out_of_range] = frames[out_of_range] - sign*offset
+            idx = np.clip(idx, 0, n_frames-1)
+
+            neighbors.append(idx)
+
+    return np.array(neighbors)
+
+def temporalMedian(data, window_length):
+    """
+    Returns the median of the temporal neighbors of each frame (see
+    temporalNeighbors), calculated for all points at once. data is an array
+    with frames along the first axis.
+    """
+    neighbors = temporalNeighbors(data.shape[0], window_length)
+
+    return np.median(data[neighbors], axis=0)
+
+def removeZingersStack(sasm_list, window_length=2, stds=5.0):
+    """
+    Removes spikes (zingers) from a series of radially averaged profiles,
+    such as consecutive frames from a SEC-SAXS run, using the temporal
+    neighbors of each q point. A point is replaced by the median of the
+    same q point in the neighboring profiles if it is more than stds times
+    its uncertainty above that median. Compared to removeZingers, which
+    smooths along q within a single profile, this works well when
+    consecutive profiles are nearly identical. The profiles must share the
+    same q vector. The intensity of profiles with spikes is replaced with
+    a new array, rather than changed in place, so views of the old intensity
+    (such as a series matrix) aren't silently changed.
+
+    Parameters
+    ----------
+    sasm_list: list
+        The profiles, in order of collection.
+    window_length: int
+        The number of profiles on either side of each profile used to
+        calculate the median.
+    stds: float
+        The threshold used to detect spikes, in units of the profile
+        uncertainty.
+    """
+    if len(sasm_list) < 2 or window_length < 1:
+        return
+
+    intensity = np.array([sasm.getRawI() for sasm in sasm_list])
+    errors = np.array([sasm.getRawErr() for sasm in sasm_list])
+
+    median = temporalMedian(intensity, window_length)
+
+    zingers = intensity - median > stds*errors
+
+    for i in np.flatnonzero(zingers.any(axis=1)):
+        new_i = np.where(zingers[i], median[i], intensity[i])
+
+        sasm_list[i].setRawI(new_i)
+
 def get_shared_header(sasm_list):
     params_list = [sasm.getAllParameters() for sasm in sasm_list]
 
-    shared_params = get_shared_values(params_list)
-
-    if 'analysis' in shared_params:
-        del shared_params['analysis']
+    # The history is made new for the combined profile, so the (possibly
+    # large) histories aren't compared
+    shared_params = get_shared_values(params_list, ['analysis', 'history'])
 
     return shared_params
 
-def get_shared_values(dict_list):
+def get_shared_values(dict_list, ignore_keys=()):
     shared_keys = set(dict_list[0].keys())
 
 
@@ -828,6 +922,8 @@ def get_shared_values(dict_list):
 
         shared_keys = shared_keys & param_keys
 
+    shared_keys = shared_keys - set(ignore_keys)
+
     shared_params = {}
 
     for key in shared_keys:
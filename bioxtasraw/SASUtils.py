@@ -43,6 +43,7 @@ import json
 import sys
 import math
 import time
+import re
 
 import numpy as np
 import matplotlib as mpl
@@ -622,6 +623,14 @@ def find_closest(val, array):
 
     return array[argmin], argmin
 
+def natural_sort_key(name):
+    """
+    Sort key that orders numbers in a name by value, so that frame_10 sorts
+    after frame_9.
+    """
+    return [int(part) if part.isdigit() else part.lower() for part
+        in re.split(r'(\d+)', name)]
+
 def sphere_intensity(q, R):
     """
     Scattering for a sphere
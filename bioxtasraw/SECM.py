@@ -34,8 +34,10 @@ import os
 import copy
 import threading
 import itertools
+import weakref
 
 import numpy as np
+from scipy import integrate
 
 raw_path = os.path.abspath(os.path.join('.', __file__, '..', '..'))
 if raw_path not in os.sys.path:
@@ -44,6 +46,422 @@ if raw_path not in os.sys.path:
 import bioxtasraw.SASExceptions as SASExceptions
 import bioxtasraw.SASProc as SASProc
 
+class SeriesValues(object):
+    """
+    The scale, offset, and q range last set on all of the profiles of a
+    SeriesMatrix. Profiles keep a reference to this, rather than to the
+    matrix, and read the values when they're next used (see
+    SASM._readSeriesValues), so profiles used elsewhere don't keep the
+    matrix data.
+    """
+
+    # Shared by all series, so profiles in more than one series can tell
+    # which values were set last
+    _versions = itertools.count(1)
+
+    def __init__(self, matrix):
+        self.matrix = weakref.ref(matrix)
+        self.version = 0
+
+        self.scale_factor = 1
+        self.offset_value = 0
+        self.qrange = None
+
+    def set(self, scale_factor, offset_value, qrange=None):
+        self.scale_factor = scale_factor
+        self.offset_value = offset_value
+        self.qrange = qrange
+
+        self.version = next(self._versions)
+
+class SeriesMatrix(object):
+    """
+    Frames x q storage for the raw intensity and error of a list of series
+    profiles that share a raw q vector, with the scale, offset, q scale, and
+    q range of each profile as arrays. The profile data is copied in, in its
+    own data type, and the profiles give the matrix any changes made to
+    them. The per profile intensities shown in the series plot are
+    calculated for all profiles in single array operations, and
+    setProfileValues sets the scale, offset, and q range of all of the
+    profiles at once. Profiles can be appended, and the matrices grow in
+    blocks.
+    """
+
+    def __init__(self, q_raw):
+        self.q_raw = q_raw
+        self.sasms = []
+        self.values = SeriesValues(self)
+
+        self.scale = np.empty(0)
+        self.offset = np.empty(0)
+        self.q_scale = np.empty(0)
+        self.q_start = np.empty(0, dtype=int)
+        self.q_end = np.empty(0, dtype=int)
+
+        self._i_raw = None
+        self._err_raw = None
+
+        # The raw arrays each row was copied from, and the rows of each
+        # profile, by id
+        self._sources = []
+        self._rows = {}
+        self._valid = True
+
+        self._q_indices = {}
+
+    def __len__(self):
+        return len(self.sasms)
+
+    def getRawI(self):
+        return self._i_raw[:len(self.sasms)]
+
+    def getRawErr(self):
+        return self._err_raw[:len(self.sasms)]
+
+    def _numStored(self, sasm_list):
+        # Number of leading profiles that are already stored in the matrix
+        n_stored = min(len(sasm_list), len(self.sasms))
+
+        if sasm_list[:n_stored] != self.sasms[:n_stored]:
+            for j in range(n_stored):
+                if sasm_list[j] is not self.sasms[j]:
+                    n_stored = j
+                    break
+
+        return n_stored
+
+    def update(self, sasm_list):
+        """
+        Makes the matrix hold the profiles in sasm_list, only copying in
+        the profiles that aren't already stored. Returns False if the
+        profiles can't be stored because they don't share the raw q vector.
+        """
+        if not self._valid:
+            return False
+
+        n_stored = self._numStored(sasm_list)
+        new_sasms = sasm_list[n_stored:]
+
+        for sasm in new_sasms:
+            if sasm == -1 or not self._sharesQ(sasm):
+                return False
+
+        self._truncate(n_stored)
+        self._extend(new_sasms)
+
+        return True
+
+    def _sharesQ(self, sasm):
+        q_raw = sasm.getRawQ()
+
+        return (len(sasm.getRawI()) == len(self.q_raw)
+            and (q_raw is self.q_raw or np.array_equal(q_raw, self.q_raw)))
+
+    def _truncate(self, n_frames):
+        for j in range(len(self.sasms)-1, n_frames-1, -1):
+            sasm = self.sasms[j]
+            rows = self._rows[id(sasm)]
+            rows.remove(j)
+
+            if not rows:
+                del self._rows[id(sasm)]
+                sasm._removeSeriesValues(self.values)
+
+        del self.sasms[n_frames:]
+        del self._sources[n_frames:]
+
+    def _extend(self, sasm_list):
+        if len(sasm_list) == 0:
+            return
+
+        n_old = len(self.sasms)
+        n_frames = n_old + len(sasm_list)
+
+        i_dtype = self._getDtype(self._i_raw, [sasm.getRawI()
+            for sasm in sasm_list])
+        err_dtype = self._getDtype(self._err_raw, [sasm.getRawErr()
+            for sasm in sasm_list])
+
+        if self._i_raw is None or n_frames > self._i_raw.shape[0]:
+            n_alloc = max(n_frames, 2*len(self.scale), 16)
+        else:
+            n_alloc = self._i_raw.shape[0]
+
+        self._allocate(n_alloc, i_dtype, err_dtype)
+
+        for j, sasm in enumerate(sasm_list, n_old):
+            sasm._addSeriesValues(self.values)
+
+            self.sasms.append(sasm)
+            self._sources.append(None)
+            self._rows.setdefault(id(sasm), []).append(j)
+
+            self._readProfile(sasm, j)
+
+    @staticmethod
+    def _getDtype(matrix, arrays):
+        # The data type that holds the matrix and the arrays without losing
+        # precision
+        dtypes = set(array.dtype for array in arrays)
+
+        if matrix is not None:
+            dtypes.add(matrix.dtype)
+
+        return np.result_type(*dtypes)
+
+    def _allocate(self, n_alloc, i_dtype, err_dtype):
+        # Makes the storage hold n_alloc profiles with the given data types,
+        # keeping the stored profiles
+        if (self._i_raw is not None and self._i_raw.shape[0] == n_alloc
+            and self._i_raw.dtype == i_dtype
+            and self._err_raw.dtype == err_dtype):
+            return
+
+        n_old = len(self.sasms)
+        n_q = len(self.q_raw)
+
+        i_raw = np.empty((n_alloc, n_q), dtype=i_dtype)
+        err_raw = np.empty((n_alloc, n_q), dtype=err_dtype)
+
+        if self._i_raw is not None:
+            i_raw[:n_old] = self._i_raw[:n_old]
+            err_raw[:n_old] = self._err_raw[:n_old]
+
+        self._i_raw = i_raw
+        self._err_raw = err_raw
+
+        if n_alloc != len(self.scale):
+            self.scale = self._resize(self.scale, n_alloc)
+            self.offset = self._resize(self.offset, n_alloc)
+            self.q_scale = self._resize(self.q_scale, n_alloc)
+            self.q_start = self._resize(self.q_start, n_alloc)
+            self.q_end = self._resize(self.q_end, n_alloc)
+
+    def _resize(self, values, n_alloc):
+        new_values = np.empty(n_alloc, dtype=values.dtype)
+        new_values[:len(self.sasms)] = values[:len(self.sasms)]
+
+        return new_values
+
+    def _readProfile(self, sasm, j):
+        # Copies the profile data into row j, if it has changed, and reads
+        # the scale, offset, q scale, and q range
+        sources = (sasm.getRawI(), sasm.getRawErr(), sasm.getRawQ())
+        i_raw, err_raw, q_raw = sources
+
+        if (self._sources[j] is None or i_raw is not self._sources[j][0]
+            or err_raw is not self._sources[j][1]):
+            i_dtype = self._getDtype(self._i_raw, [i_raw])
+            err_dtype = self._getDtype(self._err_raw, [err_raw])
+
+            self._allocate(self._i_raw.shape[0], i_dtype, err_dtype)
+
+            self._i_raw[j] = i_raw
+            self._err_raw[j] = err_raw
+
+        self._sources[j] = sources
+
+        q_start, q_end = sasm.getQrange()
+
+        self.scale[j] = sasm.getScale()
+        self.offset[j] = sasm.getOffset()
+        self.q_scale[j] = sasm.getQScale()
+        self.q_start[j] = q_start
+        self.q_end[j] = q_end
+
+    def _profileChanged(self, sasm):
+        # Called by the profiles when they're changed (see SASM._setDirty)
+        for j in self._rows.get(id(sasm), []):
+            i_raw, err_raw, q_raw = self._sources[j]
+
+            if ((sasm.getRawQ() is not q_raw or sasm.getRawI() is not i_raw)
+                and not self._sharesQ(sasm)):
+                self._valid = False
+            else:
+                self._readProfile(sasm, j)
+
+    def setProfileValues(self, scale_factor, offset_value, qrange=None):
+        """
+        Sets the scale and offset, and the q range if it isn't None, of all
+        of the profiles, as the SASM scale, offset, and setQrange methods do.
+        The profiles read the new values when they're next used.
+        """
+        if qrange is not None and (qrange[0] < 0
+            or qrange[1] > len(self.q_raw)):
+            msg = ('Qrange: ' + str(qrange) + ' is not a valid q-range for a '
+                'q-vector of length ' + str(len(self.q_raw)-1))
+            raise SASExceptions.InvalidQrange(msg)
+
+        n_frames = len(self.sasms)
+
+        self.scale[:n_frames] = abs(scale_factor)
+        self.offset[:n_frames] = offset_value
+
+        if qrange is not None:
+            qrange = (int(qrange[0]), int(qrange[1]))
+
+            self.q_start[:n_frames] = qrange[0]
+            self.q_end[:n_frames] = qrange[1]
+
+        self.values.set(abs(scale_factor), offset_value, qrange)
+
+    def _getQSettings(self, start):
+        # The q scale and q range shared by the profiles from start on, or
+        # None if they aren't all the same
+        n_frames = len(self.sasms)
+
+        q_settings = (float(self.q_scale[start]), int(self.q_start[start]),
+            int(self.q_end[start]))
+
+        for values, value in zip((self.q_scale, self.q_start, self.q_end),
+            q_settings):
+            if np.any(values[start:n_frames] != value):
+                return None
+
+        return q_settings
+
+    def _getQIndex(self, q_settings, q_val):
+        # Index in the scaled, trimmed q vector closest to q_val, the same as
+        # SASM.closest. Lookups are cached, as the q vector is shared.
+        key = q_settings + (q_val,)
+
+        index = self._q_indices.get(key)
+
+        if index is None:
+            q_scale, q_start, q_end = q_settings
+            q = (self.q_raw * q_scale)[q_start:q_end]
+
+            index = np.argmin(np.absolute(q-q_val))
+
+            if len(self._q_indices) >= 64:
+                self._q_indices.clear()
+
+            self._q_indices[key] = index
+
+        return index
+
+    def _getScaledI(self, start, q_idx1, q_idx2):
+        # The scaled intensity of the profiles from start on, for the raw q
+        # indices from q_idx1 to q_idx2, as a frames x q array. Profiles
+        # stored as single precision are scaled in single precision, as
+        # SASM does.
+        n_frames = len(self.sasms)
+
+        dtype = np.result_type(self._i_raw.dtype, 1.)
+
+        scale = self.scale[start:n_frames, None].astype(dtype)
+        offset = self.offset[start:n_frames, None].astype(dtype)
+
+        return self._i_raw[start:n_frames, q_idx1:q_idx2] * scale + offset
+
+    def getIofQ(self, qref, start=0):
+        """
+        Gets the intensity at qref of the profiles from start on, the same
+        as the SASM getIofQ method. Only the column of the matrix at qref
+        is used. Returns None if the profiles don't all have the same
+        q range and q scale.
+        """
+        if start >= len(self.sasms):
+            return np.array([])
+
+        q_settings = self._getQSettings(start)
+
+        if q_settings is None:
+            return None
+
+        index = q_settings[1] + self._getQIndex(q_settings, qref)
+
+        return self._getScaledI(start, index, index+1)[:, 0]
+
+    def getIofQRange(self, qrange, start=0):
+        """
+        Gets the integrated intensity in qrange of the profiles from start on,
+        the same as the SASM getIofQRange method. Only the columns of the
+        matrix in the q range are used. Returns None if the profiles don't
+        all have the same q range and q scale, or if the integration fails.
+        """
+        if start >= len(self.sasms):
+            return np.array([])
+
+        q_settings = self._getQSettings(start)
+
+        if q_settings is None:
+            return None
+
+        q_scale, q_start, q_end = q_settings
+
+        index1 = self._getQIndex(q_settings, qrange[0])
+        index2 = self._getQIndex(q_settings, qrange[1])
+
+        q = (self.q_raw * q_scale)[q_start:q_end][index1:index2+1]
+        i = self._getScaledI(start, q_start+index1,
+            q_start+max(index1, index2+1))
+
+        try:
+            qrange_i = integrate.trapz(i, q, axis=1)
+        except Exception:
+            # Falls back to the profile by profile calculation
+            qrange_i = None
+
+        return qrange_i
+
+    def getIntensities(self, start=0, qref=0, qrange=(0, 0)):
+        """
+        Gets the mean intensity, total intensity, intensity at qref, and
+        integrated intensity in qrange of the profiles from start on, the same
+        as the SASM getMeanI, getTotalI, getIofQ, and getIofQRange methods.
+        The intensity at qref is None if qref is 0, and the integrated
+        intensity is None if the qrange is (0, 0). Returns None if the
+        profiles don't all have the same q range and q scale, or if the
+        integration fails, so that the intensities can be calculated profile
+        by profile, where a failed calculation gives -1 for that profile.
+        """
+        n_frames = len(self.sasms) - start
+
+        if n_frames <= 0:
+            return np.array([]), np.array([]), np.array([]), np.array([])
+
+        q_settings = self._getQSettings(start)
+
+        if q_settings is None:
+            return None
+
+        q_scale, q_start, q_end = q_settings
+
+        q = (self.q_raw * q_scale)[q_start:q_end]
+        i = self._getScaledI(start, q_start, q_end)
+
+        if len(q) > 0:
+            mean_i = i.mean(axis=1)
+
+            try:
+                total_i = integrate.trapz(i, q, axis=1)
+            except Exception:
+                return None
+        else:
+            mean_i = np.full(n_frames, -1.)
+            total_i = np.full(n_frames, -1.)
+
+        if qref > 0:
+            index = self._getQIndex(q_settings, qref)
+            i_of_q = i[:, index]
+        else:
+            i_of_q = None
+
+        if tuple(qrange) != (0, 0):
+            index1 = self._getQIndex(q_settings, qrange[0])
+            index2 = self._getQIndex(q_settings, qrange[1])
+
+            try:
+                qrange_i = integrate.trapz(i[:, index1:index2+1],
+                    q[index1:index2+1], axis=1)
+            except Exception:
+                return None
+        else:
+            qrange_i = None
+
+        return mean_i, total_i, i_of_q, qrange_i
+
 class SECM(object):
     """
     Series measurement object. Was originally a SEC-SAXS measurement (SECM)
@@ -263,6 +681,9 @@ class SECM(object):
 
         self.my_semaphore = threading.Semaphore()
 
+        # Frames x q storage of the profiles, see SeriesMatrix
+        self._profile_matrices = {}
+
 
     # __getstate__ and __setstate__ modified from python documentation
     def __getstate__(self):
@@ -272,70 +693,151 @@ class SECM(object):
         state = self.__dict__.copy()
         # Remove the unpicklable entries.
         del state['my_semaphore']
+        state.pop('_profile_matrices', None)
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self.my_semaphore = threading.Semaphore()
+        self._profile_matrices = {}
 
 
-    def _update(self):
-        ''' updates modified intensity after scale, normalization and offset changes '''
+    def _loadAllProfiles(self):
+        # Profiles lazily read from a series file (SASFileIO.LazySasmList) are
+        # all read in before they are modified
+        if not isinstance(self._sasm_list, list):
+            self._sasm_list = list(self._sasm_list)
 
-        for i, sasm in enumerate(self._sasm_list):
-            sasm.scale(self._scale_factor)
-            sasm.offset(self._offset_value)
+        if not isinstance(self.subtracted_sasm_list, list):
+            self.subtracted_sasm_list = list(self.subtracted_sasm_list)
 
-            if self._q_range is not None:
-                sasm.setQrange((self._q_range[0], self._q_range[1]+1))
+        if not isinstance(self.baseline_subtracted_sasm_list, list):
+            self.baseline_subtracted_sasm_list = list(self.baseline_subtracted_sasm_list)
 
-            self.mean_i[i] = sasm.getMeanI()
-            self.total_i[i] = sasm.getTotalI()
+        if not isinstance(self.baseline_corr, list):
+            self.baseline_corr = list(self.baseline_corr)
 
-            if self.qref > 0:
-                self.I_of_q[i] = sasm.getIofQ(self.qref)
+    def _getProfileMatrix(self, int_type, sasm_list):
+        # Returns the SeriesMatrix holding the profiles, or None if they
+        # don't share a q vector
+        matrix = self._profile_matrices.get(int_type)
 
-            if self.qrange[0] != 0 and self.qrange[1] != 0:
-                self.qrange_I[i] = sasm.getIofQRange(self.qrange[0], self.qrange[1])
+        if matrix is None or not matrix.update(sasm_list):
+            if len(sasm_list) > 0 and sasm_list[0] != -1:
+                matrix = SeriesMatrix(sasm_list[0].getRawQ())
 
-        for i, sasm in enumerate(self.subtracted_sasm_list):
-            sasm.scale(self._scale_factor)
-            sasm.offset(self._offset_value)
+                if not matrix.update(sasm_list):
+                    matrix = None
+            else:
+                matrix = None
 
-            if self._sub_q_range is not None:
-                sasm.setQrange((self._sub_q_range[0], self._sub_q_range[1]+1))
+        self._profile_matrices[int_type] = matrix
 
-            self.mean_i_sub[i] = sasm.getMeanI()
-            self.total_i_sub[i] = sasm.getTotalI()
+        return matrix
 
-            if self.qref > 0:
-                self.I_of_q_sub[i] = sasm.getIofQ(self.qref)
+    def _setProfileValues(self, int_type, sasm_list, q_range):
+        # Sets the series scale, offset, and q range on the profiles, for all
+        # of the profiles at once when they're stored in a profile matrix
+        if q_range is not None:
+            q_range = (q_range[0], q_range[1]+1)
 
-            if self.qrange[0] != 0 and self.qrange[1] != 0:
-                self.qrange_I_sub[i] = sasm.getIofQRange(self.qrange[0], self.qrange[1])
+        matrix = self._getProfileMatrix(int_type, sasm_list)
 
-        for i, sasm in enumerate(self.baseline_subtracted_sasm_list):
-            sasm.scale(self._scale_factor)
-            sasm.offset(self._offset_value)
+        if matrix is not None:
+            matrix.setProfileValues(self._scale_factor, self._offset_value,
+                q_range)
+        else:
+            for sasm in sasm_list:
+                sasm.scale(self._scale_factor)
+                sasm.offset(self._offset_value)
 
-            if self._bc_sub_q_range is not None:
-                sasm.setQrange((self._bc_sub_q_range[0], self._bc_sub_q_range[1]+1))
+                if q_range is not None:
+                    sasm.setQrange(q_range)
+
+    def _calcIntensities(self, int_type, sasm_list, start=0):
+        """
+        Gets the mean intensity, total intensity, intensity at the reference
+        q, and intensity in the reference q range of the profiles from start
+        on, as described in SeriesMatrix.getIntensities. This is calculated
+        for all the profiles at once when they share a q vector and q range,
+        otherwise profile by profile.
+        """
+        matrix = self._getProfileMatrix(int_type, sasm_list)
+
+        if matrix is not None:
+            intensities = matrix.getIntensities(start, self.qref, self.qrange)
+        else:
+            intensities = None
+
+        if intensities is None:
+            sasms = sasm_list[start:]
 
-            self.mean_i_bcsub[i] = sasm.getMeanI()
-            self.total_i_bcsub[i] = sasm.getTotalI()
+            mean_i = np.array([sasm.getMeanI() for sasm in sasms])
+            total_i = np.array([sasm.getTotalI() for sasm in sasms])
 
             if self.qref > 0:
-                self.I_of_q_bcsub[i] = sasm.getIofQ(self.qref)
+                i_of_q = np.array([sasm.getIofQ(self.qref) for sasm in sasms])
+            else:
+                i_of_q = None
 
-            if self.qrange[0] != 0 and self.qrange[1] != 0:
-                self.qrange_I_bcsub[i] = sasm.getIofQRange(self.qrange[0], self.qrange[1])
+            if tuple(self.qrange) != (0, 0):
+                qrange_i = np.array([sasm.getIofQRange(self.qrange[0],
+                    self.qrange[1]) for sasm in sasms])
+            else:
+                qrange_i = None
 
-        for i, sasm in enumerate(self.baseline_corr):
-            sasm.scale(self._scale_factor)
-            sasm.offset(self._offset_value)
+            intensities = (mean_i, total_i, i_of_q, qrange_i)
 
-            if self._sub_q_range is not None:
-                sasm.setQrange((self._sub_q_range[0], self._sub_q_range[1]+1))
+        return intensities
+
+    def _calcIofQ(self, int_type, sasm_list, qref):
+        # Intensity at qref from a column of the profile matrix, if possible.
+        # Profiles still in a series file are read one at a time.
+        if isinstance(sasm_list, list):
+            matrix = self._getProfileMatrix(int_type, sasm_list)
+        else:
+            matrix = None
+
+        if matrix is not None:
+            i_of_q = matrix.getIofQ(qref)
+        else:
+            i_of_q = None
+
+        if i_of_q is None:
+            i_of_q = np.array([sasm.getIofQ(qref) for sasm in sasm_list])
+
+        return i_of_q
+
+    def _calcIofQRange(self, int_type, sasm_list, qrange):
+        # Intensity in qrange from columns of the profile matrix, if possible
+        if isinstance(sasm_list, list):
+            matrix = self._getProfileMatrix(int_type, sasm_list)
+        else:
+            matrix = None
+
+        if matrix is not None:
+            qrange_i = matrix.getIofQRange(qrange)
+        else:
+            qrange_i = None
+
+        if qrange_i is None:
+            qrange_i = np.array([sasm.getIofQRange(qrange[0], qrange[1])
+                for sasm in sasm_list])
+
+        return qrange_i
+
+    def _update(self):
+        ''' updates modified intensity after scale, normalization and offset changes '''
+
+        self._loadAllProfiles()
+
+        self._setProfileValues('unsub', self._sasm_list, self._q_range)
+        self._setProfileValues('sub', self.subtracted_sasm_list,
+            self._sub_q_range)
+        self._setProfileValues('baseline', self.baseline_subtracted_sasm_list,
+            self._bc_sub_q_range)
+        self._setProfileValues('baseline_corr', self.baseline_corr,
+            self._sub_q_range)
 
         if self.average_buffer_sasm is not None:
             self.average_buffer_sasm.scale(self._scale_factor)
@@ -344,6 +846,40 @@ class SECM(object):
             if self._sub_q_range is not None:
                 self.average_buffer_sasm.setQrange((self._sub_q_range[0], self._sub_q_range[1]+1))
 
+        calc_qrange = self.qrange[0] != 0 and self.qrange[1] != 0
+
+        if len(self._sasm_list) > 0:
+            (self.mean_i, self.total_i, I_of_q,
+                qrange_I) = self._calcIntensities('unsub', self._sasm_list)
+
+            if self.qref > 0:
+                self.I_of_q = I_of_q
+
+            if calc_qrange:
+                self.qrange_I = qrange_I
+
+        if len(self.subtracted_sasm_list) > 0:
+            (self.mean_i_sub, self.total_i_sub, I_of_q_sub,
+                qrange_I_sub) = self._calcIntensities('sub',
+                self.subtracted_sasm_list)
+
+            if self.qref > 0:
+                self.I_of_q_sub = I_of_q_sub
+
+            if calc_qrange:
+                self.qrange_I_sub = qrange_I_sub
+
+        if len(self.baseline_subtracted_sasm_list) > 0:
+            (self.mean_i_bcsub, self.total_i_bcsub, I_of_q_bcsub,
+                qrange_I_bcsub) = self._calcIntensities('baseline',
+                self.baseline_subtracted_sasm_list)
+
+            if self.qref > 0:
+                self.I_of_q_bcsub = I_of_q_bcsub
+
+            if calc_qrange:
+                self.qrange_I_bcsub = qrange_I_bcsub
+
 
     def append(self, filename_list, sasm_list, frame_list):
         """
@@ -362,6 +898,8 @@ class SECM(object):
             A list of the frame numbers of each item in the sasm_list. Usually
             just range(len(sasm_list))
         """
+        self._loadAllProfiles()
+
         for i, sasm in enumerate(sasm_list):
             sasm.scale(self._scale_factor)
             sasm.offset(self._offset_value)
@@ -369,12 +907,17 @@ class SECM(object):
             if self._q_range is not None:
                 sasm.setQrange((self._q_range[0], self._q_range[1]+1))
 
+        n_old = len(self._sasm_list)
+
         self._file_list.extend(filename_list)
         self._sasm_list.extend(sasm_list)
         self.frame_list = np.concatenate((self.frame_list, np.array(frame_list, dtype=int)))
 
-        self.mean_i = np.concatenate((self.mean_i, np.array([sasm.getMeanI() for sasm in sasm_list])))
-        self.total_i = np.concatenate((self.total_i, np.array([sasm.getTotalI() for sasm in sasm_list])))
+        mean_i, total_i, I_of_q, qrange_I = self._calcIntensities('unsub',
+            self._sasm_list, n_old)
+
+        self.mean_i = np.concatenate((self.mean_i, mean_i))
+        self.total_i = np.concatenate((self.total_i, total_i))
 
         if len(self._sasm_list) != len(self.frame_list):
             self.frame_list = np.arange(len(self._sasm_list))
@@ -383,11 +926,9 @@ class SECM(object):
         self._calcTime(sasm_list)
 
         if self.qref>0:
-            I_of_q = np.array([sasm.getIofQ(self.qref) for sasm in sasm_list])
             self.I_of_q = np.concatenate((self.I_of_q, I_of_q))
 
-        if self.qrange != (0,0):
-            qrange_I = np.array([sasm.getIofQRange(self.qrange[0], self.qrange[1]) for sasm in sasm_list])
+        if tuple(self.qrange) != (0,0):
             self.qrange_I = np.concatenate((self.qrange_I, qrange_I))
 
         self.plot_frame_list = np.arange(len(self.frame_list))
@@ -1097,13 +1638,15 @@ class SECM(object):
             The intensity of each profile at the given q value.
         """
         self.qref=float(qref)
-        self.I_of_q = np.array([sasm.getIofQ(qref) for sasm in self.getAllSASMs()])
+        self.I_of_q = self._calcIofQ('unsub', self.getAllSASMs(), qref)
 
         if self.subtracted_sasm_list:
-            self.I_of_q_sub = np.array([sasm.getIofQ(qref) for sasm in self.subtracted_sasm_list])
+            self.I_of_q_sub = self._calcIofQ('sub', self.subtracted_sasm_list,
+                qref)
 
         if self.baseline_subtracted_sasm_list:
-            self.I_of_q_bcsub = np.array([sasm.getIofQ(qref) for sasm in self.baseline_subtracted_sasm_list])
+            self.I_of_q_bcsub = self._calcIofQ('baseline',
+                self.baseline_subtracted_sasm_list, qref)
 
         return self.I_of_q
 
@@ -1126,13 +1669,16 @@ class SECM(object):
             The total intensity of each profile in the given q range.
         """
         self.qrange = qrange
-        self.qrange_I = np.array([sasm.getIofQRange(qrange[0], qrange[1]) for sasm in self.getAllSASMs()])
+        self.qrange_I = self._calcIofQRange('unsub', self.getAllSASMs(),
+            qrange)
 
         if self.subtracted_sasm_list:
-            self.qrange_I_sub = np.array([sasm.getIofQRange(qrange[0], qrange[1]) for sasm in self.subtracted_sasm_list])
+            self.qrange_I_sub = self._calcIofQRange('sub',
+                self.subtracted_sasm_list, qrange)
 
         if self.baseline_subtracted_sasm_list:
-            self.qrange_I_bcsub = np.array([sasm.getIofQRange(qrange[0], qrange[1]) for sasm in self.baseline_subtracted_sasm_list])
+            self.qrange_I_bcsub = self._calcIofQRange('baseline',
+                self.baseline_subtracted_sasm_list, qrange)
 
         return self.qrange_I
 
@@ -1724,14 +2270,14 @@ class SECM(object):
         self.subtracted_sasm_list = list(sub_sasm_list)
         self.use_subtracted_sasm = list(use_sub_sasm)
 
-        self.mean_i_sub = np.array([sasm.getMeanI() for sasm in sub_sasm_list])
-        self.total_i_sub = np.array([sasm.getTotalI() for sasm in sub_sasm_list])
+        (self.mean_i_sub, self.total_i_sub, I_of_q_sub,
+            qrange_I_sub) = self._calcIntensities('sub', self.subtracted_sasm_list)
 
         if self.qref>0:
-            self.I_of_q_sub = np.array([sasm.getIofQ(self.qref) for sasm in sub_sasm_list])
+            self.I_of_q_sub = I_of_q_sub
 
-        if self.qrange != (0,0):
-            self.qrange_I_sub = np.array([sasm.getIofQRange(self.qrange[0], self.qrange[1]) for sasm in sub_sasm_list])
+        if tuple(self.qrange) != (0,0):
+            self.qrange_I_sub = qrange_I_sub
 
     def appendSubtractedSASMs(self, sub_sasm_list, use_sasm_list, window_size):
         """
@@ -1758,18 +2304,19 @@ class SECM(object):
         self.subtracted_sasm_list = self.subtracted_sasm_list[:-window_size] + sub_sasm_list
         self.use_subtracted_sasm = self.use_subtracted_sasm[:-window_size] + use_sasm_list
 
+        mean_i_sub, total_i_sub, I_of_q_sub, qrange_I_sub = self._calcIntensities(
+            'sub', self.subtracted_sasm_list, len(self.subtracted_sasm_list)-len(sub_sasm_list))
+
         self.mean_i_sub = np.concatenate((self.mean_i_sub[:-window_size],
-            np.array([sasm.getMeanI() for sasm in sub_sasm_list])))
+            mean_i_sub))
         self.total_i_sub = np.concatenate((self.total_i_sub[:-window_size],
-            np.array([sasm.getTotalI() for sasm in sub_sasm_list])))
+            total_i_sub))
 
         if self.qref>0:
-            I_of_q_sub = np.array([sasm.getIofQ(self.qref) for sasm in sub_sasm_list])
             self.I_of_q_sub = np.concatenate((self.I_of_q_sub[:-window_size],
                 I_of_q_sub))
 
-        if self.qrange != (0,0):
-            qrange_I_sub = np.array([sasm.getIofQRange(self.qrange[0], self.qrange[1]) for sasm in sub_sasm_list])
+        if tuple(self.qrange) != (0,0):
             self.qrange_I_sub = np.concatenate((self.qrange_I_sub[:-window_size],
                 qrange_I_sub))
 
@@ -1795,14 +2342,14 @@ class SECM(object):
         self.baseline_subtracted_sasm_list = list(sub_sasm_list)
         self.use_baseline_subtracted_sasm = list(use_sub_sasm)
 
-        self.mean_i_bcsub = np.array([sasm.getMeanI() for sasm in sub_sasm_list])
-        self.total_i_bcsub = np.array([sasm.getTotalI() for sasm in sub_sasm_list])
+        (self.mean_i_bcsub, self.total_i_bcsub, I_of_q_bcsub,
+            qrange_I_bcsub) = self._calcIntensities('baseline', self.baseline_subtracted_sasm_list)
 
         if self.qref>0:
-            self.I_of_q_bcsub = np.array([sasm.getIofQ(self.qref) for sasm in sub_sasm_list])
+            self.I_of_q_bcsub = I_of_q_bcsub
 
-        if self.qrange != (0,0):
-            self.qrange_I_bcsub = np.array([sasm.getIofQRange(self.qrange[0], self.qrange[1]) for sasm in sub_sasm_list])
+        if tuple(self.qrange) != (0,0):
+            self.qrange_I_bcsub = qrange_I_bcsub
 
     def appendBCSubtractedSASMs(self, sub_sasm_list, use_sasm_list, window_size):
         """
@@ -1830,17 +2377,18 @@ class SECM(object):
         self.baseline_subtracted_sasm_list = self.baseline_subtracted_sasm_list[:-window_size] + sub_sasm_list
         self.use_baseline_subtracted_sasm = self.use_baseline_subtracted_sasm[:-window_size] + use_sasm_list
 
+        mean_i_bcsub, total_i_bcsub, I_of_q_bcsub, qrange_I_bcsub = self._calcIntensities(
+            'baseline', self.baseline_subtracted_sasm_list, len(self.baseline_subtracted_sasm_list)-len(sub_sasm_list))
+
         self.mean_i_bcsub = np.concatenate((self.mean_i_bcsub[:-window_size],
-            np.array([sasm.getMeanI() for sasm in sub_sasm_list])))
+            mean_i_bcsub))
         self.total_i_bcsub = np.concatenate((self.total_i_bcsub[:-window_size],
-            np.array([sasm.getTotalI() for sasm in sub_sasm_list])))
+            total_i_bcsub))
 
         if self.qref>0:
-            I_of_q_bcsub = np.array([sasm.getIofQ(self.qref) for sasm in sub_sasm_list])
             self.I_of_q_bcsub = np.concatenate((self.I_of_q_bcsub[:-window_size],
                 I_of_q_bcsub))
 
-        if self.qrange != (0,0):
-            qrange_I_bcsub = np.array([sasm.getIofQRange(self.qrange[0], self.qrange[1]) for sasm in sub_sasm_list])
+        if tuple(self.qrange) != (0,0):
             self.qrange_I_bcsub = np.concatenate((self.qrange_I_bcsub[:-window_size],
                 qrange_I_bcsub))